@@ -157,6 +157,16 @@ async def get_announcements(last_id: Optional[str] = None) -> Optional[str]:
                                 f"Received announcement: {current_event.model_dump()}"
                             )
                             await current_event.to_csv()
+                            # solving a new beacon takes a moment, keep the event loop free
+                            try:
+                                await asyncio.to_thread(
+                                    state_planner.update_ebt_estimate, current_event
+                                )
+                            except Exception as e:
+                                # the event is still kept, and the subscription goes on
+                                logger.error(
+                                    f"Could not update the EBT estimate with {current_event}: {e!r}"
+                                )
                             state_planner.recent_events.append(current_event)
                             last_id = str(current_event.id)
         except TimeoutError:
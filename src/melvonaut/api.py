@@ -6,6 +6,7 @@ from io import StringIO, BytesIO
 from aiohttp.web_response import ContentCoding
 from typing import Callable, Any, Awaitable
 from melvonaut import utils
+from melvonaut.state_planer import state_planner
 from shared import constants as con
 from loguru import logger
 import asyncio
@@ -610,6 +611,22 @@ async def get_all_settings(request: web.Request) -> web.Response:
     return web.json_response(all_settings, status=200)
 
 
+async def get_ebt_estimates(request: web.Request) -> web.Response:
+    """Retrieves the current position estimate of every beacon pinged so far.
+
+    Args:
+        request (web.Request): The incoming HTTP request.
+
+    Returns:
+        web.Response: JSON response with a list of estimates, ordered by beacon id.
+    """
+    logger.debug("Getting EBT estimates")
+    estimator = await asyncio.to_thread(state_planner.get_ebt_estimator)
+    return web.json_response(
+        [estimate.model_dump() for estimate in estimator.estimates()], status=200
+    )
+
+
 def setup_routes(app: web.Application) -> None:
     """Sets up API routes for the web application.
 
@@ -627,6 +644,7 @@ def setup_routes(app: web.Application) -> None:
     app.router.add_post("/api/post_clear_log", post_clear_log)
     app.router.add_post("/api/post_get_setting", post_get_setting)
     app.router.add_get("/api/get_all_settings", get_all_settings)
+    app.router.add_get("/api/get_ebt_estimates", get_ebt_estimates)
     app.router.add_post("/api/post_download_log_and_clear", post_download_log_and_clear)
     app.router.add_get(
         "/api/get_download_telemetry_and_clear", get_download_telemetry_and_clear
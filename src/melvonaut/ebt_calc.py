@@ -1,22 +1,22 @@
 import os
+import re
 import sys
 import math
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
 from loguru import logger
+from pydantic import BaseModel
 
 import shared.constants as con
 from melvonaut.settings import settings
 from shared.models import Event, Ping
 
+import numpy as np
 import matplotlib.pyplot as plt
 from matplotlib.lines import Line2D
 import matplotlib.patches as patches
 
-##### LOGGING #####
-logger.remove()
-logger.add(
-    sink=sys.stderr, level=settings.FILE_LOGGING_LEVEL, backtrace=True, diagnose=True
-)
-
 # [CONSTANTS]
 scaling_factor = 1
 x_0 = 0
@@ -24,6 +24,20 @@ y_0 = 0
 x_max = int(con.WORLD_X / scaling_factor)
 y_max = int(con.WORLD_Y / scaling_factor)
 max_offset = 325
+# find_matches_dense checks this many columns of the candidate grid at once, so large maxd does not need much memory
+block_size = 256
+# find_matches splits the candidate square into cells down to this side length, only the remaining cells are
+# checked point by point, at most cells_per_chunk at once
+leaf_size = 16
+cells_per_chunk = 4096
+# most_likely_position: spacing of the grid over the whole world, the best cell is refined pixel by pixel
+likelihood_step = 50
+# share of pings that are assumed to be outliers, their distance can be anything
+outlier_probability = 0.1
+# posterior probability that the beacon is inside of the confidence radius
+confidence_level = 0.9
+# solve_all solves this many beacons at the same time
+batch_workers = 4
 
 
 # [HELPER]
@@ -81,6 +95,66 @@ def distance(x1: int, x2: int, y1: int, y2: int) -> float:
     # return math.sqrt((x2 - x1) ** 2 + (y2 - y1) ** 2)
 
 
+def _normalize(values: np.ndarray, world: int) -> np.ndarray:
+    """Same wraparound as in distance, values outside of the world are moved in, world itself is kept."""
+    return np.where((values < 0) | (values > world), values % world, values)
+
+
+def _axis_squares(
+    start: int, values: np.ndarray, world: int
+) -> tuple[np.ndarray, np.ndarray]:
+    """Squared difference on one axis, once direct and once with wraparound, as integers."""
+    diff = _normalize(np.asarray(values, dtype=np.int64), world) - _normalize(
+        np.asarray(start, dtype=np.int64), world
+    )
+    direct = diff**2
+    return direct, np.minimum(
+        np.minimum(direct, (world + diff) ** 2), (diff - world) ** 2
+    )
+
+
+def squared_distances(x1: int, y1: int, x2: np.ndarray, y2: np.ndarray) -> np.ndarray:
+    """
+    Computes the squared distance from one point to many points at once, with the same wraparound as distance.
+
+    Args:
+        x1 (int): X-coordinate of the first point.
+        y1 (int): Y-coordinate of the first point.
+        x2 (np.ndarray): X-coordinates of the other points.
+        y2 (np.ndarray): Y-coordinates of the other points.
+
+    Returns:
+        np.ndarray: The squared Euclidean distance to each of the other points, as integers.
+    """
+    dx, dx_wrapped = _axis_squares(x1, x2, con.WORLD_X)
+    dy, dy_wrapped = _axis_squares(y1, y2, con.WORLD_Y)
+    # like distance, only wraps around in x or in y, never both
+    squared: np.ndarray = np.minimum(dx_wrapped + dy, dx + dy_wrapped)
+    return squared
+
+
+def distances(x1: int, y1: int, x2: np.ndarray, y2: np.ndarray) -> np.ndarray:
+    """Same as distance, for many points at once, see squared_distances."""
+    return np.sqrt(squared_distances(x1, y1, x2, y2))
+
+
+def _in_ring(squared: np.ndarray, mind: int, maxd: int, strict: bool) -> np.ndarray:
+    """
+    Checks mind < dist < maxd (or with <= if not strict) on squared integer distances, without a sqrt.
+
+    For integers this gives the same result as comparing the distance, a negative mind is always met.
+    """
+    if maxd < 0:
+        return np.zeros(squared.shape, dtype=bool)
+    inside = squared < maxd**2 if strict else squared <= maxd**2
+    if mind >= 0:
+        inside &= squared > mind**2 if strict else squared >= mind**2
+    return inside
+
+
+ebt_event_regex = re.compile(r"GALILEO_MSG_EB,ID_(\d+),DISTANCE_")
+
+
 def parse_pings(id: int, events: list[Event]) -> list[Ping]:
     """
     Parses event data to extract relevant ping information.
@@ -95,64 +169,521 @@ def parse_pings(id: int, events: list[Event]) -> list[Ping]:
     processed = []
     for event in events:
         if f"GALILEO_MSG_EB,ID_{id},DISTANCE_" in event.event:
-            (d, x, y) = event.easy_parse()
-            s = Ping(
-                x=int(x / scaling_factor),
-                y=int(y / scaling_factor),
-                d=d / scaling_factor,
-                mind=int((d - f(d)) / scaling_factor),
-                maxd=int((d + f(d)) / scaling_factor),
-            )
-            processed.append(s)
+            processed.append(_ping_from_event(event))
     return processed
 
 
-def find_matches(pings: list[Ping]) -> list[tuple[int, int]]:
+def _ping_from_event(event: Event) -> Ping:
+    """Ping of one GALILEO_MSG_EB announcement, with the distance bounds from f."""
+    (d, x, y) = event.easy_parse()
+    return Ping(
+        x=int(x / scaling_factor),
+        y=int(y / scaling_factor),
+        d=d / scaling_factor,
+        mind=int((d - f(d)) / scaling_factor),
+        maxd=int((d + f(d)) / scaling_factor),
+    )
+
+
+def group_pings(events: list[Event]) -> dict[int, list[Ping]]:
     """
-    Identifies matching points from the given pings based on distance constraints.
+    Parses the pings of all beacons in one pass over the events.
+
+    Args:
+        events (list[Event]): List of event objects to be processed.
+
+    Returns:
+        dict[int, list[Ping]]: Pings by beacon id, ordered by id, each list like parse_pings gives it.
+    """
+    grouped: dict[int, list[Ping]] = {}
+    for event in events:
+        match = ebt_event_regex.search(event.event)
+        if match:
+            grouped.setdefault(int(match.group(1)), []).append(_ping_from_event(event))
+    return {id: grouped[id] for id in sorted(grouped)}
+
+
+def find_matches_dense(pings: list[Ping]) -> np.ndarray:
+    """
+    Identifies matching points from the given pings based on distance constraints, see find_matches.
+
+    All integer points in the square around the ping with the smallest maxd are checked at once with
+    numpy, a block of columns at a time. Points outside of its ring are dropped first, the remaining ones
+    are checked against every ping.
 
     Args:
         pings (list[Ping]): List of Ping objects to process.
 
     Returns:
-        list[tuple[int, int]]: List of coordinate pairs that satisfy all constraints.
+        np.ndarray: Coordinate pairs that satisfy all constraints, shape (n, 2), ordered by x and then y.
     """
+    if not pings:
+        logger.warning("No pings given, can not match any points.")
+        return np.empty((0, 2), dtype=np.int64)
+
     # Procssed first point
-    res = []
     p1 = min(pings, key=lambda p: p.maxd)
-    for x in range(p1.x - p1.maxd, p1.x + p1.maxd):
-        for y in range(p1.y - p1.maxd, p1.y + p1.maxd):
-            if x > x_0 and x < x_max and y > y_0 and y < y_max:
-                dist = distance(p1.x, x, p1.y, y)
-                if dist > p1.mind and dist < p1.maxd:
-                    res.append((x, y))
-    logger.info(f"Found {len(res)} possible points on first circle.")
-
-    # Only keep the ones that are in all circles
-    filtered_res = []
-    for x, y in res:
-        is_valid = True
+    xs = np.arange(max(p1.x - p1.maxd, x_0 + 1), min(p1.x + p1.maxd, x_max))
+    ys = np.arange(max(p1.y - p1.maxd, y_0 + 1), min(p1.y + p1.maxd, y_max))
+    # the squared distance of a grid point is a sum of one term per axis
+    dx, dx_wrapped = _axis_squares(p1.x, xs, con.WORLD_X)
+    dy, dy_wrapped = _axis_squares(p1.y, ys, con.WORLD_Y)
+
+    first_circle = 0
+    blocks = []
+    for start in range(0, len(xs), block_size):
+        end = start + block_size
+        squared = np.minimum(
+            dx_wrapped[start:end, None] + dy[None, :],
+            dx[start:end, None] + dy_wrapped[None, :],
+        )
+        columns, rows = np.nonzero(_in_ring(squared, p1.mind, p1.maxd, strict=True))
+        grid_x, grid_y = xs[start + columns], ys[rows]
+        first_circle += len(grid_x)
+
+        # Only keep the ones that are in all circles
+        for pn in pings:
+            squared = squared_distances(pn.x, pn.y, grid_x, grid_y)
+            inside = _in_ring(squared, pn.mind, pn.maxd, strict=False)
+            grid_x, grid_y = grid_x[inside], grid_y[inside]
+        blocks.append(np.column_stack((grid_x, grid_y)))
+    logger.info(f"Found {first_circle} possible points on first circle.")
+
+    res = np.concatenate(blocks) if blocks else np.empty((0, 2), dtype=np.int64)
+    logger.info(f"Found {len(res)} points that match all pings.")
+    return res
+
+
+def _cell_bounds(
+    ping: Ping, x1: np.ndarray, y1: np.ndarray, x2: np.ndarray, y2: np.ndarray
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Bounds of the squared distance between a ping and the points of many cells, with the wraparound of distance.
+
+    Args:
+        ping (Ping): Ping to measure from.
+        x1 (np.ndarray): Left edges of the cells.
+        y1 (np.ndarray): Upper edges of the cells.
+        x2 (np.ndarray): Right edges of the cells, inclusive.
+        y2 (np.ndarray): Lower edges of the cells, inclusive.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: Smallest squared distance to each cell and an upper bound of the largest.
+    """
+    px = int(_normalize(np.asarray(ping.x), con.WORLD_X))
+    py = int(_normalize(np.asarray(ping.y), con.WORLD_Y))
+    lower: np.ndarray = np.full(x1.shape, np.iinfo(np.int64).max)
+    upper: np.ndarray = np.full(x1.shape, np.iinfo(np.int64).max)
+    # distance is the smallest distance to the ping or to one of its copies shifted by the world size
+    for cx, cy in (
+        (px, py),
+        (px - con.WORLD_X, py),
+        (px + con.WORLD_X, py),
+        (px, py - con.WORLD_Y),
+        (px, py + con.WORLD_Y),
+    ):
+        gap_x = np.maximum(np.maximum(x1 - cx, cx - x2), 0)
+        gap_y = np.maximum(np.maximum(y1 - cy, cy - y2), 0)
+        lower = np.minimum(lower, gap_x**2 + gap_y**2)
+        span_x = np.maximum(np.abs(cx - x1), np.abs(cx - x2))
+        span_y = np.maximum(np.abs(cy - y1), np.abs(cy - y2))
+        upper = np.minimum(upper, span_x**2 + span_y**2)
+    return lower, upper
+
+
+def find_matches(pings: list[Ping]) -> np.ndarray:
+    """
+    Identifies matching points from the given pings based on distance constraints.
+
+    Gives the same points as find_matches_dense, but does not check the whole square around the ping with the
+    smallest maxd. The square is split into cells like a quadtree, a cell is dropped as soon as it lies
+    completely outside of the outer circle or completely inside of the inner circle of any ping. Only the
+    points in the remaining cells of leaf_size are checked one by one, so the work follows the size of the
+    area that matches all pings and not the size of the largest ring.
+
+    Args:
+        pings (list[Ping]): List of Ping objects to process.
+
+    Returns:
+        np.ndarray: Coordinate pairs that satisfy all constraints, shape (n, 2), ordered by x and then y.
+    """
+    if not pings:
+        logger.warning("No pings given, can not match any points.")
+        return np.empty((0, 2), dtype=np.int64)
+
+    # candidates are the points inside the world around the ping with the smallest maxd, upper bounds exclusive
+    p1 = min(pings, key=lambda p: p.maxd)
+    x_low, x_high = max(p1.x - p1.maxd, x_0 + 1), min(p1.x + p1.maxd, x_max)
+    y_low, y_high = max(p1.y - p1.maxd, y_0 + 1), min(p1.y + p1.maxd, y_max)
+    if x_low >= x_high or y_low >= y_high:
+        logger.info("Found 0 points that match all pings.")
+        return np.empty((0, 2), dtype=np.int64)
+
+    size = leaf_size
+    while size < max(x_high - x_low, y_high - y_low):
+        size *= 2
+    cells_x = np.array([x_low], dtype=np.int64)
+    cells_y = np.array([y_low], dtype=np.int64)
+    while True:
+        keep = np.ones(len(cells_x), dtype=bool)
         for pn in pings:
-            dist = distance(pn.x, x, pn.y, y)
-            if dist < pn.mind or dist > pn.maxd:
-                is_valid = False
+            if pn.maxd < 0:
+                keep[:] = False
                 break
-        if is_valid:
-            filtered_res.append((x, y))
+            lower, upper = _cell_bounds(
+                pn,
+                cells_x,
+                cells_y,
+                np.minimum(cells_x + size, x_high) - 1,
+                np.minimum(cells_y + size, y_high) - 1,
+            )
+            # outside of the outer circle or inside of the inner circle
+            keep &= lower <= pn.maxd**2
+            if pn.mind > 0:
+                keep &= upper >= pn.mind**2
+        cells_x, cells_y = cells_x[keep], cells_y[keep]
+        if size <= leaf_size or len(cells_x) == 0:
+            break
+        # split each cell into four, the ones outside of the square are dropped
+        size //= 2
+        cells_x = np.concatenate([cells_x, cells_x + size, cells_x, cells_x + size])
+        cells_y = np.concatenate([cells_y, cells_y, cells_y + size, cells_y + size])
+        inside = (cells_x < x_high) & (cells_y < y_high)
+        cells_x, cells_y = cells_x[inside], cells_y[inside]
+    logger.info(
+        f"Found {len(cells_x)} cells of {size}x{size} that can match all pings."
+    )
+
+    offsets = np.arange(size)
+    blocks = []
+    for start in range(0, len(cells_x), cells_per_chunk):
+        grid_x = (
+            cells_x[start : start + cells_per_chunk, None, None]
+            + offsets[None, :, None]
+        )
+        grid_y = (
+            cells_y[start : start + cells_per_chunk, None, None]
+            + offsets[None, None, :]
+        )
+        grid_x, grid_y = np.broadcast_arrays(grid_x, grid_y)
+        inside = (grid_x < x_high) & (grid_y < y_high)
+        grid_x, grid_y = grid_x[inside], grid_y[inside]
+
+        squared = squared_distances(p1.x, p1.y, grid_x, grid_y)
+        inside = _in_ring(squared, p1.mind, p1.maxd, strict=True)
+        grid_x, grid_y = grid_x[inside], grid_y[inside]
+        for pn in pings:
+            squared = squared_distances(pn.x, pn.y, grid_x, grid_y)
+            inside = _in_ring(squared, pn.mind, pn.maxd, strict=False)
+            grid_x, grid_y = grid_x[inside], grid_y[inside]
+        blocks.append(np.column_stack((grid_x, grid_y)))
 
-    logger.info(f"Found {len(filtered_res)} points that match all pings.")
-    return filtered_res
+    res = np.concatenate(blocks) if blocks else np.empty((0, 2), dtype=np.int64)
+    # same order as find_matches_dense
+    res = res[np.lexsort((res[:, 1], res[:, 0]))]
+    logger.info(f"Found {len(res)} points that match all pings.")
+    return res
+
+
+def log_likelihood(pings: list[Ping], x: np.ndarray, y: np.ndarray) -> np.ndarray:
+    """
+    Computes how well each point explains all pings, as a sum of logarithms.
+
+    The measured distance of a ping is normal around the true distance, with mind and maxd two standard
+    deviations away. With outlier_probability, a ping can be any distance up to half the world diagonal
+    instead, so one bad ping lowers the likelihood everywhere by about the same amount and does not rule out
+    the right position like the hard rings in find_matches do.
+
+    Args:
+        pings (list[Ping]): List of Ping objects to process.
+        x (np.ndarray): X-coordinates of the points.
+        y (np.ndarray): Y-coordinates of the points.
+
+    Returns:
+        np.ndarray: Log-likelihood of each point, up to a constant.
+    """
+    outlier = math.log(outlier_probability / math.hypot(x_max / 2, y_max / 2))
+    total = np.zeros(np.shape(x))
+    for pn in pings:
+        sigma = max((pn.maxd - pn.mind) / 4, 1)
+        dist = distances(pn.x, pn.y, x, y)
+        inlier = math.log(
+            (1 - outlier_probability) / (sigma * math.sqrt(2 * math.pi))
+        ) - (dist - pn.d) ** 2 / (2 * sigma**2)
+        total += np.logaddexp(inlier, outlier)
+    return total
+
+
+def most_likely_position(pings: list[Ping]) -> Optional[tuple[int, int, float]]:
+    """
+    Estimates the beacon position from all pings at once, also when some of them are outliers.
+
+    The log_likelihood is evaluated on a grid over the whole world with likelihood_step spacing, the best
+    cell is then refined on every pixel around it. The confidence radius around the best position holds
+    confidence_level of the posterior on the coarse grid, it is large while the pings still allow several
+    positions.
+
+    Args:
+        pings (list[Ping]): List of Ping objects to process.
+
+    Returns:
+        Optional[tuple[int, int, float]]: Best position and confidence radius, None if there are no pings.
+    """
+    if not pings:
+        logger.warning("No pings given, can not estimate a position.")
+        return None
+
+    axis_x = np.arange(x_0 + likelihood_step // 2, x_max, likelihood_step)
+    axis_y = np.arange(y_0 + likelihood_step // 2, y_max, likelihood_step)
+    grid_x, grid_y = (
+        axis.ravel() for axis in np.meshgrid(axis_x, axis_y, indexing="ij")
+    )
+    coarse = log_likelihood(pings, grid_x, grid_y)
+    best = int(np.argmax(coarse))
+
+    # every pixel of the cells around the best one
+    fine_x, fine_y = (
+        axis.ravel()
+        for axis in np.meshgrid(
+            np.arange(
+                max(grid_x[best] - likelihood_step, x_0 + 1),
+                min(grid_x[best] + likelihood_step, x_max),
+            ),
+            np.arange(
+                max(grid_y[best] - likelihood_step, y_0 + 1),
+                min(grid_y[best] + likelihood_step, y_max),
+            ),
+            indexing="ij",
+        )
+    )
+    fine_best = int(np.argmax(log_likelihood(pings, fine_x, fine_y)))
+    x, y = int(fine_x[fine_best]), int(fine_y[fine_best])
+
+    posterior = np.exp(coarse - coarse.max())
+    posterior /= posterior.sum()
+    dist = distances(x, y, grid_x, grid_y)
+    order = np.argsort(dist)
+    inside = int(np.searchsorted(np.cumsum(posterior[order]), confidence_level))
+    radius = max(float(dist[order[min(inside, len(order) - 1)]]), likelihood_step / 2)
+
+    logger.info(
+        f"Most likely position is ({x}, {y}), within {radius:.0f} with {confidence_level:.0%} confidence."
+    )
+    return (x, y, radius)
+
+
+class BeaconEstimate(BaseModel):
+    """Current guess for the position of one beacon."""
+
+    id: int
+    pings: int
+    candidates: int
+    # centroid of the candidates, None if no point matches all pings
+    x: Optional[float] = None
+    y: Optional[float] = None
+    # root mean square distance of the candidates to the centroid
+    uncertainty: Optional[float] = None
+    # most_likely_position, also available when one of the pings is an outlier
+    likely_x: Optional[int] = None
+    likely_y: Optional[int] = None
+    confidence_radius: Optional[float] = None
+
+
+def _summarize(id: int, pings: list[Ping], candidates: np.ndarray) -> BeaconEstimate:
+    """Estimate of a beacon from its pings and the points that match all of them."""
+    estimate = BeaconEstimate(id=id, pings=len(pings), candidates=len(candidates))
+    if len(candidates):
+        centroid = candidates.mean(axis=0)
+        estimate.x, estimate.y = float(centroid[0]), float(centroid[1])
+        estimate.uncertainty = float(
+            np.sqrt(((candidates - centroid) ** 2).sum(axis=1).mean())
+        )
+    likely = most_likely_position(pings)
+    if likely:
+        estimate.likely_x, estimate.likely_y, estimate.confidence_radius = likely
+    return estimate
+
+
+def solve_beacon(id: int, pings: list[Ping]) -> BeaconEstimate:
+    """
+    Solves one beacon from scratch, with find_matches and most_likely_position.
+
+    Args:
+        id (int): Identifier of the beacon.
+        pings (list[Ping]): All pings of the beacon.
+
+    Returns:
+        BeaconEstimate: Estimate of the beacon.
+    """
+    return _summarize(id, pings, find_matches(pings))
+
+
+def solve_all(
+    events: list[Event], workers: int = batch_workers
+) -> list[BeaconEstimate]:
+    """
+    Solves every beacon in the events, the events are only parsed once.
+
+    The beacons are solved at the same time in a pool of threads, numpy does not hold the GIL while
+    it computes the distances.
+
+    Args:
+        events (list[Event]): Event log, e.g. from Event.load_events_from_csv.
+        workers (int): Number of beacons solved at the same time.
+
+    Returns:
+        list[BeaconEstimate]: Estimate of each beacon, ordered by id.
+    """
+    grouped = group_pings(events)
+    if not grouped:
+        logger.warning("No pings in the events, no beacons to solve.")
+        return []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        estimates = list(pool.map(solve_beacon, grouped.keys(), grouped.values()))
+    logger.info(
+        f"Solved {len(estimates)} beacons from {sum(len(p) for p in grouped.values())} pings."
+    )
+    return estimates
+
+
+def _usable_ping(event: Event) -> Optional[tuple[int, Ping]]:
+    """Beacon id and ping of an announcement, None if it is no ping or the ping can not be used."""
+    match = ebt_event_regex.search(event.event)
+    if not match:
+        return None
+    if event.current_x is None or event.current_y is None:
+        logger.warning(f"Ping without a position is not used: {event}")
+        return None
+    try:
+        ping = _ping_from_event(event)
+    except (IndexError, ValueError) as e:
+        logger.warning(f"Ping that can not be parsed is not used: {event}, {e!r}")
+        return None
+    return int(match.group(1)), ping
+
+
+class EbtEstimator:
+    """
+    Keeps the points that match all pings of each beacon and narrows them down with every new ping.
+
+    The candidates of a beacon are the same points find_matches gives for all of its pings. The first ping
+    and every ping with a smaller maxd than the ones before start over with find_matches, since the square
+    around the smallest ring changes. Every other ping only drops the candidates outside of its ring, which
+    is fast since the candidates get fewer with every ping.
+    """
+
+    def __init__(self) -> None:
+        self._pings: dict[int, list[Ping]] = {}
+        self._candidates: dict[int, np.ndarray] = {}
+        self._estimates: dict[int, BeaconEstimate] = {}
+        # events arrive in the event loop, the api reads from another thread
+        self._lock = threading.Lock()
+
+    def add_ping(self, id: int, ping: Ping) -> BeaconEstimate:
+        """
+        Narrows down the candidates of a beacon with a new ping.
+
+        Args:
+            id (int): Identifier of the beacon.
+            ping (Ping): New ping of the beacon.
+
+        Returns:
+            BeaconEstimate: Updated estimate of the beacon.
+        """
+        with self._lock:
+            pings = self._pings.setdefault(id, [])
+            candidates = self._candidates.get(id)
+            if candidates is None or ping.maxd < min(p.maxd for p in pings):
+                pings.append(ping)
+                candidates = find_matches(pings).astype(np.int32)
+            else:
+                pings.append(ping)
+                squared = squared_distances(
+                    ping.x, ping.y, candidates[:, 0], candidates[:, 1]
+                )
+                candidates = candidates[
+                    _in_ring(squared, ping.mind, ping.maxd, strict=False)
+                ]
+            self._candidates[id] = candidates
+            estimate = _summarize(id, pings, candidates)
+            self._estimates[id] = estimate
+        logger.info(
+            f"EBT {id}: {estimate.candidates} candidates after {estimate.pings} pings, "
+            f"centroid ({estimate.x}, {estimate.y}), uncertainty {estimate.uncertainty}"
+        )
+        return estimate
+
+    def add_event(self, event: Event) -> Optional[BeaconEstimate]:
+        """
+        Adds the ping of an event, other announcements are ignored.
+
+        Args:
+            event (Event): Announcement received by Melvonaut.
+
+        Returns:
+            Optional[BeaconEstimate]: Updated estimate of the beacon, None if the event is not a usable ping.
+        """
+        usable = _usable_ping(event)
+        if usable is None:
+            return None
+        return self.add_ping(*usable)
+
+    def seed(self, events: list[Event]) -> None:
+        """
+        Adds the pings of an event log at once, with one find_matches per beacon instead of one per ping.
+
+        Pings that arrive later are added with add_event. A beacon that can not be solved is left out.
+
+        Args:
+            events (list[Event]): Event log, e.g. recent_events of the StatePlanner.
+        """
+        grouped: dict[int, list[Ping]] = {}
+        for event in events:
+            usable = _usable_ping(event)
+            if usable is not None:
+                grouped.setdefault(usable[0], []).append(usable[1])
+        for id in sorted(grouped):
+            with self._lock:
+                pings = self._pings.get(id, []) + grouped[id]
+            try:
+                candidates = find_matches(pings).astype(np.int32)
+                estimate = _summarize(id, pings, candidates)
+            except Exception as e:
+                logger.warning(f"EBT {id}: could not solve {len(pings)} pings, {e!r}")
+                continue
+            with self._lock:
+                self._pings[id] = pings
+                self._candidates[id] = candidates
+                self._estimates[id] = estimate
+        logger.info(
+            f"Seeded EBT estimates of {len(self._estimates)} beacons from {len(events)} events"
+        )
+
+    def estimate(self, id: int) -> Optional[BeaconEstimate]:
+        """Current estimate of a beacon, None if it has no pings yet."""
+        with self._lock:
+            return self._estimates.get(id)
+
+    def estimates(self) -> list[BeaconEstimate]:
+        """Current estimates of all beacons, ordered by id."""
+        with self._lock:
+            return [self._estimates[id] for id in sorted(self._estimates)]
+
+    def candidates(self, id: int) -> np.ndarray:
+        """Points that match all pings of a beacon so far, shape (n, 2)."""
+        with self._lock:
+            return self._candidates.get(id, np.empty((0, 2), dtype=np.int32))
 
 
 def draw_res(
-    id: int, res: list[tuple[int, int]], pings: list[Ping], show: bool = False
+    id: int, res: np.ndarray, pings: list[Ping], show: bool = False
 ) -> tuple[int, int]:
     """
     Draws and saves a visualization of the computed emergency beacon locations.
 
     Args:
         id (int): Identifier for the emergency beacon tracker.
-        res (list[tuple[int, int]]): List of matched coordinate points.
+        res (np.ndarray): Matched coordinate points from find_matches.
         pings (list[Ping]): List of Ping objects representing detected signals.
         show (bool, optional): Whether to display the plot. Defaults to False.
 
@@ -160,27 +691,22 @@ def draw_res(
         tuple[int, int]: The estimated centroid of the matched points, or (-1, -1) if no matches were found.
     """
 
-    def find_centroid(points: list[tuple[int, int]]) -> tuple[float, float]:
+    def find_centroid(points: np.ndarray) -> tuple[float, float]:
         """
         Computes the centroid of a set of points.
 
         Args:
-            points (list[tuple[int, int]]): List of coordinate points.
+            points (np.ndarray): Coordinate points, shape (n, 2).
 
         Returns:
             tuple[float, float]: The centroid coordinates.
         """
-        xs, ys = zip(*points)
-        centroid_x = sum(xs) / len(xs)
-        centroid_y = sum(ys) / len(ys)
-        return (centroid_x, centroid_y)
+        centroid_x, centroid_y = points.mean(axis=0)
+        return (float(centroid_x), float(centroid_y))
 
-    x_list, y_list = [], []
-    for x, y in res:
-        x_list.append(x)
-        y_list.append(y)
+    x_list, y_list = res[:, 0], res[:, 1]
 
-    if res:
+    if len(res):
         centroid = find_centroid(res)
 
     plt.style.use("bmh")
@@ -235,7 +761,7 @@ def draw_res(
         edgecolor="blue", facecolor="none", linewidth=1, label="Maximum Distance"
     )
 
-    if res:
+    if len(res):
         # plot centroid
         circle_guess = patches.Circle(
             (centroid[0], centroid[1]),
@@ -269,7 +795,7 @@ def draw_res(
         )
 
     if show:
-        if res:
+        if len(res):
             logger.info(f"Centroid is: ({int(centroid[0])},{int(centroid[1])})")
         else:
             logger.warning("Could not match any points!")
@@ -283,13 +809,24 @@ def draw_res(
             space = "_" + str(count)
             path = con.CONSOLE_EBT_PATH + f"EBT_{id}_{len(pings)}{space}.png"
         plt.savefig(path, dpi=1000)
-    if res:
+    if len(res):
         return (int(centroid[0]), int(centroid[1]))
     else:
         return (-1, -1)
 
+
 # for local testing purposes
 if __name__ == "__main__":
+    ##### LOGGING #####
+    # only when run from cli, Melvonaut and the console set up their own logging when importing this module
+    logger.remove()
+    logger.add(
+        sink=sys.stderr,
+        level=settings.FILE_LOGGING_LEVEL,
+        backtrace=True,
+        diagnose=True,
+    )
+
     # Open idea: use midpoint circle algorithm? -> not used for now
     logger.info("Running from cli.")
 
@@ -331,6 +868,7 @@ if __name__ == "__main__":
 
     if len(res) == 0:
         logger.error("No Matches Found!")
+        most_likely_position(pings=processed)
         exit()
 
     draw_res(id=id, res=res, pings=processed, show=True)
@@ -3,15 +3,17 @@ import asyncio
 import subprocess
 import datetime
 import math
+import threading
 import tracemalloc
 from typing import Optional, Any
 from aiofile import async_open
 import aiohttp
-from pydantic import BaseModel
+from pydantic import BaseModel, PrivateAttr
 
 import shared.constants as con
 from melvonaut.settings import settings
 from melvonaut.mel_telemetry import MelTelemetry
+from melvonaut.ebt_calc import BeaconEstimate, EbtEstimator
 from shared.models import (
     CameraAngle,
     MELVINTask,
@@ -57,6 +59,10 @@ class StatePlanner(BaseModel):
 
     _current_obj_name: str = ""
 
+    _ebt_estimator: Optional[EbtEstimator] = None
+    # get_ebt_estimator is called from the threads of asyncio.to_thread
+    _ebt_lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+
     def model_post_init(self, __context__: Any) -> None:
         """Initializes the recent_events list by loading events from a CSV file.
 
@@ -65,6 +71,32 @@ class StatePlanner(BaseModel):
         """
         self.recent_events = Event.load_events_from_csv(path=con.EVENT_LOCATION_CSV)
 
+    def get_ebt_estimator(self) -> EbtEstimator:
+        """Retrieves the EBT estimator, on first use it is filled with the pings in recent_events.
+
+        Returns:
+            EbtEstimator: Estimator with the pings of all beacons so far.
+        """
+        with self._ebt_lock:
+            if self._ebt_estimator is None:
+                estimator = EbtEstimator()
+                estimator.seed(self.recent_events)
+                self._ebt_estimator = estimator
+            return self._ebt_estimator
+
+    def update_ebt_estimate(self, event: Event) -> Optional[BeaconEstimate]:
+        """Adds a received announcement to the EBT estimator.
+
+        Call this before appending the event to recent_events, otherwise it is counted twice.
+
+        Args:
+            event (Event): The received announcement.
+
+        Returns:
+            Optional[BeaconEstimate]: Updated estimate if the event is a beacon ping, otherwise None.
+        """
+        return self.get_ebt_estimator().add_event(event)
+
     def get_current_state(self) -> State:
         """Retrieves the current state from telemetry data.
 
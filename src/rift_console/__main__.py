@@ -1,10 +1,8 @@
 """Command-line interface."""
 
-from collections import defaultdict
 import csv
+import json
 from pathlib import Path
-import pathlib
-import re
 import sys
 import datetime
 import os
@@ -20,7 +18,10 @@ from quart import (
     url_for,
     request,
     flash,
+    jsonify,
+    abort,
 )
+from quart.wrappers import Response as QuartResponse
 from werkzeug.wrappers.response import Response
 from hypercorn.config import Config
 import asyncio
@@ -28,9 +29,14 @@ from hypercorn.asyncio import serve
 
 # shared imports
 from melvonaut import ebt_calc
-from rift_console.image_helper import filter_by_date, get_angle, get_date
+from rift_console.image_catalog import console_catalog
+from rift_console.image_helper import (
+    get_angle,
+    parse_image_name,
+)
 import rift_console.rift_console
 import shared.constants as con
+from shared.coverage import CoverageIndex
 from shared.models import (
     Event,
     State,
@@ -40,6 +46,9 @@ from shared.models import (
     live_utc,
 )
 import rift_console.image_processing
+from rift_console.panorama import PYRAMID_INDEX
+from rift_console.job_manager import JobManager
+from rift_console.stitching_job import JobStatus, StitchingJob
 import rift_console.ciarc_api as ciarc_api
 import rift_console.melvin_api as melvin_api
 
@@ -62,6 +71,7 @@ app.config["live"] = con.CONSOLE_LIVE_PATH
 app.config["stitched"] = con.CONSOLE_STICHED_PATH
 app.config["downloaded"] = con.CONSOLE_DOWNLOAD_PATH
 console = rift_console.rift_console.RiftConsole()
+jobs = JobManager()
 
 # [Routes]
 @app.route("/view_ebt")
@@ -105,6 +115,14 @@ async def stitches() -> str:
     worldmap = sum("worldmap" in i for i in images)
     zoned = sum("zoned" in i for i in images)
     hidden = sum("hidden" in i for i in images)
+    # panoramas that can be viewed zoomable
+    pyramids = []
+    if os.path.isdir(con.CONSOLE_TILES_PATH):
+        pyramids = sorted(
+            name
+            for name in os.listdir(con.CONSOLE_TILES_PATH)
+            if os.path.isfile(os.path.join(con.CONSOLE_TILES_PATH, name, PYRAMID_INDEX))
+        )
     logger.warning(f"Showing {count} stitched images.")
     # logger.info(f"Images: {images}")
     return await render_template(
@@ -114,35 +132,43 @@ async def stitches() -> str:
         worldMap=worldmap,
         zoned=zoned,
         hidden=hidden,
+        pyramids=pyramids,
     )
 
+@app.route("/tiles/<name>")
+async def tiles(name: str) -> str:
+    """Zoomable viewer for the tile pyramid of a stitched panorama."""
+    try:
+        with open(os.path.join(con.CONSOLE_TILES_PATH, name, PYRAMID_INDEX), "r") as f:
+            pyramid = json.load(f)
+    except FileNotFoundError:
+        abort(404)
+    return await render_template("tiles.html", name=name, pyramid=pyramid)
+
+
 @app.route("/downloads")
 async def downloads() -> str:
     """Show donwloaded indiviual images from melvonaut."""
-    images = get_console_images()
-
-    # sort by timestamp
-    images.sort(
-        key=lambda x: get_date(x),
-        reverse=True,
+    catalog = console_catalog()
+    catalog.sync(con.CONSOLE_DOWNLOAD_PATH, source="melvonaut")
+    # newest first, only take first CONSOLE_IMAGE_VIEWER_LIMIT
+    entries = catalog.entries(
+        con.CONSOLE_DOWNLOAD_PATH,
+        newest_first=True,
+        limit=con.CONSOLE_IMAGE_VIEWER_LIMIT,
     )
 
-    # only take first CONSOLE_IMAGE_VIEWER_LIMIT
-    images = images[: con.CONSOLE_IMAGE_VIEWER_LIMIT]
-
     # find the dates of each image
-    dates = set()
-    for image in images:
-        dates.add(get_date(image)[:10])
-    dates_list = list(dates)
-    dates_list.sort(reverse=True)
+    dates_list = sorted({timestamp[:10] for _, timestamp, _ in entries}, reverse=True)
 
-    image_tupel = [(image, get_date(image)[:10], get_angle(image)) for image in images]
+    image_tupel = [
+        (image, timestamp[:10], angle) for image, timestamp, angle in entries
+    ]
 
-    count = len(images)
-    narrow = sum(CameraAngle.Narrow in i for i in images)
-    normal = sum(CameraAngle.Normal in i for i in images)
-    wide = sum(CameraAngle.Wide in i for i in images)
+    count = len(entries)
+    narrow = sum(angle == CameraAngle.Narrow for _, _, angle in entries)
+    normal = sum(angle == CameraAngle.Normal for _, _, angle in entries)
+    wide = sum(angle == CameraAngle.Wide for _, _, angle in entries)
     logger.warning(
         f"Showing {len(image_tupel)} images, from {len(dates_list)} different dates."
     )
@@ -238,10 +264,13 @@ async def index() -> str:
             melvonaut_image_count=console.melvonaut_image_count,
             console_image_count=console.console_image_count,
             console_image_dates=console.console_image_dates,
+            lens_coverage=console.get_lens_coverage(),
+            zoned_coverage=console.get_zoned_coverage(),
             melvin_task=console.melvin_task,
             melvin_lens=console.melvin_lens,
             # ebt ping list
             ebt_ping_list=console.ebt_ping_list,
+            ebt_estimates=console.ebt_estimates,
         )
     else:
         return await render_template(
@@ -275,10 +304,13 @@ async def index() -> str:
             melvonaut_image_count=console.melvonaut_image_count,
             console_image_count=console.console_image_count,
             console_image_dates=console.console_image_dates,
+            lens_coverage=console.get_lens_coverage(),
+            zoned_coverage=console.get_zoned_coverage(),
             melvin_task=console.melvin_task,
             melvin_lens=console.melvin_lens,
             # ebt ping list
             ebt_ping_list=console.ebt_ping_list,
+            ebt_estimates=console.ebt_estimates,
         )
 
 
@@ -350,6 +382,9 @@ async def melvonaut_api() -> Response:
                             "wb",
                         ) as f:
                             f.write(r.content)
+                        console_catalog().add(
+                            con.CONSOLE_DOWNLOAD_PATH, image, source="melvonaut"
+                        )
                         success += 1
                         logger.info(f'Downloaded "{image}" success!')
                     else:
@@ -364,9 +399,8 @@ async def melvonaut_api() -> Response:
             else:
                 await flash("Could not contact Melvonaut API - count.")
 
-            folder = pathlib.Path(con.CONSOLE_DOWNLOAD_PATH)
-            console.console_image_count = sum(
-                file.is_file() for file in folder.rglob("*.png")
+            console.console_image_count = console_catalog().count(
+                con.CONSOLE_DOWNLOAD_PATH
             )
         case "clear":
             if melvin_api.clear_images():
@@ -408,9 +442,8 @@ async def melvonaut_api() -> Response:
             else:
                 await flash("Could not contact Melvonaut API - count.")
 
-            folder = pathlib.Path(con.CONSOLE_DOWNLOAD_PATH)
-            console.console_image_count = sum(
-                file.is_file() for file in folder.rglob("*.png")
+            console.console_image_count = console_catalog().count(
+                con.CONSOLE_DOWNLOAD_PATH
             )
         case "clear_logs":
             if melvin_api.clear_logs():
@@ -483,21 +516,10 @@ async def results() -> Response:
             )
             console.console_found_events = events
             await flash(f"Loading file {con.CONSOLE_FROM_MELVONAUT_PATH + files[0]}.")
-            found_ids = set()
-            ping_count: dict[int, int] = defaultdict(int)
-            total_pings = 0
-            pattern = r"GALILEO_MSG_EB,ID_(\d+),DISTANCE_"
-            for event in events:
-                match = re.search(pattern, event.event)
-                if match:
-                    matched_id = int(match.group(1))
-                    found_ids.add(matched_id)
-                    ping_count[matched_id] += 1
-                    total_pings += 1
-            ids_list = list(found_ids)
-            ids_list.sort()
-
-            console.ebt_ping_list = [(id, ping_count[id]) for id in ids_list]
+            grouped = ebt_calc.group_pings(events)
+            total_pings = sum(len(pings) for pings in grouped.values())
+
+            console.ebt_ping_list = [(id, len(pings)) for id, pings in grouped.items()]
             await info(
                 f"Log contained {total_pings} pings of {len(console.ebt_ping_list)} different events."
             )
@@ -585,6 +607,29 @@ async def results() -> Response:
             await flash(
                 f"For EBT_{id} found {len(res)} points that are matched by {len(pings)} pings. Centoid is: ({x},{y})"
             )
+            # tolerates outliers, so there is a guess even if no point matches all pings
+            likely = ebt_calc.most_likely_position(pings=pings)
+            if likely:
+                await flash(
+                    f"Most likely position is ({likely[0]},{likely[1]}), within {likely[2]:.0f} with {ebt_calc.confidence_level:.0%} confidence."
+                )
+
+        case "calc_all_ebt":
+            if not console.console_found_events:
+                await warning(
+                    "Tried to calculate all ebt but no events loaded, aborting."
+                )
+                return redirect(url_for("index"))
+            job_id = jobs.submit(
+                "ebt",
+                f"all beacons in {len(console.console_found_events)} events",
+                ebt_calc.solve_all,
+                console.console_found_events,
+                on_done=ebt_solved,
+            )
+            await warning(
+                f"Queued solving of {len(console.ebt_ping_list)} beacons as job {job_id}, reload for the results."
+            )
 
         case "stitch":
             choose_date = form.get("choose_date", type=str)
@@ -592,19 +637,23 @@ async def results() -> Response:
                 await warning("Tried to stitch worldmap but no date given, aborting.")
                 return redirect(url_for("index"))
 
-            images = get_console_images()
-            filtered_images = []
-            for image in images:
-                if choose_date in image:
-                    filtered_images.append(image)
+            catalog = console_catalog()
+            day = datetime.datetime.fromisoformat(choose_date)
+            filtered_images = catalog.names(
+                con.CONSOLE_DOWNLOAD_PATH,
+                start=day,
+                end=day + datetime.timedelta(days=1, seconds=-1),
+            )
             await warning(
-                f"Starting stitching, found {len(images)} images and {len(filtered_images)} with right day."
+                f"Starting stitching, found {catalog.count(con.CONSOLE_DOWNLOAD_PATH)} images and {len(filtered_images)} with right day."
             )
-            asyncio.create_task(
-                async_world_map(
-                    filtered_images=filtered_images, choose_date=choose_date
-                )
+            await async_world_map(
+                filtered_images=filtered_images, choose_date=choose_date
             )
+        case "update_worldmap":
+            await async_update_world_map()
+        case "resume_jobs":
+            await async_resume_jobs()
         case "stitch_area":
             start = datetime.datetime.fromisoformat(
                 form.get("start_stitch", type=str) or "2025-01-01T00:00"
@@ -624,17 +673,12 @@ async def results() -> Response:
 
             await check_images()
 
-            folder = pathlib.Path(con.CONSOLE_DOWNLOAD_PATH)
-            images = [str(file) for file in folder.rglob("*.png") if file.is_file()]
-
-            filtered_images = []
-            for image in images:
-                if optic_required in image:
-                    filtered_images.append(image)
-
-            final_images = filter_by_date(images=filtered_images, start=start, end=end)
+            catalog = console_catalog()
+            final_images = catalog.names(
+                con.CONSOLE_DOWNLOAD_PATH, angle=optic_required, start=start, end=end
+            )
 
-            message = f"{len(filtered_images)} have right lens of which {len(final_images)} are in time window."
+            message = f"{catalog.count(con.CONSOLE_DOWNLOAD_PATH, optic_required)} have right lens of which {len(final_images)} are in time window."
             logger.warning(message)
             await flash(message)
 
@@ -643,20 +687,6 @@ async def results() -> Response:
                 await flash("Aborting since 0 images")
                 return redirect(url_for("index"))
 
-            final_images = [image.split("/")[-1] for image in final_images]
-
-            panorama = rift_console.image_processing.stitch_images(
-                image_path=con.CONSOLE_DOWNLOAD_PATH, image_name_list=final_images
-            )
-
-            remove_offset = (
-                con.STITCHING_BORDER,
-                con.STITCHING_BORDER,
-                con.WORLD_X + con.STITCHING_BORDER,
-                con.WORLD_Y + con.STITCHING_BORDER,
-            )
-            panorama = panorama.crop(remove_offset)
-
             space = ""
             count = 0
             path = f"{con.CONSOLE_STICHED_PATH}hidden_{optic_required}_{zone[0]}_{zone[1]}_{zone[2]}_{zone[3]}_{len(final_images)}_{space}.png"
@@ -665,16 +695,16 @@ async def results() -> Response:
                 space = "_" + str(count)
                 path = f"{con.CONSOLE_STICHED_PATH}hidden_{optic_required}_{zone[0]}_{zone[1]}_{zone[2]}_{zone[3]}_{len(final_images)}_{space}.png"
 
-            panorama.save(path)
-
-            rift_console.image_processing.create_thumbnail(path)
-
-            rift_console.image_processing.cut(
-                panorama_path=path, X1=zone[0], Y1=zone[1], X2=zone[2], Y2=zone[3]
+            job = StitchingJob.create(
+                image_path=con.CONSOLE_DOWNLOAD_PATH,
+                image_name_list=final_images,
+                output_path=path,
+                zone=zone,
             )
+            jobs.submit_stitching(job, on_done=stitching_done)
 
             await warning(
-                f"Saved stitch of {optic_required}_{zone[0]}_{zone[1]}_{zone[2]}_{zone[3]} - {len(final_images)} images to {path}"
+                f"Queued stitch of {optic_required}_{zone[0]}_{zone[1]}_{zone[2]}_{zone[3]} - {len(final_images)} images to {path} as job {job.job_id}"
             )
 
         case _:
@@ -869,27 +899,23 @@ async def stitch_obj(obj_id: int) -> Response:
         return redirect(url_for("index"))
     await check_images()
 
-    folder = pathlib.Path(con.CONSOLE_DOWNLOAD_PATH)
-    images = [str(file) for file in folder.rglob("*.png") if file.is_file()]
-
-    filtered_images = []
-    for image in images:
-        if res_obj.optic_required in image:
-            filtered_images.append(image)
-
-    final_images = filter_by_date(
-        images=filtered_images, start=res_obj.start, end=res_obj.end
+    catalog = console_catalog()
+    final_images = catalog.names(
+        con.CONSOLE_DOWNLOAD_PATH,
+        angle=res_obj.optic_required,
+        start=res_obj.start,
+        end=res_obj.end,
     )
 
-    message = f"{len(filtered_images)} have right lens of which {len(final_images)} are in time window."
+    message = f"{catalog.count(con.CONSOLE_DOWNLOAD_PATH, res_obj.optic_required)} have right lens of which {len(final_images)} are in time window."
     await warning(message)
 
     if len(final_images) == 0:
         await warning("Aborting since 0 images")
         return redirect(url_for("index"))
 
-    # run this in background
-    asyncio.create_task(async_stitching(res_obj=res_obj, final_images=final_images))
+    # runs in the background, the handler returns once the job is queued
+    await async_stitching(res_obj=res_obj, final_images=final_images)
 
     return redirect(url_for("index"))
 
@@ -1079,20 +1105,10 @@ async def warning(mes: str) -> None:
     await flash(mes)
 
 async def async_stitching(res_obj: ZonedObjective, final_images: list[str]) -> None:
-    """Tried to outsource stitching to another thread, so main thread already returns, but not completed."""
-    final_images = [image.split("/")[-1] for image in final_images]
-
-    panorama = rift_console.image_processing.stitch_images(
-        image_path=con.CONSOLE_DOWNLOAD_PATH, image_name_list=final_images
-    )
-
-    remove_offset = (
-        con.STITCHING_BORDER,
-        con.STITCHING_BORDER,
-        con.WORLD_X + con.STITCHING_BORDER,
-        con.WORLD_Y + con.STITCHING_BORDER,
-    )
-    panorama = panorama.crop(remove_offset)
+    """Queues stitching of a zoned objective in the JobManager, returns without waiting for it."""
+    if not res_obj.zone:
+        await warning(f"{res_obj} has no zone, can not stitch, aborting!")
+        return
 
     space = ""
     count = 0
@@ -1104,41 +1120,22 @@ async def async_stitching(res_obj: ZonedObjective, final_images: list[str]) -> N
         space = "_" + str(count)
         path = f"{con.CONSOLE_STICHED_PATH}zoned_{len(final_images)}_{res_obj.name}{space}.png"
 
-    panorama.save(path)
-    rift_console.image_processing.create_thumbnail(path)
-
-    if not res_obj.zone:
-        await warning(f"{res_obj} has no zone, can not stitch, aborting!")
-        return
-
-    rift_console.image_processing.cut(
-        panorama_path=path,
-        X1=res_obj.zone[0],
-        Y1=res_obj.zone[1],
-        X2=res_obj.zone[2],
-        Y2=res_obj.zone[3],
+    job = StitchingJob.create(
+        image_path=con.CONSOLE_DOWNLOAD_PATH,
+        image_name_list=final_images,
+        output_path=path,
+        zone=res_obj.zone,
     )
+    jobs.submit_stitching(job, on_done=stitching_done)
 
     await warning(
-        f"Saved stitch of {res_obj.name} - {len(final_images)} images to {path}"
+        f"Queued stitch of {res_obj.name} - {len(final_images)} images to {path} as job {job.job_id}"
     )
 
 
 
 async def async_world_map(filtered_images: list[str], choose_date: str) -> None:
-    """Tried to outsource stitching to another thread, so main thread already returns, but not completed."""
-    panorama = rift_console.image_processing.stitch_images(
-        image_path=con.CONSOLE_DOWNLOAD_PATH, image_name_list=filtered_images
-    )
-
-    remove_offset = (
-        con.STITCHING_BORDER,
-        con.STITCHING_BORDER,
-        con.WORLD_X + con.STITCHING_BORDER,
-        con.WORLD_Y + con.STITCHING_BORDER,
-    )
-    panorama = panorama.crop(remove_offset)
-
+    """Queues stitching of a world map in the JobManager, returns without waiting for it."""
     space = ""
     count = 0
     path = f"{con.CONSOLE_STICHED_PATH}worldmap_{len(filtered_images)}_{choose_date}{space}.png"
@@ -1147,39 +1144,108 @@ async def async_world_map(filtered_images: list[str], choose_date: str) -> None:
         space = "_" + str(count)
         path = f"{con.CONSOLE_STICHED_PATH}worldmap_{choose_date}{space}.png"
 
-    panorama.save(path)
+    # world maps are large, the pyramid lets the browser zoom into them
+    job = StitchingJob.create(
+        image_path=con.CONSOLE_DOWNLOAD_PATH,
+        image_name_list=filtered_images,
+        output_path=path,
+        tile_pyramid=True,
+    )
+    jobs.submit_stitching(job, on_done=stitching_done)
 
-    rift_console.image_processing.create_thumbnail(path)
+    await warning(
+        f"Queued {choose_date} panorama of {len(filtered_images)} images to {path} as job {job.job_id}"
+    )
 
+async def async_update_world_map() -> None:
+    """Queues adding all downloaded images that are not yet on the persisted world map."""
+    path = f"{con.CONSOLE_STICHED_PATH}worldmap_latest.png"
+    job_id = jobs.submit(
+        "worldmap",
+        f"new images -> {path}",
+        rift_console.image_processing.update_world_map,
+        con.CONSOLE_DOWNLOAD_PATH,
+        path,
+        on_done=lambda counts: logger.warning(
+            f"Updated world map with {counts[0]} new of {counts[1]} images, saved to {path}"
+        ),
+    )
     await warning(
-        f"Saved {choose_date} panorama of {len(filtered_images)} images to {path}"
+        f"Queued update of the world map as job {job_id}, only new images are stitched."
     )
 
+async def async_resume_jobs() -> None:
+    """Queues stitching jobs that were interrupted, e.g. by a restart of the console."""
+    resumed = []
+    for job in StitchingJob.list_jobs():
+        if job.status not in (JobStatus.Pending, JobStatus.Running):
+            continue
+        if jobs.status(job.job_id) is not None:
+            # already queued by this console
+            continue
+        resumed.append(jobs.submit_stitching(job, on_done=stitching_done))
+    await warning(f"Queued {len(resumed)} unfinished stitching jobs: {resumed}")
+
+
+def ebt_solved(estimates: list[ebt_calc.BeaconEstimate]) -> None:
+    """Called by the JobManager in the event loop once all beacons are solved, keeps the table for the index page."""
+    console.ebt_estimates = estimates
+    logger.warning(f"Solved {len(estimates)} beacons")
+
+
+def stitching_done(job: StitchingJob) -> None:
+    """Called by the JobManager in the event loop once a stitching job ended, adds the images it placed to the coverage index."""
+    if job.status != JobStatus.Done:
+        logger.warning(f"Stitching job {job.job_id} ended as {job.status}")
+        return
+    if os.path.isfile(job.coverage_path):
+        console.coverage.merge(CoverageIndex(job.coverage_path))
+        console.coverage.save()
+
+    message = f"Saved stitch of {job.placed_count} images to {job.output_path}"
+    if job.zone:
+        message += f", zone is {job.zone_coverage or 0:.1%} covered"
+    logger.warning(message)
+
 async def check_images() -> None:
-    """Sorts downloaded images on console and saves them by date."""
-    folder = pathlib.Path(con.CONSOLE_DOWNLOAD_PATH)
-    console.console_image_count = sum(file.is_file() for file in folder.rglob("*.png"))
-    dates = set()
-    date_counts: dict[str, int] = defaultdict(int)
-    for image in folder.rglob("*.png"):
-        dates.add(get_date(image.name)[:10])
-        date_counts[get_date(image.name)[:10]] += 1
-    dates_list = list(dates)
-    dates_list.sort(reverse=True)
-    console.console_image_dates = [(date, date_counts[date]) for date in dates_list]
+    """Adds new downloaded images to the image catalog and counts them by date."""
+    catalog = console_catalog()
+    added: list[str] = []
+    catalog.sync(con.CONSOLE_DOWNLOAD_PATH, source="melvonaut", added=added)
+    console.console_image_count = catalog.count(con.CONSOLE_DOWNLOAD_PATH)
+    console.console_image_dates = catalog.dates(con.CONSOLE_DOWNLOAD_PATH)
 
     await info(
         f"Counted {console.console_image_count} images on console from {len(console.console_image_dates)} different dates."
     )
 
-def get_console_images() -> list[str]:
-    """Count donwloaded images."""
-    # list all images
-    images = os.listdir(con.CONSOLE_DOWNLOAD_PATH)
-    # filter to only png
-    images = [s for s in images if s.endswith(".png")]
+    # downloaded images count as covered at their position, a new index starts with all of them
+    if os.path.isfile(con.CONSOLE_COVERAGE_LOCATION):
+        covered = [(get_angle(name), *parse_image_name(name)[1:]) for name in added]
+    else:
+        covered = [
+            (angle, x, y)
+            for _, angle, x, y in catalog.positions(con.CONSOLE_DOWNLOAD_PATH)
+        ]
+    if covered:
+        for angle, x, y in covered:
+            console.coverage.add_image(angle, x, y)
+        console.coverage.save()
+
+
+# [Background jobs]
+# polled by the main page
+@app.route("/jobs")
+async def list_jobs() -> QuartResponse:
+    """Status and progress of all background jobs as json."""
+    return jsonify([info.model_dump(mode="json") for info in jobs.list_jobs()])
+
+
+@app.route("/jobs/<job_id>/cancel", methods=["POST"])
+async def cancel_job(job_id: str) -> QuartResponse:
+    """Cancels a queued or running background job."""
+    return jsonify({"job_id": job_id, "cancelled": jobs.cancel(job_id)})
 
-    return images
 
 # [Helper for image viewer]
 # called inside html-template to match filename to location
@@ -1197,6 +1263,11 @@ async def uploaded_file_ebt(filename):  # type: ignore
     return await send_from_directory(con.CONSOLE_EBT_PATH, filename)
 
 
+@app.route(f"/{con.CONSOLE_TILES_PATH}/<path:filename>")
+async def uploaded_file_tiles(filename):  # type: ignore
+    return await send_from_directory(con.CONSOLE_TILES_PATH, filename)
+
+
 @click.group()
 @click.version_option()
 def main() -> None:
@@ -0,0 +1,202 @@
+"""
+
+Global alignment of images: the offsets between overlapping images are measured pair by pair and all
+positions are solved together in one least-squares problem, so errors do not add up along the stitching order.
+
+"""
+
+import functools
+from typing import Optional
+
+import numpy as np
+from loguru import logger
+from PIL import Image
+
+import shared.constants as con
+from rift_console.image_cache import ImageCache, decode_image
+from rift_console.image_index import ImageIndex
+from rift_console.image_processing import fft_registration
+
+# first image, second image, measured offset of the second image in x and y, weight
+Edge = tuple[int, int, int, int, float]
+
+
+def _wrapped_delta(start: int, other_start: int, world: int) -> int:
+    """Shortest distance from start to other_start on an axis that wraps around after world pixels."""
+    return (other_start - start + world // 2) % world - world // 2
+
+
+def pairwise_offsets(
+    image_path: str,
+    index: ImageIndex,
+    max_offset: int,
+    image_cache: Optional[ImageCache] = None,
+) -> list[Edge]:
+    """Measures how far each image is off its name position, relative to every image it overlaps.
+
+    For each pair from index.pairs, the first image is put on an empty canvas around the second image and
+    the second image is registered on it with fft_registration. Only the overlap is compared, since the rest
+    of the canvas is transparent.
+
+    Args:
+        image_path (str): folder of the images
+        index (ImageIndex): images to measure
+        max_offset (int): largest offset in each direction
+        image_cache (Optional[ImageCache]): if given, decoded images are read from and added to it
+
+    Returns:
+        list[Edge]: pairs with a confidence of at least FFT_MIN_CONFIDENCE, weighted by their confidence
+    """
+
+    # pairs are sorted by their first image, so few images are decoded twice
+    @functools.lru_cache(maxsize=con.ALIGNMENT_LOADED_IMAGES)
+    def load(image: int) -> Optional[Image.Image]:
+        path = image_path + index.name(image)
+        lens_size = index.footprint(image)[2]
+        try:
+            if image_cache:
+                return image_cache.load(path, lens_size)
+            return decode_image(path, lens_size)
+        except OSError as e:
+            logger.warning(
+                f"Could not parse file {index.name(image)}, not aligned. Error: {e}"
+            )
+            return None
+
+    edges: list[Edge] = []
+    pairs = index.pairs(con.ALIGNMENT_MIN_OVERLAP)
+    for first, second in pairs:
+        first_img = load(first)
+        second_img = load(second)
+        if first_img is None or second_img is None:
+            continue
+
+        x1, y1, _ = index.footprint(first)
+        x2, y2, lens_size = index.footprint(second)
+        canvas = Image.new(
+            "RGBA", (lens_size + 2 * max_offset, lens_size + 2 * max_offset)
+        )
+        canvas.paste(
+            first_img,
+            (
+                max_offset + _wrapped_delta(x2, x1, con.WORLD_X),
+                max_offset + _wrapped_delta(y2, y1, con.WORLD_Y),
+            ),
+        )
+        offset, confidence = fft_registration(
+            first_img=second_img, second_img=canvas, max_offset=max_offset
+        )
+        if confidence < con.FFT_MIN_CONFIDENCE:
+            logger.debug(
+                f"Pair {index.name(first)} {index.name(second)} not used, confidence: {confidence:.3f}"
+            )
+            continue
+        edges.append((first, second, offset[0], offset[1], confidence))
+    load.cache_clear()
+
+    logger.info(f"Measured {len(edges)} of {len(pairs)} overlapping pairs")
+    return edges
+
+
+def solve_corrections(
+    count: int,
+    edges: list[Edge],
+    prior_weight: float = con.ALIGNMENT_PRIOR_WEIGHT,
+    tolerance: float = 1e-6,
+) -> np.ndarray:
+    """Corrections of the image positions that agree best with all measured offsets.
+
+    Minimizes sum(weight * |c[second] - c[first] - offset|^2) + prior_weight * sum(|c|^2). The prior keeps
+    images without measurements in place and fixes the position of each group of connected images, on
+    average they stay at their name positions. The normal equations are a weighted graph Laplacian, which is
+    solved with a Jacobi preconditioned conjugate gradient on the edge list, for x and y at once.
+
+    Args:
+        count (int): number of images
+        edges (list[Edge]): measured offsets, e.g. from pairwise_offsets
+        prior_weight (float): weight of the name position of each image, must be larger than 0
+        tolerance (float): stop when the residual is this small relative to the right side
+
+    Returns:
+        np.ndarray: correction in x and y of each image, shape (count, 2)
+    """
+    corrections = np.zeros((count, 2))
+    if not edges:
+        return corrections
+
+    first = np.array([edge[0] for edge in edges])
+    second = np.array([edge[1] for edge in edges])
+    measured = np.array([(edge[2], edge[3]) for edge in edges], dtype=np.float64)
+    weight = np.array([edge[4] for edge in edges])[:, np.newaxis]
+
+    def normal_matrix(values: np.ndarray) -> np.ndarray:
+        weighted = weight * (values[second] - values[first])
+        result = prior_weight * values
+        np.add.at(result, second, weighted)
+        np.add.at(result, first, -weighted)
+        return result
+
+    right = np.zeros((count, 2))
+    np.add.at(right, second, weight * measured)
+    np.add.at(right, first, -weight * measured)
+    diagonal = np.full(count, prior_weight)
+    np.add.at(diagonal, first, weight[:, 0])
+    np.add.at(diagonal, second, weight[:, 0])
+    diagonal = diagonal[:, np.newaxis]
+
+    # x and y are independent problems with the same matrix, all sums are per column
+    residual = right.copy()
+    preconditioned = residual / diagonal
+    direction = preconditioned.copy()
+    rho = (residual * preconditioned).sum(axis=0)
+    limit = tolerance * np.linalg.norm(right, axis=0)
+    for iteration in range(10 * count):
+        if np.all(np.linalg.norm(residual, axis=0) <= limit):
+            break
+        product = normal_matrix(direction)
+        curvature = (direction * product).sum(axis=0)
+        step = np.divide(rho, curvature, out=np.zeros(2), where=curvature > 0)
+        corrections += step * direction
+        residual -= step * product
+        preconditioned = residual / diagonal
+        new_rho = (residual * preconditioned).sum(axis=0)
+        direction = (
+            preconditioned
+            + np.divide(new_rho, rho, out=np.zeros(2), where=rho > 0) * direction
+        )
+        rho = new_rho
+    logger.debug(f"Solved {count} image positions in {iteration} iterations")
+    return corrections
+
+
+def align_images(
+    image_path: str,
+    image_name_list: list[str],
+    max_offset: int,
+    image_cache: Optional[ImageCache] = None,
+) -> dict[str, tuple[int, int]]:
+    """Offset of each image from the position in its name, consistent over all overlapping images.
+
+    Args:
+        image_path (str): folder of the images
+        image_name_list (list[str]): images to align, names in another format are left out
+        max_offset (int): largest offset in each direction between two images
+        image_cache (Optional[ImageCache]): if given, decoded images are read from and added to it
+
+    Returns:
+        dict[str, tuple[int, int]]: offset in x and y by image name
+    """
+    index = ImageIndex(image_name_list)
+    edges = pairwise_offsets(image_path, index, max_offset, image_cache)
+    corrections = np.rint(solve_corrections(len(index), edges)).astype(int)
+
+    if edges:
+        # how far the images moved, like max_offset_database for the other modes
+        moved = np.abs(corrections).max(axis=1)
+        logger.info(
+            f"Aligned {len(index)} images, moved {np.count_nonzero(moved)}, up to {moved.max()} pixels"
+        )
+    return {
+        index.name(image): (int(dx), int(dy))
+        for image, (dx, dy) in enumerate(corrections)
+    }
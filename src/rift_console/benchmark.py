@@ -0,0 +1,504 @@
+"""
+
+Reproducible benchmarks of the stitching pipeline on synthetic images with known positions.
+
+Run with `make benchmark` or `python -m rift_console.benchmark --help`, results are stored as json in
+con.CONSOLE_BENCHMARK_PATH and can be compared between commits with --compare.
+
+"""
+
+import datetime
+import json
+import math
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from typing import Any, Optional
+
+import click
+import numpy as np
+from loguru import logger
+from PIL import Image
+
+import shared.constants as con
+from shared.models import CameraAngle, lens_size_by_angle
+
+NUDGING_MODES = ("none", "grid", "fft", "pyramid", "global")
+REFERENCE_FILE = "reference.png"
+
+
+def synthetic_world(width: int, height: int, seed: int = 0) -> np.ndarray:
+    """Smooth random landscape with fine detail on top, so every offset of an image looks different.
+
+    Returns:
+        np.ndarray: uint8 RGB array of shape (height, width, 3)
+    """
+    rng = np.random.default_rng(seed)
+    coarse = rng.integers(
+        0, 256, size=(max(2, height // 50), max(2, width // 50), 3), dtype=np.uint8
+    )
+    world = np.asarray(
+        Image.fromarray(coarse).resize((width, height), Image.Resampling.BICUBIC),
+        dtype=np.int16,
+    )
+    world = world + rng.integers(-20, 21, size=world.shape, dtype=np.int16)
+    return np.clip(world, 0, 255).astype(np.uint8)
+
+
+def generate_tiles(
+    directory: str,
+    count: int,
+    reference: Optional[str] = None,
+    angle: CameraAngle = CameraAngle.Narrow,
+    overlap: float = 0.4,
+    name_error: int = 5,
+    noise: float = 2.0,
+    seed: int = 0,
+) -> tuple[dict[str, tuple[int, int]], tuple[int, int]]:
+    """Cuts images in a grid out of a reference world and saves them with the names Melvonaut uses.
+
+    The position in each name is off by up to name_error pixels, like the real positions of Melvonaut, and
+    each image gets its own gaussian noise. The world is stored as REFERENCE_FILE next to directory.
+
+    Args:
+        directory (str): output folder for the images, created if needed
+        count (int): number of images
+        reference (Optional[str]): image that is scaled to the world size, a synthetic_world if not given
+        angle (CameraAngle): lens of all images
+        overlap (float): share of each image that overlaps with its neighbours
+        name_error (int): largest error of the name position in each direction
+        noise (float): standard deviation of the noise in each color channel
+        seed (int): seed of all random numbers
+
+    Returns:
+        tuple: true world position of each image by name (in stitching order) and the world size
+    """
+    rng = np.random.default_rng(seed)
+    lens_size = lens_size_by_angle(angle)
+    columns = math.ceil(math.sqrt(count))
+    rows = math.ceil(count / columns)
+    step = round(lens_size * (1 - overlap))
+    # the margin keeps all name positions inside the world
+    margin = name_error
+    width = 2 * margin + step * (columns - 1) + lens_size
+    height = 2 * margin + step * (rows - 1) + lens_size
+
+    if reference:
+        with Image.open(reference) as img:
+            world = np.asarray(
+                img.convert("RGB").resize((width, height), Image.Resampling.LANCZOS)
+            )
+    else:
+        world = synthetic_world(width, height, seed)
+
+    os.makedirs(directory, exist_ok=True)
+    Image.fromarray(world).save(
+        os.path.join(os.path.dirname(os.path.normpath(directory)), REFERENCE_FILE)
+    )
+
+    start = datetime.datetime(2025, 1, 1)
+    truth: dict[str, tuple[int, int]] = {}
+    for index in range(count):
+        x = margin + (index % columns) * step
+        y = margin + (index // columns) * step
+        name_x = x + int(rng.integers(-name_error, name_error + 1))
+        name_y = y + int(rng.integers(-name_error, name_error + 1))
+        # old images have the center in their name
+        if con.USE_LEGACY_IMAGE_NAMES:
+            name_x += lens_size // 2
+            name_y += lens_size // 2
+
+        pixels = world[y : y + lens_size, x : x + lens_size].astype(np.float64)
+        pixels += rng.normal(0, noise, size=pixels.shape)
+        timestamp = (start + datetime.timedelta(seconds=index)).isoformat(
+            timespec="microseconds"
+        )
+        name = f"image_{index}_{angle.value}_{timestamp}_x_{name_x}_y_{name_y}.png"
+        Image.fromarray(np.clip(np.rint(pixels), 0, 255).astype(np.uint8)).save(
+            os.path.join(directory, name)
+        )
+        truth[name] = (x, y)
+    return truth, (width, height)
+
+
+def peak_rss_mb() -> float:
+    """Highest resident memory of this process so far in MB."""
+    # kilobytes on Linux, bytes on macOS
+    scale = 1024 * 1024 if platform.system() == "Darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+
+
+def case_settings(
+    world_size: tuple[int, int], mode: str, workers: int, work_dir: str, count: int
+) -> dict[str, Any]:
+    """Constants of shared.constants for one case of run_case, see _init_case_worker.
+
+    Args:
+        world_size (tuple[int, int]): world size from generate_tiles
+        mode (str): "none" for no nudging, otherwise an IMAGE_NUDGING_MODE
+        workers (int): NUMBER_OF_WORKER_THREADS for the "grid" search
+        work_dir (str): folder for temporary canvases and blend buffers
+        count (int): number of images, no step is saved while they are stitched
+
+    Returns:
+        dict[str, Any]: values by name of the constant
+    """
+    return {
+        "WORLD_X": world_size[0],
+        "WORLD_Y": world_size[1],
+        "DO_IMAGE_NUDGING_SEARCH": mode != "none",
+        "IMAGE_NUDGING_MODE": mode if mode != "none" else con.IMAGE_NUDGING_MODE,
+        "NUMBER_OF_WORKER_THREADS": workers,
+        "STITCHING_REGION_WORKERS": 1,
+        "SAVE_PANORAMA_STEP": count + 1,
+        "CONSOLE_PANORAMA_PATH": work_dir + "/",
+    }
+
+
+def _init_case_worker(values: dict[str, Any]) -> None:
+    """Sets the constants of a case before rift_console is imported, so default arguments see them too.
+
+    Only warnings are logged while a case runs, logging every image would be measured too.
+    """
+    for name, value in values.items():
+        setattr(con, name, value)
+    # image_processing sets up its own logger when it is imported
+    import rift_console.image_processing  # noqa: F401
+
+    logger.remove()
+    logger.add(sink=sys.stderr, level="WARNING")
+
+
+def run_case_process(
+    image_path: str,
+    truth: dict[str, tuple[int, int]],
+    world_size: tuple[int, int],
+    mode: str,
+    workers: int = 1,
+) -> dict[str, Any]:
+    """Runs run_case in a new process with the constants from case_settings, arguments as for run_case.
+
+    A new process per case, so peak memory is not shared between cases and no constant of this process
+    is changed.
+    """
+    work_dir = tempfile.mkdtemp(prefix="benchmark_")
+    try:
+        with ProcessPoolExecutor(
+            max_workers=1,
+            mp_context=get_context("spawn"),
+            initializer=_init_case_worker,
+            initargs=(case_settings(world_size, mode, workers, work_dir, len(truth)),),
+        ) as executor:
+            case: dict[str, Any] = executor.submit(
+                run_case, image_path, truth, world_size, mode, workers
+            ).result()
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return case
+
+
+def run_case(
+    image_path: str,
+    truth: dict[str, tuple[int, int]],
+    world_size: tuple[int, int],
+    mode: str,
+    workers: int = 1,
+) -> dict[str, Any]:
+    """Stitches the images of generate_tiles once and measures speed, memory and placement error.
+
+    Expects the constants of case_settings, see run_case_process. The canvas of the world size is created
+    here and passed to stitch_images.
+
+    Args:
+        image_path (str): folder of the images, ending with /
+        truth (dict[str, tuple[int, int]]): true positions from generate_tiles
+        world_size (tuple[int, int]): world size from generate_tiles
+        mode (str): "none" for no nudging, otherwise an IMAGE_NUDGING_MODE
+        workers (int): NUMBER_OF_WORKER_THREADS for the "grid" search
+
+    Returns:
+        dict[str, Any]: results of the case
+    """
+    from rift_console.image_processing import stitch_images
+    from rift_console.panorama import TiledPanorama
+
+    placements: dict[str, tuple[int, int]] = {}
+    border = con.STITCHING_BORDER
+    with TiledPanorama.temporary_canvas(
+        (world_size[0] + 2 * border, world_size[1] + 2 * border)
+    ) as panorama:
+        start = time.perf_counter()
+        stitch_images(
+            image_path=image_path,
+            image_name_list=list(truth),
+            panorama=panorama,
+            placements=placements,
+        )
+        seconds = time.perf_counter() - start
+        stitched = panorama.crop_array(
+            (border, border, border + world_size[0], border + world_size[1])
+        )
+
+    with Image.open(
+        os.path.join(os.path.dirname(os.path.normpath(image_path)), REFERENCE_FILE)
+    ) as img:
+        world = np.asarray(img.convert("RGB"), dtype=np.int16)
+    covered = stitched[:, :, 3] > 0
+    pixel_error = (
+        float(np.abs(stitched[:, :, :3][covered] - world[covered]).mean())
+        if covered.any()
+        else None
+    )
+
+    errors = np.array(
+        [
+            (placements[name][0] - x, placements[name][1] - y)
+            for name, (x, y) in truth.items()
+            if name in placements
+        ],
+        dtype=np.float64,
+    ).reshape(-1, 2)
+    distances = np.hypot(errors[:, 0], errors[:, 1])
+    # a shift of the whole map is no stitching error, it comes from the name positions
+    relative = np.hypot(*(errors - np.median(errors, axis=0)).T) if len(errors) else []
+
+    return {
+        "images": len(truth),
+        "mode": mode,
+        "placed": len(placements),
+        "seconds": round(seconds, 3),
+        "images_per_second": round(len(truth) / seconds, 3),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "placement_error_mean": round(float(np.mean(distances)), 3)
+        if len(distances)
+        else None,
+        "placement_error_max": round(float(np.max(distances)), 3)
+        if len(distances)
+        else None,
+        "relative_error_mean": round(float(np.mean(relative)), 3)
+        if len(relative)
+        else None,
+        "pixel_error_mean": None if pixel_error is None else round(pixel_error, 3),
+    }
+
+
+def run_operations(
+    image_path: str, truth: dict[str, tuple[int, int]]
+) -> dict[str, Any]:
+    """Times count_matching_pixels_grid, create_thumbnail and cut on the images of generate_tiles.
+
+    Returns:
+        dict[str, Any]: seconds of each operation
+    """
+    from rift_console.image_helper import generate_spiral_walk
+    from rift_console.image_processing import (
+        count_matching_pixels_grid,
+        create_thumbnail,
+        cut,
+    )
+
+    max_offset = int((con.SEARCH_GRID_SIDE_LENGTH - 1) / 2)
+    offsets = generate_spiral_walk(con.SEARCH_GRID_SIDE_LENGTH**2)
+    with Image.open(image_path + next(iter(truth))) as img:
+        first = img.convert("RGBA")
+    second = Image.new(
+        "RGBA", (first.size[0] + 2 * max_offset, first.size[1] + 2 * max_offset)
+    )
+    second.paste(first, (max_offset, max_offset))
+    start = time.perf_counter()
+    count_matching_pixels_grid(offsets, first, second, max_offset)
+    grid_seconds = time.perf_counter() - start
+
+    # the reference world stands in for a saved panorama
+    work_dir = tempfile.mkdtemp(prefix="benchmark_")
+    try:
+        panorama_path = os.path.join(work_dir, "panorama.png")
+        shutil.copy(
+            os.path.join(os.path.dirname(os.path.normpath(image_path)), REFERENCE_FILE),
+            panorama_path,
+        )
+        start = time.perf_counter()
+        create_thumbnail(panorama_path)
+        thumbnail_seconds = time.perf_counter() - start
+        with Image.open(panorama_path) as img:
+            width, height = img.size
+        start = time.perf_counter()
+        cut(panorama_path, width // 4, height // 4, 3 * width // 4, 3 * height // 4)
+        cut_seconds = time.perf_counter() - start
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    return {
+        "count_matching_pixels_grid": {
+            "offsets": len(offsets),
+            "seconds": round(grid_seconds, 3),
+            "offsets_per_second": round(len(offsets) / grid_seconds, 1),
+        },
+        "create_thumbnail": {
+            "size": [width, height],
+            "seconds": round(thumbnail_seconds, 3),
+        },
+        "cut": {"size": [width // 2, height // 2], "seconds": round(cut_seconds, 3)},
+    }
+
+
+def git_commit() -> str:
+    """Short hash of the checked out commit, "unknown" outside of git."""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def run_benchmarks(
+    sizes: list[int],
+    modes: list[str],
+    reference: Optional[str] = None,
+    workers: int = 1,
+    seed: int = 0,
+    **tile_options: Any,
+) -> dict[str, Any]:
+    """Runs every combination of size and mode, each in a new process.
+
+    Args:
+        sizes (list[int]): number of images per case
+        modes (list[str]): values of NUDGING_MODES
+        reference (Optional[str]): reference image, see generate_tiles
+        workers (int): NUMBER_OF_WORKER_THREADS for the "grid" search
+        seed (int): seed of the generated images
+        tile_options (Any): passed on to generate_tiles
+
+    Returns:
+        dict[str, Any]: environment, cases and operations, as stored by save_results
+    """
+    results: dict[str, Any] = {
+        "commit": git_commit(),
+        "date": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "cpu_count": os.cpu_count(),
+        "settings": {
+            "SEARCH_GRID_SIDE_LENGTH": con.SEARCH_GRID_SIDE_LENGTH,
+            "BLEND_MODE": con.BLEND_MODE,
+            "seed": seed,
+            **tile_options,
+        },
+        "cases": [],
+    }
+    work_dir = tempfile.mkdtemp(prefix="benchmark_")
+    try:
+        for size in sizes:
+            image_path = os.path.join(work_dir, str(size), "images") + "/"
+            truth, world_size = generate_tiles(
+                image_path, size, reference, seed=seed, **tile_options
+            )
+            for mode in modes:
+                case = run_case_process(image_path, truth, world_size, mode, workers)
+                logger.info(
+                    f"{size} images, {mode}: {case['images_per_second']} images/s, "
+                    f"{case['peak_rss_mb']} MB, error {case['placement_error_mean']}px"
+                )
+                results["cases"].append(case)
+        results["operations"] = run_operations(image_path, truth)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return results
+
+
+def save_results(results: dict[str, Any], directory: Optional[str] = None) -> str:
+    """Stores results as benchmark_{date}_{commit}.json.
+
+    Returns:
+        str: path of the file
+    """
+    directory = directory or con.CONSOLE_BENCHMARK_PATH
+    os.makedirs(directory, exist_ok=True)
+    date = datetime.datetime.now().strftime("%Y-%m-%dT%H-%M-%S")
+    path = os.path.join(directory, f"benchmark_{date}_{results['commit']}.json")
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2)
+    return path
+
+
+def compare(old: dict[str, Any], new: dict[str, Any]) -> list[str]:
+    """Lines with the change of each case that is in both results, e.g. from two commits."""
+    old_cases = {(case["images"], case["mode"]): case for case in old["cases"]}
+    lines = [f"{old['commit']} -> {new['commit']}"]
+    for case in new["cases"]:
+        before = old_cases.get((case["images"], case["mode"]))
+        if before is None:
+            continue
+        speedup = case["images_per_second"] / max(before["images_per_second"], 1e-9)
+        lines.append(
+            f"{case['images']:>6} images {case['mode']:>8}: {speedup:.2f}x images/s, "
+            f"{before['peak_rss_mb']} -> {case['peak_rss_mb']} MB, "
+            f"error {before['placement_error_mean']} -> {case['placement_error_mean']}px"
+        )
+    return lines
+
+
+@click.command()
+@click.option(
+    "--sizes", default="9,25", help="Comma separated number of images per case"
+)
+@click.option(
+    "--modes",
+    default="none,fft,pyramid,global",
+    help=f"Comma separated nudging modes of {', '.join(NUDGING_MODES)}",
+)
+@click.option("--reference", default=None, help="Image to cut the tiles from")
+@click.option("--noise", default=2.0, help="Noise of each image in each color channel")
+@click.option(
+    "--name-error", default=5, help="Largest error of the positions in the names"
+)
+@click.option("--workers", default=1, help="Worker threads of the grid search")
+@click.option("--seed", default=0, help="Seed of the generated images")
+@click.option(
+    "--compare", "compare_path", default=None, help="Earlier result to compare with"
+)
+def main(
+    sizes: str,
+    modes: str,
+    reference: Optional[str],
+    noise: float,
+    name_error: int,
+    workers: int,
+    seed: int,
+    compare_path: Optional[str],
+) -> None:
+    """Benchmarks stitching on synthetic images and stores the results as json."""
+    mode_list = modes.split(",")
+    for mode in mode_list:
+        if mode not in NUDGING_MODES:
+            raise click.BadParameter(f"unknown mode {mode}", param_hint="--modes")
+    results = run_benchmarks(
+        sizes=[int(size) for size in sizes.split(",")],
+        modes=mode_list,
+        reference=reference,
+        workers=workers,
+        seed=seed,
+        noise=noise,
+        name_error=name_error,
+    )
+    click.echo(f"Saved results to {save_results(results)}")
+    for case in results["cases"]:
+        click.echo(json.dumps(case))
+    click.echo(json.dumps(results["operations"]))
+    if compare_path:
+        with open(compare_path) as f:
+            click.echo("\n".join(compare(json.load(f), results)))
+
+
+if __name__ == "__main__":
+    main()  # pragma: no cover
@@ -0,0 +1,132 @@
+"""
+
+On-disk cache of decoded and resized images, so repeated stitching of the same downloads skips PNG decoding.
+
+"""
+
+import hashlib
+import os
+from typing import Optional
+
+import numpy as np
+from loguru import logger
+from PIL import Image
+
+import shared.constants as con
+
+
+def decode_image(path: str, lens_size: int) -> Image.Image:
+    """Opens an image as RGBA and scales it to lens_size, as needed for stitching.
+
+    Raises:
+        OSError: if the file is missing or can not be decoded
+    """
+    with Image.open(path) as file:
+        img: Image.Image = file.convert("RGBA")
+    # narrow images are already in their lens size
+    if lens_size != 600:
+        img = img.resize((lens_size, lens_size), Image.Resampling.LANCZOS)
+    return img
+
+
+class ImageCache:
+    """Raw RGBA pixels of decoded images as .npy files, at most max_bytes in total.
+
+    Entries are keyed by path, modification time and lens size of the image, so a changed download is
+    decoded again. If the cache gets too large, the least recently used entries are removed. Several
+    processes can use the same directory, every file is written in one step.
+    """
+
+    def __init__(
+        self, directory: Optional[str] = None, max_bytes: Optional[int] = None
+    ) -> None:
+        """
+        Args:
+            directory (Optional[str]): folder of the cache, CONSOLE_IMAGE_CACHE_PATH if not given
+            max_bytes (Optional[int]): size limit, IMAGE_CACHE_SIZE if not given
+        """
+        self.directory = directory or con.CONSOLE_IMAGE_CACHE_PATH
+        self.max_bytes = con.IMAGE_CACHE_SIZE if max_bytes is None else max_bytes
+        os.makedirs(self.directory, exist_ok=True)
+        # estimate of the size on disk, only rescanned when it crosses max_bytes
+        self._total_bytes = sum(size for _, _, size in self._entries())
+        self.hits = 0
+        self.misses = 0
+
+    def _entries(self) -> list[tuple[str, float, int]]:
+        """Path, last use and size of all cache files."""
+        entries = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if not entry.name.endswith(".npy"):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    # removed by another process
+                    continue
+                entries.append((entry.path, stat.st_mtime, stat.st_size))
+        return entries
+
+    def _cache_path(self, path: str, lens_size: int) -> str:
+        stat = os.stat(path)
+        key = f"{os.path.abspath(path)}|{stat.st_mtime_ns}|{stat.st_size}|{lens_size}"
+        digest = hashlib.sha1(key.encode()).hexdigest()[:16]
+        name = os.path.splitext(os.path.basename(path))[0]
+        return os.path.join(self.directory, f"{name}_{digest}.npy")
+
+    def load(self, path: str, lens_size: int) -> Image.Image:
+        """Same as decode_image, but served from the cache if the image was decoded before.
+
+        Raises:
+            OSError: if the file is missing or can not be decoded
+        """
+        cache_path = self._cache_path(path, lens_size)
+        try:
+            pixels = np.load(cache_path)
+            # mtime of the cache file marks the last use
+            os.utime(cache_path)
+            self.hits += 1
+            return Image.fromarray(pixels, "RGBA")
+        except (OSError, ValueError):
+            # not cached yet, evicted by another process or half written
+            pass
+
+        img = decode_image(path, lens_size)
+        self.misses += 1
+        if self.max_bytes > 0:
+            self._store(cache_path, np.asarray(img))
+        return img
+
+    def _store(self, cache_path: str, pixels: np.ndarray) -> None:
+        tmp_path = cache_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, pixels)
+        os.replace(tmp_path, cache_path)
+        self._total_bytes += os.path.getsize(cache_path)
+        if self._total_bytes > self.max_bytes:
+            self.evict()
+
+    def evict(self) -> None:
+        """Removes the least recently used entries until the cache fits into max_bytes."""
+        entries = sorted(self._entries(), key=lambda entry: entry[1])
+        total = sum(size for _, _, size in entries)
+        removed = 0
+        for path, _, size in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            removed += 1
+        self._total_bytes = total
+        logger.debug(f"Evicted {removed} images from cache {self.directory}")
+
+
+def console_image_cache() -> Optional[ImageCache]:
+    """Cache for stitching of the console downloads, None if IMAGE_CACHE_SIZE turns it off."""
+    if con.IMAGE_CACHE_SIZE <= 0:
+        return None
+    return ImageCache()
@@ -0,0 +1,284 @@
+"""
+
+Persistent catalog of image metadata in SQLite, so listing and filtering images never parses file names again.
+
+"""
+
+import datetime
+import os
+import re
+import sqlite3
+import threading
+from typing import Optional
+
+from loguru import logger
+
+import shared.constants as con
+from shared.models import CameraAngle, lens_size_by_angle
+
+# image_{melv_id}_{angle}_{time}_x_{cor_x}_y_{cor_y}.png, see con.IMAGE_LOCATION
+IMAGE_NAME_PATTERN = re.compile(
+    r"_(narrow|normal|wide)_(\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}(?:\.\d{6})?)_x_(-?\d+)_y_(-?\d+)"
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    directory TEXT NOT NULL,
+    name TEXT NOT NULL,
+    angle TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    x INTEGER NOT NULL,
+    y INTEGER NOT NULL,
+    lens_size INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    source TEXT NOT NULL,
+    PRIMARY KEY (directory, name)
+);
+CREATE INDEX IF NOT EXISTS images_timestamp ON images (directory, timestamp);
+CREATE INDEX IF NOT EXISTS images_angle ON images (directory, angle, timestamp);
+"""
+
+SECONDS_FORMAT = "%Y-%m-%dT%H:%M:%S"
+
+
+class ImageCatalog:
+    """Metadata of all images per folder: lens, timestamp, position from the name, lens size, size on disk, source.
+
+    Rows are added when an image arrives (add) or by comparing a folder with the catalog (sync), which only
+    parses the names of new files. Queries use the indices on timestamp and lens, so they do not depend on
+    parsing or listing the folder. One connection is shared by all threads of a process.
+    """
+
+    def __init__(self, path: str = ":memory:") -> None:
+        """
+        Args:
+            path (str): SQLite file, it is created on first use
+        """
+        self.path = path
+        self._connection: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def _db(self) -> sqlite3.Connection:
+        if self._connection is None:
+            if self.path != ":memory:":
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._connection = sqlite3.connect(self.path, check_same_thread=False)
+            # other processes (e.g. background jobs) can read while the console writes
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.executescript(SCHEMA)
+        return self._connection
+
+    @staticmethod
+    def _row(
+        directory: str, name: str, size: int, source: str
+    ) -> Optional[tuple[str, str, str, str, int, int, int, int, str]]:
+        match = IMAGE_NAME_PATTERN.search(name)
+        if not match:
+            return None
+        angle = CameraAngle(match.group(1))
+        return (
+            directory,
+            name,
+            angle.value,
+            match.group(2),
+            int(match.group(3)),
+            int(match.group(4)),
+            lens_size_by_angle(angle),
+            size,
+            source,
+        )
+
+    def add(self, directory: str, name: str, source: str = "") -> bool:
+        """Adds or updates one image that was just written to directory.
+
+        Returns:
+            bool: False if the name is not in the image name format
+        """
+        directory = os.path.normpath(directory)
+        row = self._row(
+            directory, name, os.path.getsize(os.path.join(directory, name)), source
+        )
+        if row is None:
+            logger.warning(f"ImageCatalog: can not parse {name}, not added")
+            return False
+        with self._lock, self._db() as db:
+            db.execute("INSERT OR REPLACE INTO images VALUES (?,?,?,?,?,?,?,?,?)", row)
+        return True
+
+    def sync(
+        self, directory: str, source: str = "", added: Optional[list[str]] = None
+    ) -> tuple[int, int]:
+        """Adds new images of a folder to the catalog and removes the ones that are gone.
+
+        Args:
+            directory (str): folder of the images, not searched recursively
+            source (str): stored with the new images, e.g. melvonaut
+            added (Optional[list[str]]): if given, the names of the new images are appended
+
+        Returns:
+            tuple[int, int]: number of added and removed images
+        """
+        directory = os.path.normpath(directory)
+        on_disk = {}
+        if os.path.isdir(directory):
+            with os.scandir(directory) as it:
+                for entry in it:
+                    if entry.name.startswith("image") and entry.is_file():
+                        on_disk[entry.name] = entry
+        with self._lock, self._db() as db:
+            known = {
+                name
+                for (name,) in db.execute(
+                    "SELECT name FROM images WHERE directory = ?", (directory,)
+                )
+            }
+            rows = []
+            for name in on_disk.keys() - known:
+                row = self._row(directory, name, on_disk[name].stat().st_size, source)
+                if row is not None:
+                    rows.append(row)
+            removed = [(directory, name) for name in known - on_disk.keys()]
+            db.executemany("INSERT INTO images VALUES (?,?,?,?,?,?,?,?,?)", rows)
+            db.executemany(
+                "DELETE FROM images WHERE directory = ? AND name = ?", removed
+            )
+        if added is not None:
+            added.extend(row[1] for row in rows)
+        if rows or removed:
+            logger.info(
+                f"ImageCatalog: {len(rows)} new and {len(removed)} removed images in {directory}"
+            )
+        return len(rows), len(removed)
+
+    def _where(
+        self,
+        directory: str,
+        angle: Optional[CameraAngle],
+        start: Optional[datetime.datetime],
+        end: Optional[datetime.datetime],
+    ) -> tuple[str, list[str]]:
+        clauses = ["directory = ?"]
+        params = [os.path.normpath(directory)]
+        if angle is not None:
+            clauses.append("angle = ?")
+            params.append(angle.value)
+        if start is not None:
+            clauses.append("timestamp >= ?")
+            params.append(start.strftime(SECONDS_FORMAT))
+        if end is not None:
+            # end is inclusive up to the second, like filter_by_date
+            clauses.append("timestamp < ?")
+            params.append(
+                (end + datetime.timedelta(seconds=1)).strftime(SECONDS_FORMAT)
+            )
+        return " AND ".join(clauses), params
+
+    def entries(
+        self,
+        directory: str,
+        angle: Optional[CameraAngle] = None,
+        start: Optional[datetime.datetime] = None,
+        end: Optional[datetime.datetime] = None,
+        by_position: bool = False,
+        newest_first: bool = False,
+        limit: Optional[int] = None,
+    ) -> list[tuple[str, str, CameraAngle]]:
+        """Name, timestamp and lens of the images in a folder, oldest first.
+
+        Args:
+            directory (str): folder of the images
+            angle (Optional[CameraAngle]): only images of this lens
+            start (Optional[datetime.datetime]): only images taken at or after start
+            end (Optional[datetime.datetime]): only images taken at or before end, to the second
+            by_position (bool): sort by x + y instead, like con.SORT_IMAGE_BY_POSITION
+            newest_first (bool): reverse the order
+            limit (Optional[int]): at most this many images
+
+        Returns:
+            list[tuple[str, str, CameraAngle]]: file name, timestamp in iso format and lens
+        """
+        where, params = self._where(directory, angle, start, end)
+        order = "x + y" if by_position else "timestamp"
+        direction = "DESC" if newest_first else "ASC"
+        query = f"SELECT name, timestamp, angle FROM images WHERE {where} ORDER BY {order} {direction}, name {direction}"
+        if limit is not None:
+            query += f" LIMIT {int(limit)}"
+        with self._lock:
+            return [
+                (name, timestamp, CameraAngle(angle))
+                for name, timestamp, angle in self._db().execute(query, params)
+            ]
+
+    def names(
+        self,
+        directory: str,
+        angle: Optional[CameraAngle] = None,
+        start: Optional[datetime.datetime] = None,
+        end: Optional[datetime.datetime] = None,
+        by_position: bool = False,
+        newest_first: bool = False,
+        limit: Optional[int] = None,
+    ) -> list[str]:
+        """Only the file names of entries, with the same filters and order."""
+        return [
+            name
+            for name, _, _ in self.entries(
+                directory, angle, start, end, by_position, newest_first, limit
+            )
+        ]
+
+    def count(self, directory: str, angle: Optional[CameraAngle] = None) -> int:
+        """Number of images in a folder, optionally only of one lens."""
+        where, params = self._where(directory, angle, None, None)
+        with self._lock:
+            (count,) = (
+                self._db()
+                .execute(f"SELECT COUNT(*) FROM images WHERE {where}", params)
+                .fetchone()
+            )
+        return int(count)
+
+    def dates(self, directory: str) -> list[tuple[str, int]]:
+        """Days with images in a folder and the number of images on each, newest first."""
+        where, params = self._where(directory, None, None, None)
+        with self._lock:
+            return [
+                (date, int(count))
+                for date, count in self._db().execute(
+                    f"SELECT substr(timestamp, 1, 10) AS date, COUNT(*) FROM images WHERE {where} "
+                    "GROUP BY date ORDER BY date DESC",
+                    params,
+                )
+            ]
+
+    def positions(self, directory: str) -> list[tuple[str, CameraAngle, int, int]]:
+        """Name, lens and position of every image in a folder, with the same adjustment as parse_image_name."""
+        where, params = self._where(directory, None, None, None)
+        with self._lock:
+            rows = self._db().execute(
+                f"SELECT name, angle, x, y, lens_size FROM images WHERE {where}", params
+            )
+            result = []
+            for name, angle, x, y, lens_size in rows:
+                # old images position is not adjusted in melvonaut yet
+                if con.USE_LEGACY_IMAGE_NAMES:
+                    x -= lens_size // 2
+                    y -= lens_size // 2
+                result.append((name, CameraAngle(angle), x, y))
+        return result
+
+    def close(self) -> None:
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+
+_catalog: Optional[ImageCatalog] = None
+
+
+def console_catalog() -> ImageCatalog:
+    """Catalog of this process in CONSOLE_IMAGE_CATALOG_LOCATION, callers sync the folders they list, see check_images."""
+    global _catalog
+    if _catalog is None:
+        _catalog = ImageCatalog(con.CONSOLE_IMAGE_CATALOG_LOCATION)
+    return _catalog
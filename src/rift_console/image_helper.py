@@ -7,7 +7,10 @@ Provides helping functions that are used in image_processing.
 import re
 import os
 import datetime
+
+import numpy as np
 from loguru import logger
+from PIL import Image
 
 import shared.constants as con
 from shared.models import CameraAngle
@@ -39,19 +42,26 @@ def get_date(image: str) -> str:
         return datetime.datetime.min.strftime("%Y-%m-%dT%H:%M:%S")
 
 
-def filter_by_date(
-    images: list[str], start: datetime.datetime, end: datetime.datetime
-) -> list[str]:
-    res = []
-    date_format = "%Y-%m-%dT%H:%M:%S"
-    for image in images:
-        date = datetime.datetime.strptime(get_date(image), date_format).replace(
-            tzinfo=datetime.timezone.utc
-        )
-        # logger.warning(f"{date} {start} {end}")
-        if date >= start and date <= end:
-            res.append(image)
-    return res
+def count_set_pixels(img: Image.Image) -> int:
+    """Counts the pixels of an image that are not fully transparent, using the alpha channel.
+
+    Args:
+        img (Image.Image): image, without alpha channel every pixel counts as set
+
+    Returns:
+        int: number of pixels with alpha > 0
+    """
+    if "A" not in img.getbands():
+        return img.size[0] * img.size[1]
+    return int(np.count_nonzero(np.asarray(img.getchannel("A"))))
+
+
+def coverage(img: Image.Image) -> float:
+    """Share of the image that is already covered (alpha > 0), between 0 and 1."""
+    total_pixel = img.size[0] * img.size[1]
+    if total_pixel == 0:
+        return 0.0
+    return count_set_pixels(img) / total_pixel
 
 
 def generate_spiral_walk(n: int) -> list[tuple[int, int]]:
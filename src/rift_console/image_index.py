@@ -0,0 +1,280 @@
+"""
+
+Spatial index of image footprints, to find the images that touch a zone without opening any of them.
+
+"""
+
+import heapq
+import math
+from typing import Optional
+
+import numpy as np
+from loguru import logger
+
+import shared.constants as con
+from rift_console.image_helper import parse_image_name
+
+
+def overlaps(
+    start: int, length: int, zone_start: int, zone_length: int, world: int
+) -> bool:
+    """If two ranges overlap on an axis that wraps around after world pixels."""
+    return (start - zone_start) % world < zone_length or (
+        zone_start - start
+    ) % world < length
+
+
+def overlap_length(
+    start: int, length: int, other_start: int, other_length: int, world: int
+) -> int:
+    """Length of the overlap of two ranges on an axis that wraps around after world pixels."""
+    ahead = (other_start - start) % world
+    behind = (start - other_start) % world
+    return max(
+        0,
+        min(length - ahead, other_length),
+        min(other_length - behind, length),
+    )
+
+
+def zone_size(zone: tuple[int, int, int, int]) -> tuple[int, int]:
+    """Width and height of a zone, which wraps around the world border if x2/y2 is smaller than x1/y1."""
+
+    def span(start: int, end: int, world: int) -> int:
+        if end == start:
+            return 0
+        # a zone over the whole world has end - start == world
+        return (end - start) % world or world
+
+    return (
+        span(int(zone[0]), int(zone[2]), con.WORLD_X),
+        span(int(zone[1]), int(zone[3]), con.WORLD_Y),
+    )
+
+
+class ImageIndex:
+    """Grid of IMAGE_INDEX_CELL_SIZE cells over the world, each cell lists the images that touch it.
+
+    Footprints are parsed from the image names, like in stitch_images. Images and zones wrap around the
+    world border in x and y.
+    """
+
+    def __init__(
+        self,
+        image_name_list: Optional[list[str]] = None,
+        cell_size: int = con.IMAGE_INDEX_CELL_SIZE,
+    ) -> None:
+        """
+        Args:
+            image_name_list (Optional[list[str]]): images to add, see add
+            cell_size (int): side length of one cell in pixels
+        """
+        self.cell_size = cell_size
+        self._names: list[str] = []
+        # x, y, lens size of each image
+        self._footprints: list[tuple[int, int, int]] = []
+        self._cells: dict[tuple[int, int], list[int]] = {}
+        for image_name in image_name_list or []:
+            self.add(image_name)
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def _wrapped_cells(self, start: int, length: int, world: int) -> list[int]:
+        """Cell indices touched by a range, wrapped around the world."""
+        cells: set[int] = set()
+        start %= world
+        # the last cell can be smaller, so each part inside the world is looked up on its own
+        while length > 0:
+            end = min(start + length, world)
+            cells.update(
+                range(start // self.cell_size, math.ceil(end / self.cell_size))
+            )
+            length -= end - start
+            start = 0
+        return sorted(cells)
+
+    def add(self, image_name: str) -> None:
+        """Adds an image at the position and lens size from its name, names in another format are skipped."""
+        try:
+            lens_size, x, y = parse_image_name(image_name)
+        except Exception:
+            logger.warning(f"ImageIndex: can not parse {image_name}, skipped")
+            return
+        index = len(self._names)
+        self._names.append(image_name)
+        self._footprints.append((x, y, lens_size))
+        for row in self._wrapped_cells(y, lens_size, con.WORLD_Y):
+            for column in self._wrapped_cells(x, lens_size, con.WORLD_X):
+                self._cells.setdefault((row, column), []).append(index)
+
+    def query(self, zone: tuple[int, int, int, int]) -> list[str]:
+        """Images that touch a zone, in the order they were added.
+
+        Args:
+            zone (tuple[int, int, int, int]): x1, y1, x2, y2 in the world, x2/y2 can be smaller than x1/y1
+                or beyond the world border if the zone wraps around
+
+        Returns:
+            list[str]: names of the images
+        """
+        x1, y1 = int(zone[0]), int(zone[1])
+        width, height = zone_size(zone)
+
+        candidates: set[int] = set()
+        for row in self._wrapped_cells(y1, height, con.WORLD_Y):
+            for column in self._wrapped_cells(x1, width, con.WORLD_X):
+                candidates.update(self._cells.get((row, column), []))
+
+        return [
+            self._names[index]
+            for index in sorted(candidates)
+            if overlaps(
+                self._footprints[index][0],
+                self._footprints[index][2],
+                x1,
+                width,
+                con.WORLD_X,
+            )
+            and overlaps(
+                self._footprints[index][1],
+                self._footprints[index][2],
+                y1,
+                height,
+                con.WORLD_Y,
+            )
+        ]
+
+    def overlap(self, first: int, second: int) -> int:
+        """Overlapping area in pixels of two added images, by their index."""
+        x1, y1, size1 = self._footprints[first]
+        x2, y2, size2 = self._footprints[second]
+        return overlap_length(x1, size1, x2, size2, con.WORLD_X) * overlap_length(
+            y1, size1, y2, size2, con.WORLD_Y
+        )
+
+    def footprint(self, index: int) -> tuple[int, int, int]:
+        """x, y and lens size of an added image, by its index."""
+        return self._footprints[index]
+
+    def name(self, index: int) -> str:
+        """Name of an added image, by its index."""
+        return self._names[index]
+
+    def pairs(self, min_overlap: float = 0.0) -> list[tuple[int, int]]:
+        """All pairs of overlapping images, by their index with the smaller index first.
+
+        Args:
+            min_overlap (float): share of the smaller image that has to overlap, pairs with less are left out
+
+        Returns:
+            list[tuple[int, int]]: sorted pairs
+        """
+        pairs = []
+        for index, (x, y, lens_size) in enumerate(self._footprints):
+            for neighbour in sorted(self._neighbours(x, y, lens_size)):
+                if neighbour <= index:
+                    continue
+                smaller = min(lens_size, self._footprints[neighbour][2]) ** 2
+                area = self.overlap(index, neighbour)
+                if area > 0 and area >= min_overlap * smaller:
+                    pairs.append((index, neighbour))
+        return pairs
+
+    def _strongest_overlaps(self, max_neighbours: int) -> list[list[tuple[int, int]]]:
+        """Overlapping images of each image as (area, index), computed once for overlap_order.
+
+        Each image keeps its max_neighbours largest overlaps, and is also listed as neighbour of those
+        images, so the overlap graph stays connected where the images are dense.
+        """
+        footprints = np.array(self._footprints, dtype=np.int64).reshape(-1, 3)
+        xs, ys, sizes = footprints[:, 0], footprints[:, 1], footprints[:, 2]
+        cells = {key: np.array(indices) for key, indices in self._cells.items()}
+
+        def lengths(
+            start: int,
+            length: int,
+            others: np.ndarray,
+            other_lengths: np.ndarray,
+            world: int,
+        ) -> np.ndarray:
+            # overlap_length for many ranges at once
+            ahead = (others - start) % world
+            behind = (start - others) % world
+            longest: np.ndarray = np.maximum(
+                0,
+                np.maximum(
+                    np.minimum(length - ahead, other_lengths),
+                    np.minimum(other_lengths - behind, length),
+                ),
+            )
+            return longest
+
+        neighbours: list[list[tuple[int, int]]] = [[] for _ in self._names]
+        for index, (x, y, lens_size) in enumerate(self._footprints):
+            candidates = np.unique(
+                np.concatenate(
+                    [
+                        cells[(row, column)]
+                        for row in self._wrapped_cells(y, lens_size, con.WORLD_Y)
+                        for column in self._wrapped_cells(x, lens_size, con.WORLD_X)
+                        if (row, column) in cells
+                    ]
+                )
+            )
+            candidates = candidates[candidates != index]
+            areas = lengths(
+                x, lens_size, xs[candidates], sizes[candidates], con.WORLD_X
+            ) * lengths(y, lens_size, ys[candidates], sizes[candidates], con.WORLD_Y)
+            candidates, areas = candidates[areas > 0], areas[areas > 0]
+            if len(candidates) > max_neighbours:
+                strongest = np.argpartition(-areas, max_neighbours)[:max_neighbours]
+                candidates, areas = candidates[strongest], areas[strongest]
+            for neighbour, area in zip(candidates.tolist(), areas.tolist()):
+                neighbours[index].append((area, neighbour))
+                neighbours[neighbour].append((area, index))
+        return neighbours
+
+    def overlap_order(self, max_neighbours: Optional[int] = None) -> list[str]:
+        """Placement order in which every image overlaps the already placed ones as much as possible.
+
+        Grows a maximum spanning tree over the overlap graph of the footprints (Prim), starting with the
+        first added image: the next image is always the one with the largest overlap with any placed
+        image, so nudging can register it against well covered neighbours. Images without overlap start a
+        new tree, again with the first remaining image in the order they were added.
+
+        Args:
+            max_neighbours (Optional[int]): largest overlaps kept per image, OVERLAP_ORDER_NEIGHBOURS if
+                not given, limits the work in areas with many images on top of each other
+
+        Returns:
+            list[str]: all added images in placement order
+        """
+        if max_neighbours is None:
+            max_neighbours = con.OVERLAP_ORDER_NEIGHBOURS
+        neighbours = self._strongest_overlaps(max_neighbours)
+        placed = [False] * len(self._names)
+        order: list[str] = []
+        for seed in range(len(self._names)):
+            if placed[seed]:
+                continue
+            # max heap of (-overlap, index), ties keep the order in which images were added
+            heap = [(0, seed)]
+            while heap:
+                _, index = heapq.heappop(heap)
+                if placed[index]:
+                    continue
+                placed[index] = True
+                order.append(self._names[index])
+                for area, neighbour in neighbours[index]:
+                    if not placed[neighbour]:
+                        heapq.heappush(heap, (-area, neighbour))
+        return order
+
+    def _neighbours(self, x: int, y: int, lens_size: int) -> set[int]:
+        """Indices of the images in the cells touched by a footprint."""
+        neighbours: set[int] = set()
+        for row in self._wrapped_cells(y, lens_size, con.WORLD_Y):
+            for column in self._wrapped_cells(x, lens_size, con.WORLD_X):
+                neighbours.update(self._cells.get((row, column), []))
+        return neighbours
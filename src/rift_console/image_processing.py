@@ -1,25 +1,79 @@
+import contextlib
+import json
+import math
+import os
+import shutil
 import sys
+import tempfile
 from collections import Counter
 from concurrent.futures import ProcessPoolExecutor
-from functools import partial
-from typing import Optional
+from multiprocessing import get_context
+from multiprocessing.shared_memory import SharedMemory
+from types import TracebackType
+from typing import Callable, Optional
 import requests
 
+import numpy as np
 from loguru import logger
 from PIL import Image
 
 from rift_console.image_helper import (
+    count_set_pixels,
+    coverage,
     generate_spiral_walk,
+    get_angle,
     parse_image_name,
     find_image_names,
 )
+from rift_console.image_cache import ImageCache, console_image_cache, decode_image
+from rift_console.image_index import zone_size
+from rift_console.panorama import TiledCompositor, TiledPanorama, write_tile_pyramid
 import shared.constants as con
+from shared.coverage import CoverageIndex
+from shared.models import CameraAngle, lens_size_by_angle
 
 ##### LOGGING #####
 logger.remove()
 logger.add(sink=sys.stderr, level=con.RIFT_LOG_LEVEL, backtrace=True, diagnose=True)
 
 
+def image_to_array(img: Image.Image) -> np.ndarray:
+    """Converts an image into an RGB array used for pixel matching.
+
+    Alpha is dropped, since only R G B are compared. Channels are stored first, so each channel is one
+    contiguous block, and the dtype is int16 so differences between two arrays can not overflow.
+
+    Args:
+        img (Image.Image): image in any mode
+
+    Returns:
+        np.ndarray: array of shape (3, height, width)
+    """
+    rgb = np.asarray(img.convert("RGB"), dtype=np.int16)
+    return np.ascontiguousarray(rgb.transpose(2, 0, 1))
+
+
+def _count_matching(
+    offset: tuple[int, int],
+    first_arr: np.ndarray,
+    second_arr: np.ndarray,
+    max_offset: int,
+    buffer: Optional[np.ndarray] = None,
+) -> int:
+    """Counts matching pixels for one offset, works on arrays created by image_to_array."""
+    height, width = first_arr.shape[1:]
+    x_start = offset[0] + max_offset
+    y_start = offset[1] + max_offset
+    window = second_arr[:, y_start : y_start + height, x_start : x_start + width]
+
+    # only compare R G B and not Alpha. Since there is random noise a slight difference is allowed
+    difference = np.subtract(first_arr, window, out=buffer)
+    np.abs(difference, out=difference)
+    summed = difference[0] + difference[1]
+    summed += difference[2]
+    return int(np.count_nonzero(summed < con.IMAGE_NOISE_FORGIVENESS))
+
+
 def count_matching_pixels(
     offset: tuple[int, int],
     first_img: Image.Image,
@@ -36,189 +90,655 @@ def count_matching_pixels(
     Returns:
         tuple[int, int]: used offset and number of matching pixels
     """
+    matches = _count_matching(
+        offset, image_to_array(first_img), image_to_array(second_img), max_offset
+    )
+    return offset, matches
+
+
+def count_matching_pixels_grid(
+    offsets: list[tuple[int, int]],
+    first_img: Image.Image,
+    second_img: Image.Image,
+    max_offset: int,
+) -> list[tuple[tuple[int, int], int]]:
+    """Same as count_matching_pixels, but scores all offsets at once.
+
+    Both images are only converted once, each offset is then compared as whole-array operation.
+
+    Args:
+        offsets (list[tuple[int, int]]): shifts to try, e.g. from generate_spiral_walk
+        first_img (Image.Image): first image
+        second_img (Image.Image): second (larger to allow shift) image
+        max_offset (int): largest shift in each direction
+
+    Returns:
+        list[tuple[tuple[int, int], int]]: each offset with its number of matching pixels
+    """
+    first_arr = image_to_array(first_img)
+    second_arr = image_to_array(second_img)
+    buffer = np.empty_like(first_arr)
+    return [
+        (offset, _count_matching(offset, first_arr, second_arr, max_offset, buffer))
+        for offset in offsets
+    ]
+
+
+# shared memory of the current NudgingPool, attached once in each worker process
+_worker_buffers: dict[str, SharedMemory] = {}
+# set in the processes of stitch_images_parallel, so they do not start workers on their own
+_in_region_worker = False
+
+
+def _attach_worker_buffers(first_name: str, second_name: str) -> None:
+    """Initializer of the NudgingPool workers, opens the shared image buffers."""
+    _worker_buffers["first"] = SharedMemory(name=first_name)
+    _worker_buffers["second"] = SharedMemory(name=second_name)
+
+
+def _count_matching_shared(
+    offsets: list[tuple[int, int]],
+    first_shape: tuple[int, int, int],
+    second_shape: tuple[int, int, int],
+    max_offset: int,
+) -> list[tuple[tuple[int, int], int]]:
+    """Worker side of NudgingPool, scores a part of the offsets on the shared buffers."""
+    first_arr = np.ndarray(
+        first_shape, dtype=np.int16, buffer=_worker_buffers["first"].buf
+    )
+    second_arr = np.ndarray(
+        second_shape, dtype=np.int16, buffer=_worker_buffers["second"].buf
+    )
+    buffer = np.empty_like(first_arr)
+    return [
+        (offset, _count_matching(offset, first_arr, second_arr, max_offset, buffer))
+        for offset in offsets
+    ]
+
+
+class NudgingPool:
+    """Long-lived worker processes for the grid nudging search of one stitching run.
+
+    Workers are started once and keep two shared memory buffers open. For each image the pixel data is
+    copied into these buffers, so only the offsets and the resulting counts are sent between processes.
+    """
+
+    def __init__(self, workers: int, max_offset: int) -> None:
+        """Starts the workers and allocates buffers large enough for the widest lens.
+
+        Args:
+            workers (int): number of worker processes
+            max_offset (int): largest shift in each direction, defines the size of the panorama crop
+        """
+        lens_size = lens_size_by_angle(CameraAngle.Wide)
+        itemsize = np.dtype(np.int16).itemsize
+        self._first_shm = SharedMemory(create=True, size=3 * lens_size**2 * itemsize)
+        self._second_shm = SharedMemory(
+            create=True, size=3 * (lens_size + 2 * max_offset) ** 2 * itemsize
+        )
+        self._workers = workers
+        # spawn instead of fork, since the console runs stitching next to other threads
+        self._executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=get_context("spawn"),
+            initializer=_attach_worker_buffers,
+            initargs=(self._first_shm.name, self._second_shm.name),
+        )
+        logger.info(f"Started NudgingPool with {workers} workers")
+
+    def count_matching_pixels_grid(
+        self,
+        offsets: list[tuple[int, int]],
+        first_img: Image.Image,
+        second_img: Image.Image,
+        max_offset: int,
+    ) -> list[tuple[tuple[int, int], int]]:
+        """Same as count_matching_pixels_grid, but the offsets are split between the workers.
+
+        Args:
+            offsets (list[tuple[int, int]]): shifts to try, e.g. from generate_spiral_walk
+            first_img (Image.Image): first image
+            second_img (Image.Image): second (larger to allow shift) image
+            max_offset (int): largest shift in each direction
+
+        Returns:
+            list[tuple[tuple[int, int], int]]: each offset with its number of matching pixels, in the given order
+        """
+        first_arr = image_to_array(first_img)
+        second_arr = image_to_array(second_img)
+        np.ndarray(first_arr.shape, dtype=np.int16, buffer=self._first_shm.buf)[:] = (
+            first_arr
+        )
+        np.ndarray(second_arr.shape, dtype=np.int16, buffer=self._second_shm.buf)[:] = (
+            second_arr
+        )
+
+        # continuous chunks keep the order of the offsets
+        chunk_size = -(-len(offsets) // self._workers)
+        chunks = [
+            offsets[i : i + chunk_size] for i in range(0, len(offsets), chunk_size)
+        ]
+        results = self._executor.map(
+            _count_matching_shared,
+            chunks,
+            [first_arr.shape] * len(chunks),
+            [second_arr.shape] * len(chunks),
+            [max_offset] * len(chunks),
+        )
+        return [result for chunk in results for result in chunk]
+
+    def close(self) -> None:
+        """Stops the workers and frees the shared memory."""
+        self._executor.shutdown()
+        self._first_shm.close()
+        self._first_shm.unlink()
+        self._second_shm.close()
+        self._second_shm.unlink()
+
+    def __enter__(self) -> "NudgingPool":
+        return self
+
+    def __exit__(
+        self,
+        exc_type: Optional[type[BaseException]],
+        exc_value: Optional[BaseException],
+        traceback: Optional[TracebackType],
+    ) -> None:
+        self.close()
+
+
+def _downscale(arr: np.ndarray) -> np.ndarray:
+    """Halves an array created by image_to_array by averaging blocks of 2x2 pixels."""
+    height = arr.shape[1] - arr.shape[1] % 2
+    width = arr.shape[2] - arr.shape[2] % 2
+    # four values up to 255 still fit into int16
+    summed = arr[:, 0:height:2, 0:width:2] + arr[:, 1:height:2, 0:width:2]
+    summed += arr[:, 0:height:2, 1:width:2]
+    summed += arr[:, 1:height:2, 1:width:2]
+    downscaled: np.ndarray = summed // 4
+    return downscaled
+
+
+def pyramid_registration(
+    first_img: Image.Image, second_img: Image.Image, max_offset: int
+) -> tuple[tuple[int, int], int]:
+    """Coarse-to-fine search for the best offset of first_img inside second_img.
+
+    The whole search window is only scanned on the coarsest level, where both images are downscaled by
+    2^(PYRAMID_LEVELS - 1). Each finer level doubles the resolution and only checks PYRAMID_REFINE_RADIUS
+    around the previous result. The last level is the full resolution with the normal matching, so
+    IMAGE_NOISE_FORGIVENESS and the returned matches are the same as in count_matching_pixels.
+
+    Args:
+        first_img (Image.Image): image that should be placed
+        second_img (Image.Image): crop of the panorama, larger by max_offset in each direction
+        max_offset (int): largest shift in each direction
 
-    matches = 0
-    for x_local in range(first_img.size[0]):
-        for y_local in range(first_img.size[1]):
-            p1 = first_img.getpixel((x_local, y_local))
-            p2 = second_img.getpixel(
-                (x_local + offset[0] + max_offset, y_local + offset[1] + max_offset)
+    Returns:
+        tuple[tuple[int, int], int]: best offset and its number of matching pixels at full resolution
+    """
+    first = image_to_array(first_img)
+    second = image_to_array(second_img)
+
+    # pad the crop, so its border is a multiple of every downscale factor
+    coarsest = 2 ** (con.PYRAMID_LEVELS - 1)
+    margin = -(-max_offset // coarsest) * coarsest
+    padding = margin - max_offset
+    second = np.pad(second, ((0, 0), (padding, padding), (padding, padding)))
+
+    first_levels = [first]
+    second_levels = [second]
+    for _ in range(con.PYRAMID_LEVELS - 1):
+        first_levels.append(_downscale(first_levels[-1]))
+        second_levels.append(_downscale(second_levels[-1]))
+
+    best_offset = (0, 0)
+    best_match_count = 0
+    for level in reversed(range(con.PYRAMID_LEVELS)):
+        factor = 2**level
+        first_level = first_levels[level]
+        second_level = second_levels[level]
+        buffer = np.empty_like(first_level)
+
+        limit = -(-max_offset // factor)
+        if factor == coarsest:
+            # search the complete window
+            center = (0, 0)
+            radius = limit
+        else:
+            center = (best_offset[0] // factor, best_offset[1] // factor)
+            radius = con.PYRAMID_REFINE_RADIUS
+
+        candidates = [
+            (center[0] + dx, center[1] + dy)
+            for dx in range(-radius, radius + 1)
+            for dy in range(-radius, radius + 1)
+            if abs(center[0] + dx) <= limit and abs(center[1] + dy) <= limit
+        ]
+        # like generate_spiral_walk, prefer offsets close to the previous result
+        candidates.sort(key=lambda o: abs(o[0] - center[0]) + abs(o[1] - center[1]))
+
+        level_best = center
+        best_match_count = 0
+        for offset in candidates:
+            matches = _count_matching(
+                offset, first_level, second_level, margin // factor, buffer
             )
-            if p1 and p2 and isinstance(p1, tuple) and isinstance(p2, tuple):
-                # only compare R G B and not Alpha. Since there is random noise a slight difference is allowed
-                if (
-                    abs(p1[0] - p2[0]) + abs(p1[1] - p2[1]) + abs(p1[2] - p2[2])
-                    < con.IMAGE_NOISE_FORGIVENESS
-                ):
-                    matches += 1
-            else:
-                logger.error(f"{p1} {p2} unkown types")
+            if matches > best_match_count:
+                level_best = offset
+                best_match_count = matches
+        best_offset = (level_best[0] * factor, level_best[1] * factor)
+        logger.debug(
+            f"Pyramid level {level}: offset {best_offset} with {best_match_count} matches"
+        )
 
-    return offset, matches
+    return best_offset, best_match_count
+
+
+def fft_registration(
+    first_img: Image.Image, second_img: Image.Image, max_offset: int
+) -> tuple[tuple[int, int], float]:
+    """Finds the best offset of first_img inside second_img in one pass in the frequency domain.
+
+    Computes a masked normalized cross-correlation (NCC) for all offsets at once. Only pixels of second_img
+    that are already set (alpha > 0) are compared, so partly covered panorama crops still work. The cost
+    depends on the image size and not on the number of tried offsets.
+
+    Args:
+        first_img (Image.Image): image that should be placed
+        second_img (Image.Image): crop of the panorama, larger by max_offset in each direction
+        max_offset (int): largest shift in each direction
+
+    Returns:
+        tuple[tuple[int, int], float]: best offset and its correlation between -1 and 1, used as confidence
+    """
+    first = image_to_array(first_img).mean(axis=0)
+    second = image_to_array(second_img).mean(axis=0)
+    mask = (np.asarray(second_img.getchannel("A")) > 0).astype(np.float64)
+
+    height, width = first.shape
+    shape = second.shape
+    # remove the mean, so the sums below do not lose precision
+    first -= first.mean()
+    if mask.any():
+        second -= second[mask > 0].mean()
+    second *= mask
+
+    def spectrum(values: np.ndarray) -> np.ndarray:
+        """Conjugated spectrum of a first_img sized array, zero padded to the size of second_img."""
+        padded = np.zeros(shape)
+        padded[:height, :width] = values
+        return np.conj(np.fft.rfft2(padded))
+
+    def correlate(first_spectrum: np.ndarray, second_values: np.ndarray) -> np.ndarray:
+        """Sum over first_img for each offset, only the valid offsets are returned."""
+        res = np.fft.irfft2(first_spectrum * np.fft.rfft2(second_values), s=shape)
+        return res[: 2 * max_offset + 1, : 2 * max_offset + 1]
+
+    f_ones = spectrum(np.ones_like(first))
+    f_first = spectrum(first)
+    count = correlate(f_ones, mask)
+    sum_first = correlate(f_first, mask)
+    sum_first_sq = correlate(spectrum(first * first), mask)
+    sum_second = correlate(f_ones, second)
+    sum_second_sq = correlate(f_ones, second * second)
+    sum_product = correlate(f_first, second)
+
+    count = np.maximum(np.rint(count), 1)
+    covariance = sum_product - sum_first * sum_second / count
+    variance = np.maximum(sum_first_sq - sum_first**2 / count, 1e-9) * np.maximum(
+        sum_second_sq - sum_second**2 / count, 1e-9
+    )
+    ncc = covariance / np.sqrt(variance)
+    # offsets that barely overlap with set pixels are not trustworthy
+    ncc[count < 0.1 * height * width] = -1
+
+    y_best, x_best = np.unravel_index(np.argmax(ncc), ncc.shape)
+    offset = (int(x_best) - max_offset, int(y_best) - max_offset)
+    return offset, float(ncc[y_best, x_best])
+
+
+def checkpoint_dir(panorama: TiledPanorama) -> str:
+    """Tile directory for the intermediate steps of a stitching run.
+
+    Each canvas keeps its checkpoint in its own directory, so runs at the same time do not replace each
+    other's tiles, and a temporary canvas removes it with delete.
+    """
+    return os.path.join(panorama.directory, "checkpoint")
+
+
+def fits_zone_canvas(zone: tuple[int, int, int, int]) -> bool:
+    """If a zone can be stitched onto a canvas of its own size, see wrap of stitch_images.
+
+    On a wider canvas, images left of the zone would wrap around the world into the border right of it.
+    """
+    width, height = zone_size(zone)
+    return (
+        width + 2 * con.STITCHING_BORDER <= con.WORLD_X
+        and height + 2 * con.STITCHING_BORDER <= con.WORLD_Y
+    )
+
+
+def canvas_position(
+    x: int, y: int, origin: tuple[int, int], wrap: bool
+) -> tuple[int, int]:
+    """Position of a world pixel on a canvas with STITCHING_BORDER, see origin and wrap of stitch_images.
+
+    With wrap every world pixel has one position, so the canvas must not be larger than the world, see
+    fits_zone_canvas.
+    """
+    if wrap:
+        return (
+            (x - origin[0] + con.STITCHING_BORDER) % con.WORLD_X,
+            (y - origin[1] + con.STITCHING_BORDER) % con.WORLD_Y,
+        )
+    return x + con.STITCHING_BORDER - origin[0], y + con.STITCHING_BORDER - origin[1]
+
+
+def blending_compositor(
+    panorama: Image.Image | TiledPanorama,
+) -> Optional[TiledCompositor]:
+    """Compositor for con.BLEND_MODE, None if images simply overwrite each other on this canvas."""
+    if con.BLEND_MODE == "overwrite" or not isinstance(panorama, TiledPanorama):
+        return None
+    return TiledCompositor(panorama, con.BLEND_MODE)
 
 
 # Takes the folder location(including logs/melvonaut/images) and a list of image names
 def stitch_images(
-    image_path: str, image_name_list: list[str], panorama: Optional[Image.Image] = None
-) -> Image.Image:
+    image_path: str,
+    image_name_list: list[str],
+    panorama: Optional[Image.Image | TiledPanorama] = None,
+    nudging_pool: Optional[NudgingPool] = None,
+    processed_images: Optional[dict[str, bool]] = None,
+    origin: tuple[int, int] = (0, 0),
+    coverage_index: Optional[CoverageIndex] = None,
+    on_step: Optional[Callable[[int], None]] = None,
+    image_cache: Optional[ImageCache] = None,
+    wrap: bool = False,
+    placements: Optional[dict[str, tuple[int, int]]] = None,
+) -> Image.Image | TiledPanorama:
     """Main stitching algorithm
-    TODO add existing img
 
     Args:
-        image_path (str): _description_
-        images (list[str]): _description_
-        panorama
+        image_path (str): folder of the images, including logs/melvonaut/images
+        image_name_list (list[str]): names of the images to stitch, in stitching order
+        panorama (Optional[Image.Image | TiledPanorama]): canvas to stitch onto, if not given a
+            temporary TiledPanorama of the whole world is created
+        nudging_pool (Optional[NudgingPool]): workers for the "grid" nudging search, if not given
+            one is started for this run
+        processed_images (Optional[dict[str, bool]]): if given, every processed image name is added,
+            with True if it was placed
+        origin (tuple[int, int]): world position of the canvas without the STITCHING_BORDER, used for
+            regions of the world
+        coverage_index (Optional[CoverageIndex]): if given, every placed image is marked as covered,
+            saving is up to the caller
+        on_step (Optional[Callable[[int], None]]): called every SAVE_PANORAMA_STEP images with the
+            number of consumed names, instead of the default checkpoint, e.g. by a StitchingJob
+        image_cache (Optional[ImageCache]): if given, decoded and resized images are read from and
+            added to it
+        wrap (bool): place images across the world border next to origin, used for canvases of a zone
+        placements (Optional[dict[str, tuple[int, int]]]): if given, the world position (upper left
+            corner) of every placed image is added
 
     Returns:
-        Image.Image: _description_
+        Image.Image | TiledPanorama: the panorama, use it as context manager to remove a temporary canvas
     """
+    # all positions are solved first, then every image is placed once
+    if con.DO_IMAGE_NUDGING_SEARCH and con.IMAGE_NUDGING_MODE == "global":
+        return stitch_images_global(
+            image_path=image_path,
+            image_name_list=image_name_list,
+            panorama=panorama,
+            processed_images=processed_images,
+            origin=origin,
+            coverage_index=coverage_index,
+            on_step=on_step,
+            image_cache=image_cache,
+            wrap=wrap,
+            placements=placements,
+        )
+
+    # regions of the world are stitched in parallel, each region worker stitches in one loop
+    if (
+        con.STITCHING_REGION_WORKERS > 1
+        and not _in_region_worker
+        and not isinstance(panorama, Image.Image)
+        and origin == (0, 0)
+        and not wrap
+    ):
+        return stitch_images_parallel(
+            image_path=image_path,
+            image_name_list=image_name_list,
+            panorama=panorama,
+            workers=con.STITCHING_REGION_WORKERS,
+            processed_images=processed_images,
+            coverage_index=coverage_index,
+            image_cache=image_cache,
+            placements=placements,
+            on_step=on_step,
+        )
+
+    # start the workers once for the whole run
+    if (
+        nudging_pool is None
+        and con.DO_IMAGE_NUDGING_SEARCH
+        and con.IMAGE_NUDGING_MODE == "grid"
+        and con.NUMBER_OF_WORKER_THREADS > 1
+        and not _in_region_worker
+    ):
+        with NudgingPool(
+            workers=con.NUMBER_OF_WORKER_THREADS,
+            max_offset=int((con.SEARCH_GRID_SIDE_LENGTH - 1) / 2),
+        ) as pool:
+            return stitch_images(
+                image_path,
+                image_name_list,
+                panorama,
+                pool,
+                processed_images,
+                origin,
+                coverage_index,
+                on_step,
+                image_cache,
+                wrap,
+                placements,
+            )
+
     # create new panorama if it does not exist
     if panorama is None:
         # add 1000 pixels on each side be used by nudging
-        panorama = Image.new(
-            "RGBA",
+        panorama = TiledPanorama.temporary_canvas(
             (
                 con.WORLD_X + con.STITCHING_BORDER * 2,
                 con.WORLD_Y + con.STITCHING_BORDER * 2,
-            ),
+            )
         )
 
+    # overlapping images are blended into the canvas instead of overwriting it, the compositor is flushed
+    # before every step, its buffers are removed when the loop ends, also when it is stopped by an exception
+    compositor = blending_compositor(panorama)
+
     processed_images_counter = 0
     nudging_failed_counter = 0
     to_few_pixel_counter = 0
     max_offset_database = []
 
     # iterate images
-    for image_name in image_name_list:
-        with Image.open(image_path + image_name) as img:
+    with compositor or contextlib.nullcontext():
+        for image_index, image_name in enumerate(image_name_list):
             # extract image name
             lens_size, x, y = parse_image_name(image_name)
+            # RGBA and resized to lens_size
             try:
-                img = img.convert("RGBA")
+                if image_cache:
+                    img = image_cache.load(image_path + image_name, lens_size)
+                else:
+                    img = decode_image(image_path + image_name, lens_size)
             except OSError as e:
                 logger.warning(
                     f"Could not parse file {image_name}, skipped. Error: {e}"
                 )
                 continue
 
-            # possible resize
-            if lens_size != 600:
-                img = img.resize((lens_size, lens_size), Image.Resampling.LANCZOS)
-
-            logger.info(f"Parsing {image_name}")
-            logger.debug(f"{img.size} {img.mode}")
-
-            # try position in a square arround the center
-            # values 7x7 Grid: d = 3, n = 28   9x9 Grid: d = 4 n = 80   11x11 Grid, d = 5 n = 120
-            spiral_coordinates = generate_spiral_walk(
-                con.SEARCH_GRID_SIDE_LENGTH * con.SEARCH_GRID_SIDE_LENGTH
-            )
+            with img:
+                logger.info(f"Parsing {image_name}")
+                logger.debug(f"{img.size} {img.mode}")
 
-            max_offset = int((con.SEARCH_GRID_SIDE_LENGTH - 1) / 2)
-            existing_stitch = panorama.crop(
-                (
-                    x - max_offset + con.STITCHING_BORDER,
-                    y - max_offset + con.STITCHING_BORDER,
-                    x + lens_size + max_offset + con.STITCHING_BORDER,
-                    y + lens_size + max_offset + con.STITCHING_BORDER,
+                max_offset = int((con.SEARCH_GRID_SIDE_LENGTH - 1) / 2)
+                x, y = canvas_position(x, y, origin, wrap)
+                existing_stitch = panorama.crop(
+                    (
+                        x - max_offset,
+                        y - max_offset,
+                        x + lens_size + max_offset,
+                        y + lens_size + max_offset,
+                    )
                 )
-            )
 
-            # check if existing_stich contains something
-            total_pixel = existing_stitch.size[0] * existing_stitch.size[1]
-            set_pixel = sum(
-                pixel != (0, 0, 0, 0) for pixel in list(existing_stitch.getdata())
-            )
-            empty_pixel = total_pixel - set_pixel
+                # check if existing_stich contains something
+                total_pixel = existing_stitch.size[0] * existing_stitch.size[1]
+                set_pixel = count_set_pixels(existing_stitch)
+                empty_pixel = total_pixel - set_pixel
 
-            logger.debug(
-                f"Existing stich ({existing_stitch.size[0]},{existing_stitch.size[1]}) w. {total_pixel}p "
-                + f"set: {set_pixel} {set_pixel/total_pixel}% and transparent: {empty_pixel} {empty_pixel/total_pixel}%"
-            )
-
-            best_match_count = 0
-            best_offset = (0, 0)
-            skip = False
-
-            # TODO next goal would to move in only one direction in which the matches get better
-            if con.DO_IMAGE_NUDGING_SEARCH:
-                # probiere nur zu match_count falls mehr als 20% aller pixel gefüllt
-                if set_pixel / total_pixel == 0:
-                    logger.warning("Emtpy panoarma, image still placed")
-
-                elif set_pixel / total_pixel > 0.2:
-                    # make a func with static params for this image
-                    count_part = partial(
-                        count_matching_pixels,
-                        first_img=img,
-                        second_img=existing_stitch,
-                        max_offset=max_offset,
-                    )
-
-                    with ProcessPoolExecutor(
-                        max_workers=con.NUMBER_OF_WORKER_THREADS
-                    ) as executor:
-                        # each Thread gets automatically assign a different coordinate from the pool
-                        results = executor.map(count_part, spiral_coordinates)
+                logger.debug(
+                    f"Existing stich ({existing_stitch.size[0]},{existing_stitch.size[1]}) w. {total_pixel}p "
+                    + f"set: {set_pixel} {set_pixel/total_pixel}% and transparent: {empty_pixel} {empty_pixel/total_pixel}%"
+                )
 
-                    for offset, matches in results:
-                        if matches > best_match_count:
+                best_match_count = 0
+                best_offset = (0, 0)
+                skip = False
+
+                # TODO next goal would to move in only one direction in which the matches get better
+                if con.DO_IMAGE_NUDGING_SEARCH:
+                    # probiere nur zu match_count falls mehr als 20% aller pixel gefüllt
+                    if set_pixel / total_pixel == 0:
+                        logger.warning("Emtpy panoarma, image still placed")
+
+                    elif set_pixel / total_pixel > 0.2:
+                        if con.IMAGE_NUDGING_MODE == "fft":
+                            best_offset, confidence = fft_registration(
+                                first_img=img,
+                                second_img=existing_stitch,
+                                max_offset=max_offset,
+                            )
+                            logger.info(
+                                f"FFT registration: offset {best_offset} with confidence {confidence:.3f}"
+                            )
+                            nudging_failed = confidence < con.FFT_MIN_CONFIDENCE
+                            failure_reason = f"confidence: {confidence:.3f}"
+                        elif con.IMAGE_NUDGING_MODE == "pyramid":
+                            best_offset, best_match_count = pyramid_registration(
+                                first_img=img,
+                                second_img=existing_stitch,
+                                max_offset=max_offset,
+                            )
                             logger.info(
-                                f"New best: matches {matches}p ({matches/total_pixel}%), with offset {best_offset}\n"
+                                f"Pyramid search: matches {best_match_count}p ({best_match_count/total_pixel}%), with offset {best_offset}"
+                            )
+                            nudging_failed = best_match_count / (set_pixel) < 0.5
+                            failure_reason = f"best_match_count: {best_match_count}p ({best_match_count/total_pixel}%)"
+                        else:
+                            # try position in a square arround the center
+                            # values 7x7 Grid: d = 3, n = 28   9x9 Grid: d = 4 n = 80   11x11 Grid, d = 5 n = 120
+                            spiral_coordinates = generate_spiral_walk(
+                                con.SEARCH_GRID_SIDE_LENGTH
+                                * con.SEARCH_GRID_SIDE_LENGTH
                             )
-                            best_offset = offset
-                            best_match_count = matches
+                            # every offset is scored as array operation on the RGB values
+                            if nudging_pool:
+                                results = nudging_pool.count_matching_pixels_grid(
+                                    offsets=spiral_coordinates,
+                                    first_img=img,
+                                    second_img=existing_stitch,
+                                    max_offset=max_offset,
+                                )
+                            else:
+                                results = count_matching_pixels_grid(
+                                    offsets=spiral_coordinates,
+                                    first_img=img,
+                                    second_img=existing_stitch,
+                                    max_offset=max_offset,
+                                )
+
+                            for offset, matches in results:
+                                if matches > best_match_count:
+                                    logger.info(
+                                        f"New best: matches {matches}p ({matches/total_pixel}%), with offset {best_offset}\n"
+                                    )
+                                    best_offset = offset
+                                    best_match_count = matches
+                            nudging_failed = best_match_count / (set_pixel) < 0.5
+                            failure_reason = f"best_match_count: {best_match_count}p ({best_match_count/total_pixel}%)"
+
+                        # check if it worked
+                        if nudging_failed:
+                            logger.warning(
+                                f"Nudging failed, image skipped, since {failure_reason}"
+                            )
+
+                            skip = True
+                            nudging_failed_counter += 1
 
-                    # check if it worked
-                    if best_match_count / (set_pixel) < 0.5:
+                            logger.warning(
+                                f"{max(abs(best_offset[0]), abs(best_offset[1]))} {best_offset[0]} {best_offset[1]}"
+                            )
+                            max_offset_database.append(
+                                max(abs(best_offset[0]), abs(best_offset[1]))
+                            )
+                    else:
                         logger.warning(
-                            f"Nudging failed, image skipped, since best_match_count: {best_match_count}p ({best_match_count/total_pixel}%)"
+                            f"Too few pixel on panorama, image skipped, set_pixel%: {set_pixel/total_pixel}"
                         )
-
                         skip = True
-                        nudging_failed_counter += 1
+                        to_few_pixel_counter += 1
 
-                        logger.warning(
-                            f"{max(abs(best_offset[0]), abs(best_offset[1]))} {best_offset[0]} {best_offset[1]}"
-                        )
-                        max_offset_database.append(
-                            max(abs(best_offset[0]), abs(best_offset[1]))
-                        )
-                else:
-                    logger.warning(
-                        f"Too few pixel on panorama, image skipped, set_pixel%: {set_pixel/total_pixel}"
+                    # need to check math for % here!
+                    logger.debug(
+                        f"Placed Image best_match_count: {best_match_count}p ({best_match_count/total_pixel}%) with offset: {best_offset}\n"
                     )
-                    skip = True
-                    to_few_pixel_counter += 1
-
-                # need to check math for % here!
-                logger.debug(
-                    f"Placed Image best_match_count: {best_match_count}p ({best_match_count/total_pixel}%) with offset: {best_offset}\n"
-                )
-
-            if not skip:
-                panorama.paste(
-                    img,
-                    (
-                        x + best_offset[0] + con.STITCHING_BORDER,
-                        y + best_offset[1] + con.STITCHING_BORDER,
-                    ),
-                )
 
-            processed_images_counter += 1
-            if processed_images_counter % con.SAVE_PANORAMA_STEP == 0:
-                panorama.save(
-                    con.PANORAMA_PATH + "step_" + str(processed_images_counter) + ".png"
-                )
+                if not skip:
+                    (compositor or panorama).paste(
+                        img, (x + best_offset[0], y + best_offset[1])
+                    )
+                    world_x = x + best_offset[0] - con.STITCHING_BORDER + origin[0]
+                    world_y = y + best_offset[1] - con.STITCHING_BORDER + origin[1]
+                    if coverage_index:
+                        coverage_index.add_image(
+                            get_angle(image_name), world_x, world_y
+                        )
+                    if placements is not None:
+                        placements[image_name] = (
+                            world_x % con.WORLD_X,
+                            world_y % con.WORLD_Y,
+                        )
 
-        # if any(pixel < 255 for pixel in alpha.getdata()):
-        #    return True
+                processed_images_counter += 1
+                if processed_images is not None:
+                    processed_images[image_name] = not skip
+                if processed_images_counter % con.SAVE_PANORAMA_STEP == 0:
+                    if compositor:
+                        compositor.flush()
+                    if on_step:
+                        on_step(image_index + 1)
+                    elif isinstance(panorama, TiledPanorama):
+                        # only tiles changed since the last step are written
+                        panorama.checkpoint(
+                            checkpoint_dir(panorama),
+                            workers=con.NUMBER_OF_WORKER_THREADS,
+                        )
+                    else:
+                        panorama.save(
+                            con.PANORAMA_PATH
+                            + "step_"
+                            + str(processed_images_counter)
+                            + ".png"
+                        )
 
-        if processed_images_counter >= con.STITCHING_COUNT_LIMIT:
-            logger.warning(
-                f"STITCHING_COUNT_LIMIT of {con.STITCHING_COUNT_LIMIT} reached!"
-            )
-            break
+            # if any(pixel < 255 for pixel in alpha.getdata()):
+            #    return True
 
     logger.warning(
         f"\n\nDone stitching of {processed_images_counter} from {len(image_name_list)} given images"
@@ -234,6 +754,508 @@ def stitch_images(
     return panorama
 
 
+def stitch_images_global(
+    image_path: str,
+    image_name_list: list[str],
+    panorama: Optional[Image.Image | TiledPanorama] = None,
+    processed_images: Optional[dict[str, bool]] = None,
+    origin: tuple[int, int] = (0, 0),
+    coverage_index: Optional[CoverageIndex] = None,
+    on_step: Optional[Callable[[int], None]] = None,
+    image_cache: Optional[ImageCache] = None,
+    wrap: bool = False,
+    placements: Optional[dict[str, tuple[int, int]]] = None,
+) -> Image.Image | TiledPanorama:
+    """Stitching with IMAGE_NUDGING_MODE "global", same arguments as stitch_images.
+
+    The offsets of all images are solved together by alignment.align_images before anything is placed,
+    then each image is pasted once at its corrected position. Nothing is read back from the canvas, so
+    images already on it are not used for the alignment.
+    """
+    # alignment uses fft_registration of this module
+    from rift_console.alignment import align_images
+
+    if panorama is None:
+        panorama = TiledPanorama.temporary_canvas(
+            (
+                con.WORLD_X + con.STITCHING_BORDER * 2,
+                con.WORLD_Y + con.STITCHING_BORDER * 2,
+            )
+        )
+
+    offsets = align_images(
+        image_path=image_path,
+        image_name_list=image_name_list,
+        max_offset=int((con.SEARCH_GRID_SIDE_LENGTH - 1) / 2),
+        image_cache=image_cache,
+    )
+
+    compositor = blending_compositor(panorama)
+    processed_images_counter = 0
+    with compositor or contextlib.nullcontext():
+        for image_index, image_name in enumerate(image_name_list):
+            lens_size, x, y = parse_image_name(image_name)
+            try:
+                if image_cache:
+                    img = image_cache.load(image_path + image_name, lens_size)
+                else:
+                    img = decode_image(image_path + image_name, lens_size)
+            except OSError as e:
+                logger.warning(
+                    f"Could not parse file {image_name}, skipped. Error: {e}"
+                )
+                continue
+
+            with img:
+                x += offsets[image_name][0]
+                y += offsets[image_name][1]
+                (compositor or panorama).paste(img, canvas_position(x, y, origin, wrap))
+                if coverage_index:
+                    coverage_index.add_image(get_angle(image_name), x, y)
+                if placements is not None:
+                    placements[image_name] = (x % con.WORLD_X, y % con.WORLD_Y)
+
+            processed_images_counter += 1
+            if processed_images is not None:
+                processed_images[image_name] = True
+            if processed_images_counter % con.SAVE_PANORAMA_STEP == 0:
+                if compositor:
+                    compositor.flush()
+                if on_step:
+                    on_step(image_index + 1)
+                elif isinstance(panorama, TiledPanorama):
+                    panorama.checkpoint(
+                        checkpoint_dir(panorama), workers=con.NUMBER_OF_WORKER_THREADS
+                    )
+
+    logger.warning(
+        f"\n\nDone stitching of {processed_images_counter} from {len(image_name_list)} given images"
+    )
+    return panorama
+
+
+def _init_region_worker() -> None:
+    """Initializer of the region worker processes."""
+    global _in_region_worker
+    _in_region_worker = True
+
+
+def _region_of(x: int, y: int, columns: int, rows: int) -> int:
+    """Index of the region that contains the world position, row-major and with wraparound."""
+    column = (x % con.WORLD_X) // con.STITCHING_REGION_SIZE
+    row = (y % con.WORLD_Y) // con.STITCHING_REGION_SIZE
+    return min(row, rows - 1) * columns + min(column, columns - 1)
+
+
+def _stitch_region(
+    image_path: str,
+    image_name_list: list[str],
+    origin: tuple[int, int],
+    region_dir: str,
+    parent_dir: Optional[str],
+    image_cache: Optional[ImageCache] = None,
+) -> tuple[dict[str, bool], dict[str, tuple[int, int]], tuple[int, int, int, int]]:
+    """Stitches the images of one region onto its own canvas, runs in a worker process.
+
+    The region canvas has the layout of the world canvas, moved by origin. If the images are added to an
+    existing panorama, its content is copied first, so nudging can match against it. Afterwards every
+    pixel that was not changed is made transparent again, so only new pixels are merged back.
+
+    Returns:
+        tuple: processed images, their world positions and the box on the region canvas that contains all changes
+    """
+    max_offset = int((con.SEARCH_GRID_SIDE_LENGTH - 1) / 2)
+    # images start inside the region, so the border plus max_offset holds everything
+    region_size = con.STITCHING_REGION_SIZE + 2 * con.STITCHING_BORDER + max_offset
+    region = TiledPanorama(region_dir, size=(region_size, region_size))
+
+    # area that can be touched by the images of this region
+    boxes = []
+    for image_name in image_name_list:
+        lens_size, x, y = parse_image_name(image_name)
+        x += con.STITCHING_BORDER - origin[0]
+        y += con.STITCHING_BORDER - origin[1]
+        boxes.append(
+            (
+                x - max_offset,
+                y - max_offset,
+                x + lens_size + max_offset,
+                y + lens_size + max_offset,
+            )
+        )
+    box = (
+        max(0, min(b[0] for b in boxes)),
+        max(0, min(b[1] for b in boxes)),
+        min(region_size, max(b[2] for b in boxes)),
+        min(region_size, max(b[3] for b in boxes)),
+    )
+
+    parent = TiledPanorama(parent_dir) if parent_dir else None
+
+    def parent_box(top: int, bottom: int) -> tuple[int, int, int, int]:
+        return (
+            box[0] + origin[0],
+            top + origin[1],
+            box[2] + origin[0],
+            bottom + origin[1],
+        )
+
+    def row_ranges() -> list[tuple[int, int]]:
+        return [
+            (top, min(box[3], top + region.tile_size))
+            for top in range(box[1], box[3], region.tile_size)
+        ]
+
+    if parent:
+        for top, bottom in row_ranges():
+            region.paste_array(
+                parent.crop_array(parent_box(top, bottom)), (box[0], top)
+            )
+
+    processed: dict[str, bool] = {}
+    placements: dict[str, tuple[int, int]] = {}
+    stitch_images(
+        image_path=image_path,
+        image_name_list=image_name_list,
+        panorama=region,
+        processed_images=processed,
+        origin=origin,
+        image_cache=image_cache,
+        placements=placements,
+    )
+
+    if parent:
+        for top, bottom in row_ranges():
+            pixels = region.crop_array((box[0], top, box[2], bottom))
+            unchanged = np.all(
+                pixels == parent.crop_array(parent_box(top, bottom)), axis=2
+            )
+            pixels[unchanged] = 0
+            region.paste_array(pixels, (box[0], top))
+
+    region.flush()
+    return processed, placements, box
+
+
+def stitch_images_parallel(
+    image_path: str,
+    image_name_list: list[str],
+    panorama: Optional[TiledPanorama] = None,
+    workers: int = con.STITCHING_REGION_WORKERS,
+    processed_images: Optional[dict[str, bool]] = None,
+    coverage_index: Optional[CoverageIndex] = None,
+    image_cache: Optional[ImageCache] = None,
+    placements: Optional[dict[str, tuple[int, int]]] = None,
+    on_step: Optional[Callable[[int], None]] = None,
+) -> TiledPanorama:
+    """Stitches the world in regions of STITCHING_REGION_SIZE at the same time, one worker process per region.
+
+    Every image belongs to the region that contains its upper left corner (with the x/y wraparound of the
+    world). Inside a region images are placed in the given order, like in stitch_images. When all regions
+    are done they are merged in row-major region order, where regions overlap the later region wins, so
+    the result does not depend on which worker finished first. Images at the edge of a region are nudged
+    only against images of the same region.
+
+    With on_step, the names are stitched in steps of SAVE_PANORAMA_STEP, all regions of a step are merged
+    before on_step is called, so the consumed names are always a prefix of image_name_list.
+
+    Args:
+        image_path (str): folder of the images
+        image_name_list (list[str]): images in stitching order
+        panorama (Optional[TiledPanorama]): canvas to add the images to, a temporary one if not given
+        workers (int): number of processes
+        processed_images (Optional[dict[str, bool]]): if given, every processed image name is added
+        coverage_index (Optional[CoverageIndex]): if given, placed images are marked at their placed position
+        image_cache (Optional[ImageCache]): shared with the workers, they use the same cache directory
+        placements (Optional[dict[str, tuple[int, int]]]): if given, world positions of the placed images are added
+        on_step (Optional[Callable[[int], None]]): called after each step with the number of consumed names,
+            e.g. by a StitchingJob
+
+    Returns:
+        TiledPanorama: the panorama
+    """
+    # images are added to an existing panorama, workers need to see its content
+    parent_dir = None
+    if panorama is None:
+        panorama = TiledPanorama.temporary_canvas(
+            (
+                con.WORLD_X + con.STITCHING_BORDER * 2,
+                con.WORLD_Y + con.STITCHING_BORDER * 2,
+            )
+        )
+    else:
+        panorama.flush()
+        parent_dir = panorama.directory
+
+    columns = math.ceil(con.WORLD_X / con.STITCHING_REGION_SIZE)
+    rows = math.ceil(con.WORLD_Y / con.STITCHING_REGION_SIZE)
+    step_size = con.SAVE_PANORAMA_STEP if on_step else max(1, len(image_name_list))
+
+    logger.warning(
+        f"Stitching {len(image_name_list)} images in regions with {workers} workers"
+    )
+
+    merged = 0
+    os.makedirs(con.CONSOLE_PANORAMA_PATH, exist_ok=True)
+    regions_dir = tempfile.mkdtemp(prefix="regions_", dir=con.CONSOLE_PANORAMA_PATH)
+    try:
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=get_context("spawn"),
+            initializer=_init_region_worker,
+        ) as executor:
+            for step_start in range(0, len(image_name_list), step_size):
+                step_names = image_name_list[step_start : step_start + step_size]
+                regions: list[list[str]] = [[] for _ in range(columns * rows)]
+                for image_name in step_names:
+                    _, x, y = parse_image_name(image_name)
+                    regions[_region_of(x, y, columns, rows)].append(image_name)
+
+                futures = {
+                    index: executor.submit(
+                        _stitch_region,
+                        image_path,
+                        names,
+                        (
+                            (index % columns) * con.STITCHING_REGION_SIZE,
+                            (index // columns) * con.STITCHING_REGION_SIZE,
+                        ),
+                        os.path.join(regions_dir, str(index)),
+                        parent_dir,
+                        image_cache,
+                    )
+                    for index, names in enumerate(regions)
+                    if names
+                }
+                results = {index: future.result() for index, future in futures.items()}
+
+                # merge in fixed order, only set pixels overwrite what is already there
+                for index in sorted(results):
+                    processed, region_placements, box = results[index]
+                    if processed_images is not None:
+                        processed_images.update(processed)
+                    if placements is not None:
+                        placements.update(region_placements)
+                    if coverage_index:
+                        for image_name, (x, y) in region_placements.items():
+                            coverage_index.add_image(get_angle(image_name), x, y)
+                    origin = (
+                        (index % columns) * con.STITCHING_REGION_SIZE,
+                        (index // columns) * con.STITCHING_REGION_SIZE,
+                    )
+                    region = TiledPanorama(os.path.join(regions_dir, str(index)))
+                    for top in range(box[1], box[3], region.tile_size):
+                        bottom = min(box[3], top + region.tile_size)
+                        panorama.paste_array(
+                            region.crop_array((box[0], top, box[2], bottom)),
+                            (box[0] + origin[0], top + origin[1]),
+                            only_set=True,
+                        )
+                    region.delete()
+                merged += len(results)
+
+                if on_step:
+                    on_step(step_start + len(step_names))
+                # the next step is nudged against everything merged so far
+                panorama.flush()
+                parent_dir = panorama.directory
+    finally:
+        shutil.rmtree(regions_dir, ignore_errors=True)
+
+    logger.warning(f"Merged {merged} regions")
+    return panorama
+
+
+STITCHING_MANIFEST = "manifest.json"
+
+
+def load_manifest(panorama_dir: str) -> dict[str, bool]:
+    """Loads which images are already part of a persisted panorama.
+
+    Args:
+        panorama_dir (str): folder of the TiledPanorama
+
+    Returns:
+        dict[str, bool]: image name and if it was placed (False if nudging skipped it), empty for a new panorama
+    """
+    manifest_path = os.path.join(panorama_dir, STITCHING_MANIFEST)
+    if not os.path.isfile(manifest_path):
+        return {}
+    with open(manifest_path, "r") as f:
+        manifest: dict[str, bool] = json.load(f)["images"]
+    return manifest
+
+
+def save_manifest(panorama_dir: str, manifest: dict[str, bool]) -> None:
+    """Stores the manifest next to the panorama, replaced in one step so it can not be half written."""
+    manifest_path = os.path.join(panorama_dir, STITCHING_MANIFEST)
+    with open(manifest_path + ".tmp", "w") as f:
+        json.dump({"images": manifest}, f)
+    os.replace(manifest_path + ".tmp", manifest_path)
+
+
+def update_stitching(
+    image_path: str,
+    image_name_list: list[str],
+    panorama_dir: str = con.CONSOLE_WORLDMAP_PATH,
+    image_cache: Optional[ImageCache] = None,
+) -> tuple[TiledPanorama, list[str]]:
+    """Stitches only images that are not yet in the persisted panorama in panorama_dir onto it.
+
+    The panorama and its manifest are created on the first run. Images that were processed before are
+    not opened again, also the ones nudging skipped, so the runtime only depends on the new images.
+
+    Args:
+        image_path (str): folder of the images
+        image_name_list (list[str]): all known images, in stitching order
+        panorama_dir (str): folder of the persisted TiledPanorama
+        image_cache (Optional[ImageCache]): passed on to stitch_images
+
+    Returns:
+        tuple[TiledPanorama, list[str]]: the updated panorama and the names of the newly processed images
+    """
+    manifest = load_manifest(panorama_dir)
+    if not manifest and os.path.isfile(
+        os.path.join(panorama_dir, TiledPanorama.META_FILE)
+    ):
+        # canvas without manifest can not be trusted, e.g. if a previous run crashed
+        TiledPanorama(panorama_dir).delete()
+
+    panorama = TiledPanorama(
+        panorama_dir,
+        size=(
+            con.WORLD_X + con.STITCHING_BORDER * 2,
+            con.WORLD_Y + con.STITCHING_BORDER * 2,
+        ),
+    )
+    new_images = [name for name in image_name_list if name not in manifest]
+    logger.warning(
+        f"Updating panorama {panorama_dir}: {len(manifest)} images already stitched, {len(new_images)} new"
+    )
+    if not new_images:
+        return panorama, []
+
+    processed: dict[str, bool] = {}
+    stitch_images(
+        image_path=image_path,
+        image_name_list=new_images,
+        panorama=panorama,
+        processed_images=processed,
+        image_cache=image_cache,
+    )
+
+    # pixels first, so the manifest never lists images that are not on disk
+    panorama.flush()
+    manifest.update(processed)
+    save_manifest(panorama_dir, manifest)
+
+    return panorama, list(processed)
+
+
+def zone_box(
+    zone: tuple[int, int, int, int], origin: tuple[int, int] = (0, 0)
+) -> tuple[int, int, int, int]:
+    """Area of a zone (in world coordinates) on a panorama from stitch_images with the given origin."""
+    x1 = int(zone[0]) - origin[0] + con.STITCHING_BORDER
+    y1 = int(zone[1]) - origin[1] + con.STITCHING_BORDER
+    width, height = zone_size(zone)
+    return (x1, y1, x1 + width, y1 + height)
+
+
+def zone_coverage(
+    panorama: Image.Image | TiledPanorama,
+    zone: tuple[int, int, int, int],
+    origin: tuple[int, int] = (0, 0),
+) -> float:
+    """Share of a zone (in world coordinates) that is already covered on a panorama from stitch_images.
+
+    Args:
+        panorama (Image.Image | TiledPanorama): panorama including the STITCHING_BORDER
+        zone (tuple[int, int, int, int]): x1, y1, x2, y2 of the zone
+        origin (tuple[int, int]): origin the panorama was stitched with
+
+    Returns:
+        float: covered share between 0 and 1
+    """
+    box = zone_box(zone, origin)
+    if isinstance(panorama, TiledPanorama):
+        return panorama.coverage(box)
+    return coverage(panorama.crop(box))
+
+
+def thumbnail_size(width: int, height: int) -> tuple[int, int]:
+    """Largest size within THUMBNAIL_X and THUMBNAIL_Y with the aspect ratio of width and height."""
+    scale = min(con.THUMBNAIL_X / width, con.THUMBNAIL_Y / height)
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def save_panorama(
+    panorama: Image.Image | TiledPanorama,
+    path: str,
+    zone: Optional[tuple[int, int, int, int]] = None,
+    origin: tuple[int, int] = (0, 0),
+    tile_pyramid: Optional[bool] = None,
+) -> None:
+    """Saves a panorama from stitch_images without the STITCHING_BORDER, including its thumbnail.
+
+    A TiledPanorama is written tile by tile, so the full world map never has to be in memory at once.
+    With tile_pyramid a zoomable tile pyramid is written to con.CONSOLE_TILES_PATH as well, named like
+    the output file.
+
+    Args:
+        panorama (Image.Image | TiledPanorama): result of stitch_images
+        path (str): output file, the thumbnail is stored next to it as *_thumb.png, see thumbnail_size
+        zone (Optional[tuple[int, int, int, int]]): if given, this area is also saved as *_cut.png
+        origin (tuple[int, int]): origin the panorama was stitched with, see stitch_zone
+        tile_pyramid (Optional[bool]): also write the tile pyramid, con.EMIT_TILE_PYRAMID if not given
+    """
+    if tile_pyramid is None:
+        tile_pyramid = con.EMIT_TILE_PYRAMID
+    remove_offset = (
+        con.STITCHING_BORDER,
+        con.STITCHING_BORDER,
+        panorama.size[0] - con.STITCHING_BORDER,
+        panorama.size[1] - con.STITCHING_BORDER,
+    )
+    thumb_path = path.replace(".png", "") + "_thumb.png"
+    # zones keep their aspect ratio, the world fills THUMBNAIL_X and THUMBNAIL_Y
+    thumb_size = thumbnail_size(
+        remove_offset[2] - remove_offset[0], remove_offset[3] - remove_offset[1]
+    )
+    if isinstance(panorama, TiledPanorama):
+        panorama.save(path, box=remove_offset)
+        panorama.thumbnail(thumb_size, box=remove_offset).save(thumb_path)
+    else:
+        world = panorama.crop(remove_offset)
+        world.save(path)
+        world.resize(thumb_size, Image.Resampling.LANCZOS).save(thumb_path)
+    logger.warning(f"Saved panorama to {path} and thumbnail to {thumb_path}")
+
+    if tile_pyramid:
+        pyramid_dir = os.path.join(
+            con.CONSOLE_TILES_PATH, os.path.basename(path).replace(".png", "")
+        )
+        if isinstance(panorama, TiledPanorama):
+            panorama.write_pyramid(
+                pyramid_dir, box=remove_offset, workers=con.NUMBER_OF_WORKER_THREADS
+            )
+        else:
+            write_tile_pyramid(
+                lambda box: np.asarray(world.crop(box).convert("RGBA")),
+                world.size[0],
+                world.size[1],
+                pyramid_dir,
+                workers=con.NUMBER_OF_WORKER_THREADS,
+            )
+        logger.warning(f"Saved tile pyramid to {pyramid_dir}")
+
+    if zone:
+        cut_box = zone_box(zone, origin)
+        cut_path = path.replace(".png", "") + "_cut.png"
+        panorama.crop(cut_box).save(cut_path)
+        logger.warning(f"Saved cut to {cut_path}")
+
+
 def upload(id: int, path: str, folder: bool = False) -> None:
     """Uploads one objective image" """
 
@@ -296,12 +1318,30 @@ def create_thumbnail(panorama_path: str) -> None:
     logger.warning(f"Saved Thumbnail to {panorama_path}_thumb.png")
 
 
-# TODO add parameter to add new stiches onto an exisiting map
-def automated_stitching(local_path: str) -> None:
+def update_world_map(image_path: str, path: str) -> tuple[int, int]:
+    """Adds new images of image_path to the persisted world map and saves it to path, see update_stitching.
+
+    Returns:
+        tuple[int, int]: number of new images and of all images
+    """
+    image_name_list = find_image_names(image_path)
+    panorama, new_images = update_stitching(
+        image_path=image_path,
+        image_name_list=image_name_list,
+        image_cache=console_image_cache(),
+    )
+    with panorama:
+        if new_images or not os.path.isfile(path):
+            save_panorama(panorama, path)
+    return len(new_images), len(image_name_list)
+
+
+def automated_stitching(local_path: str, update: bool = False) -> None:
     """Stitches images from the given path into one big image, which is stored under the same name in con.PANORAMA_PATH.
 
     Args:
         local_path (str): Path of a folder with images that should be stitched.
+        update (bool): Add only new images onto the persisted panorama in con.PANORAMA_PATH instead of starting empty.
     """
 
     image_path = local_path + "/"
@@ -313,16 +1353,22 @@ def automated_stitching(local_path: str) -> None:
         f"Starting stitching of {len(image_name_list)} image with path: {image_path}"
     )
 
-    panorama = stitch_images(image_path=image_path, image_name_list=image_name_list)
-
-    remove_offset = (
-        con.STITCHING_BORDER,
-        con.STITCHING_BORDER,
-        con.WORLD_X + con.STITCHING_BORDER,
-        con.WORLD_Y + con.STITCHING_BORDER,
-    )
-    panorama = panorama.crop(remove_offset)
-    panorama.save(output_path + ".png")
+    panorama: Image.Image | TiledPanorama
+    if update:
+        panorama, _ = update_stitching(
+            image_path=image_path,
+            image_name_list=image_name_list,
+            panorama_dir=con.PANORAMA_PATH + "stitched_panorama/",
+            image_cache=console_image_cache(),
+        )
+    else:
+        panorama = stitch_images(
+            image_path=image_path,
+            image_name_list=image_name_list,
+            image_cache=console_image_cache(),
+        )
+    with panorama:
+        save_panorama(panorama, output_path + ".png")
 
     logger.warning(f"Saved panorama in {output_path}.png")
 
@@ -333,6 +1379,7 @@ if __name__ == "__main__":
 
     if len(sys.argv) < 2:
         print("Usage: python3 src/rift_console/image_processing.py stitch PATH")
+        print("Usage: python3 src/rift_console/image_processing.py update PATH")
         print("Usage: python3 src/rift_console/image_processing.py thumb PATH")
         print(
             "Usage: python3 src/rift_console/image_processing.py cut PATH X1 Y1 X2 Y2"
@@ -347,6 +1394,13 @@ if __name__ == "__main__":
             sys.exit(0)
         print("Usage: python3 src/rift_console/image_processing.py stitch PATH")
         sys.exit(1)
+    # Stitch only new images onto the existing panorama
+    elif sys.argv[1] == "update":
+        if len(sys.argv) == 3:
+            automated_stitching(local_path=sys.argv[2], update=True)
+            sys.exit(0)
+        print("Usage: python3 src/rift_console/image_processing.py update PATH")
+        sys.exit(1)
     # Create Thumbnail
     elif sys.argv[1] == "thumb":
         if len(sys.argv) == 3:
@@ -0,0 +1,225 @@
+"""
+
+Queue of background jobs for the console, stitching and other image work runs in separate processes.
+
+"""
+
+import asyncio
+import datetime
+import threading
+import uuid
+from concurrent.futures import Future, ProcessPoolExecutor
+from multiprocessing import get_context
+from typing import Any, Callable, Optional
+
+from loguru import logger
+from pydantic import BaseModel, Field
+
+import shared.constants as con
+from rift_console.stitching_job import JobStatus, StitchingJob
+
+
+class JobInfo(BaseModel):
+    """Status of one queued job, as shown by the /jobs endpoint."""
+
+    job_id: str
+    kind: str
+    description: str
+    status: JobStatus = JobStatus.Pending
+    # percent, stitching jobs report it at every checkpoint, other jobs only at the end
+    progress: float = 0.0
+    created: datetime.datetime = Field(
+        default_factory=lambda: datetime.datetime.now(datetime.timezone.utc)
+    )
+    error: str = ""
+
+
+def _run_stitching_job(job_id: str) -> StitchingJob:
+    """Worker side of JobManager.submit_stitching, the job is loaded from disk in the worker process."""
+    job = StitchingJob.load(job_id)
+    job.run()
+    return job
+
+
+class JobManager:
+    """Runs jobs one after another in a pool of CONSOLE_JOB_WORKERS processes.
+
+    Jobs are queued by the pool, submitting never waits for the work. Stitching jobs report their
+    progress through their job file and can be cancelled while running, other jobs only before they start.
+    """
+
+    def __init__(self, workers: int = con.CONSOLE_JOB_WORKERS) -> None:
+        self.workers = workers
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._jobs: dict[str, JobInfo] = {}
+        self._futures: dict[str, Future[Any]] = {}
+        # done callbacks run in a thread of the pool
+        self._lock = threading.Lock()
+
+    def _pool(self) -> ProcessPoolExecutor:
+        """Started on first use, so importing the console does not spawn processes."""
+        if self._executor is None:
+            # spawn instead of fork, since the console runs next to other threads
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=get_context("spawn")
+            )
+            logger.info(f"Started JobManager with {self.workers} workers")
+        return self._executor
+
+    def _submit(
+        self,
+        info: JobInfo,
+        function: Callable[..., Any],
+        args: tuple[Any, ...],
+        on_done: Optional[Callable[[Any], None]],
+    ) -> str:
+        # on_done changes console state, so it runs in the event loop of the console and not in the pool's thread
+        try:
+            loop: Optional[asyncio.AbstractEventLoop] = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        future = self._pool().submit(function, *args)
+        with self._lock:
+            self._jobs[info.job_id] = info
+            self._futures[info.job_id] = future
+        logger.info(f"Queued {info.kind} job {info.job_id}: {info.description}")
+
+        def done(future: Future[Any]) -> None:
+            if future.cancelled():
+                with self._lock:
+                    info.status = JobStatus.Cancelled
+                return
+            if future.exception() is not None:
+                with self._lock:
+                    info.status = JobStatus.Failed
+                    info.error = repr(future.exception())
+                logger.error(f"{info.kind} job {info.job_id} failed: {info.error}")
+                return
+            result = future.result()
+            with self._lock:
+                if isinstance(result, StitchingJob):
+                    info.status = result.status
+                    info.progress = result.progress
+                else:
+                    info.status = JobStatus.Done
+                    info.progress = 100.0
+            logger.info(f"{info.kind} job {info.job_id} finished as {info.status}")
+            if on_done is None:
+                return
+            if loop is None:
+                on_done(result)
+            elif not loop.is_closed():
+                loop.call_soon_threadsafe(on_done, result)
+
+        future.add_done_callback(done)
+        return info.job_id
+
+    def submit(
+        self,
+        kind: str,
+        description: str,
+        function: Callable[..., Any],
+        *args: Any,
+        on_done: Optional[Callable[[Any], None]] = None,
+    ) -> str:
+        """Queues any function, e.g. create_thumbnail or cut from image_processing.
+
+        Args:
+            kind (str): short name shown in the job list
+            description (str): shown in the job list
+            function (Callable[..., Any]): module level function, it is pickled to the worker
+            args (Any): arguments of function, also pickled
+            on_done (Optional[Callable[[Any], None]]): called with the result in the console process,
+                in its event loop if submitted from one
+
+        Returns:
+            str: id of the job
+        """
+        info = JobInfo(job_id=uuid.uuid4().hex[:8], kind=kind, description=description)
+        return self._submit(info, function, args, on_done)
+
+    def submit_stitching(
+        self,
+        job: StitchingJob,
+        on_done: Optional[Callable[[StitchingJob], None]] = None,
+    ) -> str:
+        """Queues a stored StitchingJob, its job_id is also the id in this queue.
+
+        Args:
+            job (StitchingJob): created or interrupted job
+            on_done (Optional[Callable[[StitchingJob], None]]): called with the finished job in the console process,
+                in its event loop if submitted from one
+
+        Returns:
+            str: id of the job
+        """
+        info = JobInfo(
+            job_id=job.job_id,
+            kind="stitch",
+            description=f"{job.image_count} images -> {job.output_path}",
+            progress=job.progress,
+        )
+        return self._submit(info, _run_stitching_job, (job.job_id,), on_done)
+
+    def status(self, job_id: str) -> Optional[JobInfo]:
+        """Current status of a job, stitching jobs are read from their job file."""
+        with self._lock:
+            info = self._jobs.get(job_id)
+            future = self._futures.get(job_id)
+        if info is None or future is None:
+            return None
+        if future.done():
+            return info
+        if future.running():
+            info.status = JobStatus.Running
+        if info.kind == "stitch":
+            try:
+                job = StitchingJob.load(job_id)
+            except (OSError, ValueError):
+                # job file is replaced in that moment
+                return info
+            info.progress = job.progress
+            if job.cancel_requested:
+                info.status = JobStatus.Cancelled
+        return info
+
+    def list_jobs(self) -> list[JobInfo]:
+        """All jobs submitted since the console started, newest first."""
+        with self._lock:
+            job_ids = list(self._jobs)
+        infos = [self.status(job_id) for job_id in job_ids]
+        return sorted(
+            [info for info in infos if info is not None],
+            key=lambda info: info.created,
+            reverse=True,
+        )
+
+    def cancel(self, job_id: str) -> bool:
+        """Cancels a job, queued jobs are dropped, running stitching jobs stop at their next checkpoint.
+
+        Returns:
+            bool: True if the job is or will be cancelled
+        """
+        with self._lock:
+            info = self._jobs.get(job_id)
+            future = self._futures.get(job_id)
+        if info is None or future is None or future.done():
+            return False
+        if future.cancel():
+            if info.kind == "stitch":
+                job = StitchingJob.load(job_id)
+                job.status = JobStatus.Cancelled
+                job.save()
+            logger.warning(f"Cancelled queued {info.kind} job {job_id}")
+            return True
+        if info.kind == "stitch":
+            StitchingJob.load(job_id).request_cancel()
+            return True
+        logger.warning(f"{info.kind} job {job_id} is already running, can not cancel")
+        return False
+
+    def shutdown(self) -> None:
+        """Drops all queued jobs and waits for the running ones."""
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
@@ -0,0 +1,717 @@
+"""
+
+Panorama canvas for stitching that is split into tiles and stored on disk instead of in RAM.
+
+"""
+
+import json
+import math
+import os
+import shutil
+import struct
+import tempfile
+import uuid
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from types import TracebackType
+from typing import Callable, Iterator, Literal, Optional
+
+import numpy as np
+from loguru import logger
+from PIL import Image
+
+import shared.constants as con
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# how many compressed bytes are collected before a PNG IDAT chunk is written
+PNG_CHUNK_SIZE = 1 << 20
+
+
+def _png_chunk(chunk_type: bytes, data: bytes) -> bytes:
+    """Creates one PNG chunk including length and checksum."""
+    checksum = zlib.crc32(chunk_type + data) & 0xFFFFFFFF
+    return (
+        struct.pack(">I", len(data)) + chunk_type + data + struct.pack(">I", checksum)
+    )
+
+
+def write_png(path: str, width: int, height: int, strips: Iterator[np.ndarray]) -> None:
+    """Writes an RGBA PNG from horizontal strips, without ever holding the full image in memory.
+
+    Each scanline uses the PNG "Up" filter, which works well on images and can be computed with numpy.
+
+    Args:
+        path (str): output file
+        width (int): image width
+        height (int): image height
+        strips (Iterator[np.ndarray]): uint8 arrays of shape (rows, width, 4), from top to bottom
+    """
+    compressor = zlib.compressobj(level=6)
+    previous = np.zeros(width * 4, dtype=np.uint8)
+    written_rows = 0
+    with open(path, "wb") as f:
+        f.write(PNG_SIGNATURE)
+        f.write(
+            _png_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0))
+        )
+        pending = bytearray()
+        for strip in strips:
+            rows = strip.reshape(strip.shape[0], width * 4)
+            filtered = np.empty((rows.shape[0], width * 4 + 1), dtype=np.uint8)
+            filtered[:, 0] = 2  # filter type Up
+            filtered[0, 1:] = rows[0] - previous
+            filtered[1:, 1:] = rows[1:] - rows[:-1]
+            previous = rows[-1].copy()
+            written_rows += rows.shape[0]
+
+            pending += compressor.compress(filtered.tobytes())
+            if len(pending) >= PNG_CHUNK_SIZE:
+                f.write(_png_chunk(b"IDAT", bytes(pending)))
+                pending.clear()
+        pending += compressor.flush()
+        f.write(_png_chunk(b"IDAT", bytes(pending)))
+        f.write(_png_chunk(b"IEND", b""))
+
+    if written_rows != height:
+        raise ValueError(f"write_png: got {written_rows} rows instead of {height}")
+
+
+PYRAMID_INDEX = "pyramid.json"
+
+
+def write_tile_pyramid(
+    read_box: Callable[[tuple[int, int, int, int]], np.ndarray],
+    width: int,
+    height: int,
+    directory: str,
+    tile_size: int = con.TILE_PYRAMID_SIZE,
+    workers: int = 4,
+) -> int:
+    """Writes a zoomable tile pyramid of an image, as used by Leaflet and similar map viewers.
+
+    The highest zoom level has the full resolution, each level below is half the size, down to level 0
+    where the whole image fits into one tile. Tiles are stored as {z}/{x}_{y}.png, fully transparent ones
+    are left out. Only one row of full resolution tiles is read at a time, the lower levels are built from
+    the four tiles one level up.
+
+    Args:
+        read_box (Callable): returns the uint8 RGBA pixels of a box (x1, y1, x2, y2) of the image
+        width (int): image width
+        height (int): image height
+        directory (str): output folder, an existing pyramid in it is replaced
+        tile_size (int): side length of the tiles
+        workers (int): threads used for encoding
+
+    Returns:
+        int: number of written tiles
+    """
+    max_zoom = max(0, math.ceil(math.log2(max(width, height) / tile_size)))
+    shutil.rmtree(directory, ignore_errors=True)
+    for zoom in range(max_zoom + 1):
+        os.makedirs(os.path.join(directory, str(zoom)), exist_ok=True)
+
+    def tile_path(zoom: int, x: int, y: int) -> str:
+        return os.path.join(directory, str(zoom), f"{x}_{y}.png")
+
+    def save_tile(zoom: int, x: int, y: int, pixels: np.ndarray) -> None:
+        Image.fromarray(pixels, "RGBA").save(tile_path(zoom, x, y))
+
+    def merge_children(zoom: int, x: int, y: int) -> None:
+        merged = Image.new("RGBA", (2 * tile_size, 2 * tile_size))
+        for dx in range(2):
+            for dy in range(2):
+                child = tile_path(zoom + 1, 2 * x + dx, 2 * y + dy)
+                if os.path.isfile(child):
+                    with Image.open(child) as tile:
+                        merged.paste(tile, (dx * tile_size, dy * tile_size))
+        merged.resize((tile_size, tile_size), Image.Resampling.BOX).save(
+            tile_path(zoom, x, y)
+        )
+
+    level: set[tuple[int, int]] = set()
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        for y in range(math.ceil(height / tile_size)):
+            strip = read_box(
+                (0, y * tile_size, width, min(height, (y + 1) * tile_size))
+            )
+            row = []
+            for x in range(math.ceil(width / tile_size)):
+                part = strip[:, x * tile_size : (x + 1) * tile_size]
+                if not part[:, :, 3].any():
+                    continue
+                tile = np.zeros((tile_size, tile_size, 4), dtype=np.uint8)
+                tile[: part.shape[0], : part.shape[1]] = part
+                row.append(executor.submit(save_tile, max_zoom, x, y, tile))
+                level.add((x, y))
+            # wait for the row, so only one row of tiles is in memory
+            for future in row:
+                future.result()
+
+        written = len(level)
+        for zoom in range(max_zoom - 1, -1, -1):
+            level = {(x // 2, y // 2) for x, y in level}
+            list(
+                executor.map(
+                    lambda tile, zoom=zoom: merge_children(zoom, *tile), sorted(level)
+                )
+            )
+            written += len(level)
+
+    with open(os.path.join(directory, PYRAMID_INDEX), "w") as f:
+        json.dump(
+            {
+                "width": width,
+                "height": height,
+                "tile_size": tile_size,
+                "max_zoom": max_zoom,
+            },
+            f,
+        )
+    logger.debug(f"Wrote tile pyramid with {written} tiles to {directory}")
+    return written
+
+
+class TiledPanorama:
+    """RGBA canvas made of square tiles, backed by a memory-mapped file.
+
+    Supports the parts of the PIL Image interface that are used while stitching (size, paste, crop, save),
+    so it can be used instead of one giant Image.new. All operations only touch the tiles inside the given
+    box, everything else stays on disk. A canvas is a folder with the pixel data and a small json file,
+    so it can be opened again later.
+    """
+
+    DATA_FILE = "canvas.raw"
+    META_FILE = "panorama.json"
+    CHECKPOINT_INDEX = "index.json"
+
+    def __init__(
+        self,
+        directory: str,
+        size: Optional[tuple[int, int]] = None,
+        tile_size: int = con.PANORAMA_TILE_SIZE,
+        temporary: bool = False,
+    ) -> None:
+        """Opens the canvas in directory or creates a new empty one.
+
+        Args:
+            directory (str): folder of the canvas
+            size (Optional[tuple[int, int]]): width and height, only needed for a new canvas
+            tile_size (int): side length of one tile, only used for a new canvas
+            temporary (bool): delete the folder when used as context manager
+        """
+        self.directory = directory
+        self.temporary = temporary
+        meta_path = os.path.join(directory, self.META_FILE)
+
+        mode: Literal["r+", "w+"]
+        if os.path.isfile(meta_path):
+            with open(meta_path, "r") as f:
+                meta = json.load(f)
+            self.size: tuple[int, int] = (meta["width"], meta["height"])
+            self.tile_size: int = meta["tile_size"]
+            self.canvas_id: str = meta["id"]
+            mode = "r+"
+        else:
+            if size is None:
+                raise ValueError(
+                    f"TiledPanorama: no canvas in {directory}, size needed"
+                )
+            os.makedirs(directory, exist_ok=True)
+            self.size = size
+            self.tile_size = tile_size
+            self.canvas_id = uuid.uuid4().hex
+            self._write_meta()
+            # new file is sparse, unused tiles do not take up disk space
+            mode = "w+"
+
+        self.tiles_x = math.ceil(self.size[0] / self.tile_size)
+        self.tiles_y = math.ceil(self.size[1] / self.tile_size)
+        self._tiles = np.memmap(
+            os.path.join(directory, self.DATA_FILE),
+            dtype=np.uint8,
+            mode=mode,
+            shape=(self.tiles_y, self.tiles_x, self.tile_size, self.tile_size, 4),
+        )
+        # tiles changed since the last checkpoint
+        self.dirty_tiles: set[tuple[int, int]] = set()
+
+    def _write_meta(self) -> None:
+        """Stores size, tile size and id of the canvas in its META_FILE."""
+        with open(os.path.join(self.directory, self.META_FILE), "w") as f:
+            json.dump(
+                {
+                    "id": self.canvas_id,
+                    "width": self.size[0],
+                    "height": self.size[1],
+                    "tile_size": self.tile_size,
+                },
+                f,
+            )
+
+    @staticmethod
+    def temporary_canvas(size: tuple[int, int]) -> "TiledPanorama":
+        """Creates an empty canvas in con.CONSOLE_PANORAMA_PATH that is deleted after use."""
+        os.makedirs(con.CONSOLE_PANORAMA_PATH, exist_ok=True)
+        directory = tempfile.mkdtemp(prefix="tmp_", dir=con.CONSOLE_PANORAMA_PATH)
+        return TiledPanorama(directory, size=size, temporary=True)
+
+    def _tile_slices(
+        self, box: tuple[int, int, int, int]
+    ) -> Iterator[tuple[int, int, tuple[slice, slice], tuple[slice, slice]]]:
+        """Finds all tiles that overlap with box, clipped to the canvas.
+
+        Yields:
+            tile row, tile column, slices inside the tile and slices relative to the box
+        """
+        x1, y1, x2, y2 = box
+        clip_x1, clip_y1 = max(x1, 0), max(y1, 0)
+        clip_x2, clip_y2 = min(x2, self.size[0]), min(y2, self.size[1])
+        if clip_x1 >= clip_x2 or clip_y1 >= clip_y2:
+            return
+
+        size = self.tile_size
+        for tile_y in range(clip_y1 // size, (clip_y2 - 1) // size + 1):
+            top = max(clip_y1, tile_y * size)
+            bottom = min(clip_y2, (tile_y + 1) * size)
+            for tile_x in range(clip_x1 // size, (clip_x2 - 1) // size + 1):
+                left = max(clip_x1, tile_x * size)
+                right = min(clip_x2, (tile_x + 1) * size)
+                yield (
+                    tile_y,
+                    tile_x,
+                    (
+                        slice(top - tile_y * size, bottom - tile_y * size),
+                        slice(left - tile_x * size, right - tile_x * size),
+                    ),
+                    (slice(top - y1, bottom - y1), slice(left - x1, right - x1)),
+                )
+
+    def paste(self, img: Image.Image, box: tuple[int, int]) -> None:
+        """Overwrites the canvas with img at box (upper left corner), like Image.paste without mask."""
+        self.paste_array(np.asarray(img.convert("RGBA")), box)
+
+    def paste_array(
+        self, pixels: np.ndarray, box: tuple[int, int], only_set: bool = False
+    ) -> None:
+        """Writes an RGBA array of shape (height, width, 4) onto the canvas at box (upper left corner).
+
+        Args:
+            pixels (np.ndarray): uint8 RGBA pixels
+            box (tuple[int, int]): upper left corner on the canvas
+            only_set (bool): only copy pixels with alpha > 0, transparent ones keep the canvas content
+        """
+        x, y = box
+        for tile_y, tile_x, tile_slice, img_slice in self._tile_slices(
+            (x, y, x + pixels.shape[1], y + pixels.shape[0])
+        ):
+            if only_set:
+                part = pixels[img_slice]
+                mask = part[:, :, 3] > 0
+                if not mask.any():
+                    continue
+                self._tiles[tile_y, tile_x][tile_slice][mask] = part[mask]
+            else:
+                self._tiles[tile_y, tile_x][tile_slice] = pixels[img_slice]
+            self.dirty_tiles.add((tile_y, tile_x))
+
+    def crop_array(self, box: tuple[int, int, int, int]) -> np.ndarray:
+        """Pixels inside box as uint8 array of shape (height, width, 4), outside of the canvas is transparent."""
+        x1, y1, x2, y2 = box
+        res = np.zeros((y2 - y1, x2 - x1, 4), dtype=np.uint8)
+        for tile_y, tile_x, tile_slice, res_slice in self._tile_slices(box):
+            res[res_slice] = self._tiles[tile_y, tile_x][tile_slice]
+        return res
+
+    def crop(self, box: tuple[int, int, int, int]) -> Image.Image:
+        """Same as Image.crop, returns a new RGBA image of the area inside box."""
+        return Image.fromarray(self.crop_array(box), "RGBA")
+
+    def count_set_pixels(self, box: Optional[tuple[int, int, int, int]] = None) -> int:
+        """Number of pixels inside box (full canvas if not given) with alpha > 0, counted tile by tile."""
+        box = box or (0, 0, self.size[0], self.size[1])
+        return sum(
+            int(np.count_nonzero(self._tiles[tile_y, tile_x][tile_slice][:, :, 3]))
+            for tile_y, tile_x, tile_slice, _ in self._tile_slices(box)
+        )
+
+    def coverage(self, box: Optional[tuple[int, int, int, int]] = None) -> float:
+        """Share of box (full canvas if not given) that is already covered, between 0 and 1."""
+        x1, y1, x2, y2 = box or (0, 0, self.size[0], self.size[1])
+        total_pixel = (x2 - x1) * (y2 - y1)
+        if total_pixel <= 0:
+            return 0.0
+        return self.count_set_pixels((x1, y1, x2, y2)) / total_pixel
+
+    def _strips(self, box: tuple[int, int, int, int]) -> Iterator[np.ndarray]:
+        """Box split into horizontal strips, one row of tiles at a time."""
+        x1, y1, x2, y2 = box
+        top = y1
+        while top < y2:
+            bottom = min(y2, (top // self.tile_size + 1) * self.tile_size)
+            yield self.crop_array((x1, top, x2, bottom))
+            top = bottom
+
+    def save(self, path: str, box: Optional[tuple[int, int, int, int]] = None) -> None:
+        """Saves the canvas, or only the area inside box, as PNG one row of tiles at a time.
+
+        Args:
+            path (str): output file, should end with .png
+            box (Optional[tuple[int, int, int, int]]): area to save, full canvas if not given
+        """
+        box = box or (0, 0, self.size[0], self.size[1])
+        write_png(path, box[2] - box[0], box[3] - box[1], self._strips(box))
+        logger.debug(f"Saved tiled panorama {self.directory} to {path}")
+
+    def thumbnail(
+        self, size: tuple[int, int], box: Optional[tuple[int, int, int, int]] = None
+    ) -> Image.Image:
+        """Scaled down version of the canvas (or the area inside box), created in horizontal strips.
+
+        Each strip is loaded with enough extra rows for the LANCZOS filter, so the result matches a resize
+        of the full image.
+
+        Args:
+            size (tuple[int, int]): size of the thumbnail
+            box (Optional[tuple[int, int, int, int]]): area to scale, full canvas if not given
+
+        Returns:
+            Image.Image: RGBA thumbnail
+        """
+        x1, y1, x2, y2 = box or (0, 0, self.size[0], self.size[1])
+        width, height = size
+        scale = (y2 - y1) / height
+        # LANCZOS uses 3 pixels on each side, measured in thumbnail pixels
+        support = math.ceil(3 * max(scale, (x2 - x1) / width)) + 1
+        rows_per_strip = max(1, self.tile_size // math.ceil(scale))
+
+        thumb = Image.new("RGBA", size)
+        for row in range(0, height, rows_per_strip):
+            row_end = min(height, row + rows_per_strip)
+            source_top = y1 + row * scale
+            source_bottom = y1 + row_end * scale
+            load_top = max(y1, math.floor(source_top) - support)
+            load_bottom = min(y2, math.ceil(source_bottom) + support)
+
+            strip = self.crop((x1, load_top, x2, load_bottom))
+            part = strip.resize(
+                (width, row_end - row),
+                Image.Resampling.LANCZOS,
+                box=(0, source_top - load_top, x2 - x1, source_bottom - load_top),
+            )
+            thumb.paste(part, (0, row))
+        return thumb
+
+    def write_pyramid(
+        self,
+        directory: str,
+        box: Optional[tuple[int, int, int, int]] = None,
+        tile_size: int = con.TILE_PYRAMID_SIZE,
+        workers: int = 4,
+    ) -> int:
+        """Writes the canvas, or only the area inside box, as zoomable tile pyramid, see write_tile_pyramid."""
+        x1, y1, x2, y2 = box or (0, 0, self.size[0], self.size[1])
+        return write_tile_pyramid(
+            lambda b: self.crop_array((b[0] + x1, b[1] + y1, b[2] + x1, b[3] + y1)),
+            x2 - x1,
+            y2 - y1,
+            directory,
+            tile_size=tile_size,
+            workers=workers,
+        )
+
+    def _write_tile(self, checkpoint_dir: str, tile: tuple[int, int]) -> None:
+        """Writes one tile as PNG, replaced in one step so a checkpoint never contains half a tile."""
+        tile_path = os.path.join(checkpoint_dir, f"{tile[0]}_{tile[1]}.png")
+        Image.fromarray(np.array(self._tiles[tile]), "RGBA").save(
+            tile_path + ".tmp", format="PNG"
+        )
+        os.replace(tile_path + ".tmp", tile_path)
+
+    def checkpoint(self, checkpoint_dir: str, workers: int = 4) -> int:
+        """Writes all tiles changed since the last checkpoint into a tile directory.
+
+        Each tile is a PNG named row_column.png, the index.json is written last and lists all tiles of the
+        checkpoint, so the cost of a checkpoint only depends on how much changed. Tiles are encoded in
+        parallel threads, PIL releases the GIL while encoding.
+
+        Args:
+            checkpoint_dir (str): tile directory, created if needed
+            workers (int): threads used for encoding
+
+        Returns:
+            int: number of written tiles
+        """
+        os.makedirs(checkpoint_dir, exist_ok=True)
+        index_path = os.path.join(checkpoint_dir, self.CHECKPOINT_INDEX)
+        tiles: set[tuple[int, int]] = set()
+        if os.path.isfile(index_path):
+            with open(index_path, "r") as f:
+                index = json.load(f)
+            # tiles of an older canvas are replaced, since all its changes are dirty
+            if index["canvas"] == self.canvas_id:
+                tiles = {(tile[0], tile[1]) for tile in index["tiles"]}
+            else:
+                for tile_y, tile_x in index["tiles"]:
+                    tile_path = os.path.join(checkpoint_dir, f"{tile_y}_{tile_x}.png")
+                    if os.path.isfile(tile_path):
+                        os.remove(tile_path)
+
+        dirty = sorted(self.dirty_tiles)
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            list(
+                executor.map(lambda tile: self._write_tile(checkpoint_dir, tile), dirty)
+            )
+
+        tiles.update(dirty)
+        with open(index_path + ".tmp", "w") as f:
+            json.dump(
+                {
+                    "canvas": self.canvas_id,
+                    "width": self.size[0],
+                    "height": self.size[1],
+                    "tile_size": self.tile_size,
+                    "tiles": sorted(tiles),
+                },
+                f,
+            )
+        os.replace(index_path + ".tmp", index_path)
+
+        self.dirty_tiles.clear()
+        self.flush()
+        logger.debug(f"Checkpoint of {len(dirty)} tiles to {checkpoint_dir}")
+        return len(dirty)
+
+    @staticmethod
+    def restore(checkpoint_dir: str, directory: str) -> "TiledPanorama":
+        """Creates a new canvas in directory from a tile directory written by checkpoint.
+
+        Args:
+            checkpoint_dir (str): tile directory
+            directory (str): folder of the new canvas, must not contain a canvas yet
+
+        Returns:
+            TiledPanorama: canvas with the content of the checkpoint
+        """
+        with open(os.path.join(checkpoint_dir, TiledPanorama.CHECKPOINT_INDEX)) as f:
+            index = json.load(f)
+        panorama = TiledPanorama(
+            directory,
+            size=(index["width"], index["height"]),
+            tile_size=index["tile_size"],
+        )
+        # continue the checkpoint, later checkpoints only add the changed tiles
+        panorama.canvas_id = index["canvas"]
+        panorama._write_meta()
+        for tile_y, tile_x in index["tiles"]:
+            with Image.open(
+                os.path.join(checkpoint_dir, f"{tile_y}_{tile_x}.png")
+            ) as tile:
+                panorama._tiles[tile_y, tile_x] = np.asarray(tile.convert("RGBA"))
+        panorama.flush()
+        return panorama
+
+    def flush(self) -> None:
+        """Writes all changes to disk."""
+        self._tiles.flush()
+
+    def delete(self) -> None:
+        """Removes the canvas from disk, it can not be used afterwards."""
+        del self._tiles
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def __enter__(self) -> "TiledPanorama":
+        return self
+
+    def __exit__(
+        self,
+        exc_type: Optional[type[BaseException]],
+        exc_value: Optional[BaseException],
+        traceback: Optional[TracebackType],
+    ) -> None:
+        if self.temporary:
+            self.delete()
+        else:
+            self.flush()
+
+
+BLEND_MODES = ("overwrite", "average", "feather", "median")
+
+
+def feather_weights(width: int, height: int) -> np.ndarray:
+    """Weight of each pixel of an image for "feather" blending, 1 in the center and falling to the border.
+
+    Returns:
+        np.ndarray: float32 array of shape (height, width), all values larger than 0
+    """
+    x = np.minimum(np.arange(width) + 1, width - np.arange(width))
+    y = np.minimum(np.arange(height) + 1, height - np.arange(height))
+    return (np.minimum.outer(y, x) / max(1, (min(width, height) + 1) // 2)).astype(
+        np.float32
+    )
+
+
+class TiledCompositor:
+    """Blends overlapping images onto a TiledPanorama, instead of overwriting them like paste.
+
+    "average" and "feather" keep a sum of the weighted colors and of the weights per pixel, "median" keeps
+    the colors of the last `layers` images per pixel. The buffers use the tile layout of the canvas in
+    memory-mapped files, so only the tiles in use are loaded into memory. For "average" and "feather" each
+    paste writes the blended result into the canvas right away, so nudging sees it and no second pass over
+    the images is needed. "median" only pastes the image itself, the median of a tile is computed once by
+    flush, which has to be called before the canvas is saved. Leaving the with block also flushes.
+    Content that is already on the canvas counts as one image, when a tile is touched for the first time.
+    """
+
+    def __init__(
+        self,
+        panorama: TiledPanorama,
+        mode: str = con.BLEND_MODE,
+        layers: int = con.BLEND_MEDIAN_LAYERS,
+    ) -> None:
+        """
+        Args:
+            panorama (TiledPanorama): canvas that gets the blended images
+            mode (str): "average", "feather" or "median"
+            layers (int): only for "median", number of images kept per pixel, at most 127
+        """
+        if mode not in BLEND_MODES[1:]:
+            raise ValueError(f"TiledCompositor: unknown blend mode {mode}")
+        self.panorama = panorama
+        self.mode = mode
+        self.layers = layers
+        os.makedirs(con.CONSOLE_PANORAMA_PATH, exist_ok=True)
+        self.directory = tempfile.mkdtemp(
+            prefix="blend_", dir=con.CONSOLE_PANORAMA_PATH
+        )
+
+        tiles = (panorama.tiles_y, panorama.tiles_x)
+        size = panorama.tile_size
+        # new files are sparse, like the canvas
+        if mode == "median":
+            self._colors = self._buffer(
+                "colors", np.uint8, (*tiles, layers, size, size, 3)
+            )
+            self._count = self._buffer("count", np.uint8, (*tiles, size, size))
+        else:
+            self._sum = self._buffer("sum", np.float32, (*tiles, size, size, 3))
+            self._weight = self._buffer("weight", np.float32, (*tiles, size, size))
+        self._seeded = np.zeros(tiles, dtype=bool)
+        # median tiles that got images since the last flush
+        self._pending: set[tuple[int, int]] = set()
+
+    def _buffer(self, name: str, dtype: type, shape: tuple[int, ...]) -> np.memmap:
+        return np.memmap(
+            os.path.join(self.directory, name + ".raw"),
+            dtype=dtype,
+            mode="w+",
+            shape=shape,
+        )
+
+    def _seed(self, tile: tuple[int, int]) -> None:
+        """Adds the current canvas content of a tile as the first image."""
+        self._seeded[tile] = True
+        pixels = self.panorama._tiles[tile]
+        mask = pixels[:, :, 3] > 0
+        if not mask.any():
+            return
+        if self.mode == "median":
+            self._colors[tile][0][mask] = pixels[:, :, :3][mask]
+            self._count[tile][mask] = 1
+        else:
+            self._sum[tile][mask] = pixels[:, :, :3][mask]
+            self._weight[tile][mask] = 1
+
+    def paste(self, img: Image.Image, box: tuple[int, int]) -> None:
+        """Blends img into the canvas at box (upper left corner), pixels with alpha 0 are left out."""
+        pixels = np.asarray(img.convert("RGBA"))
+        set_pixels = pixels[:, :, 3] > 0
+        if self.mode == "feather":
+            weights = feather_weights(pixels.shape[1], pixels.shape[0]) * set_pixels
+        else:
+            weights = set_pixels.astype(np.float32)
+
+        x, y = box
+        for tile_y, tile_x, tile_slice, img_slice in self.panorama._tile_slices(
+            (x, y, x + pixels.shape[1], y + pixels.shape[0])
+        ):
+            mask = set_pixels[img_slice]
+            if not mask.any():
+                continue
+            tile = (tile_y, tile_x)
+            if not self._seeded[tile]:
+                self._seed(tile)
+            colors = pixels[img_slice][:, :, :3]
+
+            if self.mode == "median":
+                count = self._count[tile][tile_slice]
+                stored = self._colors[tile][:, tile_slice[0], tile_slice[1]]
+                rows, columns = np.nonzero(mask)
+                # oldest layer is replaced once all layers are in use
+                stored[count[mask] % self.layers, rows, columns] = colors[mask]
+                # from layers on, count only tells the next layer, so it runs from layers to 2 * layers
+                count[mask] += 1
+                count[count == 2 * self.layers] = self.layers
+                # shown until the next flush, so nudging already sees the image
+                blended = colors[mask]
+                self._pending.add(tile)
+            else:
+                weight = weights[img_slice][mask][:, None]
+                # views into the buffers, updated in place
+                total = self._sum[tile][tile_slice]
+                total[mask] += colors[mask] * weight
+                weight_sum = self._weight[tile][tile_slice]
+                weight_sum[mask] += weight[:, 0]
+                blended = total[mask] / weight_sum[mask][:, None]
+
+            canvas = self.panorama._tiles[tile][tile_slice]
+            canvas[mask] = np.concatenate(
+                [
+                    np.clip(np.rint(blended), 0, 255).astype(np.uint8),
+                    np.full((len(blended), 1), 255, dtype=np.uint8),
+                ],
+                axis=1,
+            )
+            self.panorama.dirty_tiles.add(tile)
+
+    def flush(self) -> None:
+        """Writes the median of all tiles pasted since the last flush into the canvas, only for "median"."""
+        for tile in sorted(self._pending):
+            stored = self._colors[tile]
+            # from layers on all layers are in use, see paste
+            used = np.minimum(self._count[tile], self.layers)
+            canvas = self.panorama._tiles[tile]
+            for layers in range(1, self.layers + 1):
+                mask = used == layers
+                if not mask.any():
+                    continue
+                blended = np.median(stored[:layers][:, mask].astype(np.float32), axis=0)
+                canvas[mask] = np.concatenate(
+                    [
+                        np.clip(np.rint(blended), 0, 255).astype(np.uint8),
+                        np.full((len(blended), 1), 255, dtype=np.uint8),
+                    ],
+                    axis=1,
+                )
+            self.panorama.dirty_tiles.add(tile)
+        self._pending.clear()
+
+    def delete(self) -> None:
+        """Removes the buffers, the blended images stay on the canvas."""
+        for name in ("_colors", "_count", "_sum", "_weight"):
+            if hasattr(self, name):
+                delattr(self, name)
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def __enter__(self) -> "TiledCompositor":
+        return self
+
+    def __exit__(
+        self,
+        exc_type: Optional[type[BaseException]],
+        exc_value: Optional[BaseException],
+        traceback: Optional[TracebackType],
+    ) -> None:
+        # after an exception the canvas is not saved anyway
+        if exc_type is None:
+            self.flush()
+        self.delete()
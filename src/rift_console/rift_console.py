@@ -1,12 +1,15 @@
 import datetime
 from typing import Optional
 
+from melvonaut.ebt_calc import BeaconEstimate
 from rift_console.melvin_api import MelvonautTelemetry
 import shared.constants as con
+from shared.coverage import CoverageIndex
 from shared.models import (
     Achievement,
     BaseTelemetry,
     BeaconObjective,
+    CameraAngle,
     Event,
     Slot,
     State,
@@ -36,8 +39,10 @@ class RiftConsole:
     melvonaut_image_count: int = -1  # -1 indicates no data
     console_image_count: int = -1  # -1 indicates no data
     console_image_dates: list[tuple[str, int]] = []
+    _coverage: Optional[CoverageIndex] = None
     ebt_ping_list: list[tuple[int, int]] = []
     console_found_events: list[Event] = []
+    ebt_estimates: list[BeaconEstimate] = []
     melvin_task: str = ""
     melvin_lens: str = ""
 
@@ -60,6 +65,28 @@ class RiftConsole:
                     break
         return get_draw_zoned_obj
 
+    @property
+    def coverage(self) -> CoverageIndex:
+        """Coverage index of the console, loaded from CONSOLE_COVERAGE_LOCATION on first use."""
+        if self._coverage is None:
+            self._coverage = CoverageIndex(con.CONSOLE_COVERAGE_LOCATION)
+        return self._coverage
+
+    def get_zoned_coverage(self) -> dict[int, str]:
+        """Covered share of each zoned objective with the required lens, from the coverage index."""
+        return {
+            obj.id: f"{self.coverage.fraction_covered(obj.zone, obj.optic_required) * 100:.1f}"
+            for obj in self.zoned_objectives
+            if obj.zone is not None
+        }
+
+    def get_lens_coverage(self) -> str:
+        """Covered share of the world per lens (narrow/normal/wide), from the coverage index."""
+        return "/".join(
+            f"{self.coverage.fraction_covered(angle=angle) * 100:.2f}"
+            for angle in (CameraAngle.Narrow, CameraAngle.Normal, CameraAngle.Wide)
+        )
+
     def predict_trajektorie(
         self,
     ) -> tuple[list[tuple[int, int]], list[tuple[int, int]]]:
@@ -0,0 +1,398 @@
+"""
+
+Stitching runs as resumable jobs, which store their progress next to a checkpoint of the panorama.
+
+"""
+
+import datetime
+import json
+import os
+import shutil
+import sys
+import uuid
+from enum import StrEnum
+from typing import ClassVar, Optional
+
+from loguru import logger
+from pydantic import BaseModel, Field
+
+import shared.constants as con
+from rift_console.image_cache import console_image_cache
+from rift_console.image_index import ImageIndex, zone_size
+from rift_console.image_processing import (
+    fits_zone_canvas,
+    save_panorama,
+    stitch_images,
+    zone_coverage,
+)
+from rift_console.panorama import TiledPanorama
+from shared.coverage import CoverageIndex
+
+
+class JobStatus(StrEnum):
+    """Lifecycle of a StitchingJob."""
+
+    Pending = "pending"
+    Running = "running"
+    Done = "done"
+    Failed = "failed"
+    Cancelled = "cancelled"
+
+
+class JobCancelled(Exception):
+    """Raised inside a running job once it was cancelled."""
+
+
+class StitchingJob(BaseModel):
+    """A stitching run that can be stopped at any time and resumed from its last checkpoint.
+
+    All images before cursor are part of the checkpoint in the job folder, so after a crash or restart
+    the canvas is restored from it and stitching continues at cursor, no image is placed twice. Each call
+    of run_batch stitches at most STITCHING_COUNT_LIMIT images.
+
+    With a zone and STITCH_ZONE_ONLY only images that touch the zone are stitched, onto a canvas of the
+    size of the zone instead of the whole world.
+
+    A job is cancelled from another process by creating CANCEL_FILE in its folder, the running job stops
+    at its next checkpoint.
+    """
+
+    JOB_FILE: ClassVar[str] = "job.json"
+    IMAGES_FILE: ClassVar[str] = "images.json"
+    CANCEL_FILE: ClassVar[str] = "cancel"
+
+    job_id: str
+    image_path: str
+    output_path: str
+    zone: Optional[tuple[int, int, int, int]] = None
+    # canvas only covers the zone, starting at its upper left corner
+    zone_canvas: bool = False
+    # image_name_list is sorted by overlap in the worker before the first image, see SORT_IMAGE_BY_OVERLAP
+    sort_by_overlap: bool = False
+    status: JobStatus = JobStatus.Pending
+    cursor: int = 0
+    image_count: int = 0
+    placed_count: int = 0
+    skipped_count: int = 0
+    created: datetime.datetime = Field(
+        default_factory=lambda: datetime.datetime.now(datetime.timezone.utc)
+    )
+    error: str = ""
+    # also write a tile pyramid of the result, see save_panorama
+    tile_pyramid: bool = False
+    # covered share of zone on the result, set when done
+    zone_coverage: Optional[float] = None
+    # stored once in IMAGES_FILE, not with every progress update
+    image_name_list: list[str] = Field(default_factory=list, exclude=True)
+
+    @property
+    def directory(self) -> str:
+        return os.path.join(con.CONSOLE_JOBS_PATH, self.job_id)
+
+    @property
+    def canvas_dir(self) -> str:
+        return os.path.join(self.directory, "canvas")
+
+    @property
+    def checkpoint_dir(self) -> str:
+        return os.path.join(self.directory, "checkpoint")
+
+    @property
+    def coverage_path(self) -> str:
+        """CoverageIndex of the images placed by this job, saved with every checkpoint."""
+        return os.path.join(self.directory, "coverage.npz")
+
+    @property
+    def origin(self) -> tuple[int, int]:
+        """World position of the canvas without its STITCHING_BORDER, see stitch_images."""
+        if self.zone_canvas and self.zone:
+            return (int(self.zone[0]), int(self.zone[1]))
+        return (0, 0)
+
+    @property
+    def progress(self) -> float:
+        """Stitched share of the images in percent, as of the last checkpoint."""
+        if self.status == JobStatus.Done or self.image_count == 0:
+            return 100.0
+        return self.cursor / self.image_count * 100
+
+    @property
+    def cancel_requested(self) -> bool:
+        return os.path.isfile(os.path.join(self.directory, self.CANCEL_FILE))
+
+    def request_cancel(self) -> None:
+        """Asks the process running this job to stop, also works for jobs that did not start yet."""
+        with open(os.path.join(self.directory, self.CANCEL_FILE), "w"):
+            pass
+        logger.warning(f"Requested cancel of stitching job {self.job_id}")
+
+    @staticmethod
+    def create(
+        image_path: str,
+        image_name_list: list[str],
+        output_path: str,
+        zone: Optional[tuple[int, int, int, int]] = None,
+        tile_pyramid: bool = False,
+    ) -> "StitchingJob":
+        """Creates and stores a new job.
+
+        Args:
+            image_path (str): folder of the images
+            image_name_list (list[str]): images in stitching order, reordered by the worker with
+                SORT_IMAGE_BY_OVERLAP
+            output_path (str): png file for the result, see save_panorama
+            zone (Optional[tuple[int, int, int, int]]): if given, also save this area as *_cut.png, with
+                STITCH_ZONE_ONLY only this area is stitched, unless it is too large, see fits_zone_canvas
+            tile_pyramid (bool): also write a tile pyramid of the result
+
+        Returns:
+            StitchingJob: the pending job
+        """
+        zone_canvas = zone is not None and con.STITCH_ZONE_ONLY
+        if zone is not None and zone_canvas and not fits_zone_canvas(zone):
+            logger.warning(
+                f"Zone {zone} is too large for a canvas of its own, stitching the world"
+            )
+            zone_canvas = False
+        if zone is not None and zone_canvas:
+            total = len(image_name_list)
+            image_name_list = ImageIndex(image_name_list).query(zone)
+            logger.info(f"{len(image_name_list)} of {total} images touch zone {zone}")
+
+        job = StitchingJob(
+            job_id=datetime.datetime.now().strftime("%Y-%m-%dT%H-%M-%S_")
+            + uuid.uuid4().hex[:6],
+            image_path=image_path,
+            output_path=output_path,
+            zone=zone,
+            zone_canvas=zone_canvas,
+            sort_by_overlap=con.SORT_IMAGE_BY_OVERLAP,
+            tile_pyramid=tile_pyramid,
+            image_count=len(image_name_list),
+            image_name_list=image_name_list,
+        )
+        os.makedirs(job.directory, exist_ok=True)
+        job.save_images()
+        job.save()
+        logger.info(f"Created stitching job {job.job_id} with {job.image_count} images")
+        return job
+
+    @staticmethod
+    def load(job_id: str) -> "StitchingJob":
+        """Loads a stored job including its image list."""
+        directory = os.path.join(con.CONSOLE_JOBS_PATH, job_id)
+        with open(os.path.join(directory, StitchingJob.JOB_FILE), "r") as f:
+            job = StitchingJob.model_validate_json(f.read())
+        with open(os.path.join(directory, StitchingJob.IMAGES_FILE), "r") as f:
+            job.image_name_list = json.load(f)
+        return job
+
+    @staticmethod
+    def list_jobs() -> list["StitchingJob"]:
+        """All stored jobs, oldest first."""
+        if not os.path.isdir(con.CONSOLE_JOBS_PATH):
+            return []
+        jobs = []
+        for job_id in sorted(os.listdir(con.CONSOLE_JOBS_PATH)):
+            if os.path.isfile(
+                os.path.join(con.CONSOLE_JOBS_PATH, job_id, StitchingJob.JOB_FILE)
+            ):
+                jobs.append(StitchingJob.load(job_id))
+        return jobs
+
+    def save_images(self) -> None:
+        """Stores image_name_list, only before the first image is stitched, see save."""
+        images_path = os.path.join(self.directory, self.IMAGES_FILE)
+        with open(images_path + ".tmp", "w") as f:
+            json.dump(self.image_name_list, f)
+        os.replace(images_path + ".tmp", images_path)
+
+    def save(self) -> None:
+        """Stores the progress, replaced in one step so the job file is never half written."""
+        job_path = os.path.join(self.directory, self.JOB_FILE)
+        with open(job_path + ".tmp", "w") as f:
+            f.write(self.model_dump_json(indent=2))
+        os.replace(job_path + ".tmp", job_path)
+
+    def open_panorama(self) -> TiledPanorama:
+        """Canvas with exactly the images before cursor, restored from the last checkpoint.
+
+        A canvas left over from an interrupted run can contain images after the checkpoint, so it is
+        always replaced.
+        """
+        shutil.rmtree(self.canvas_dir, ignore_errors=True)
+        if os.path.isfile(
+            os.path.join(self.checkpoint_dir, TiledPanorama.CHECKPOINT_INDEX)
+        ):
+            return TiledPanorama.restore(self.checkpoint_dir, self.canvas_dir)
+        width, height = con.WORLD_X, con.WORLD_Y
+        if self.zone_canvas and self.zone:
+            width, height = zone_size(self.zone)
+        return TiledPanorama(
+            self.canvas_dir,
+            size=(
+                width + con.STITCHING_BORDER * 2,
+                height + con.STITCHING_BORDER * 2,
+            ),
+        )
+
+    def _checkpoint(
+        self,
+        panorama: TiledPanorama,
+        cursor: int,
+        processed: dict[str, bool],
+        coverage_index: Optional[CoverageIndex] = None,
+    ) -> None:
+        """Stores the canvas first and then the cursor, so the cursor never points past the checkpoint."""
+        panorama.checkpoint(self.checkpoint_dir, workers=con.NUMBER_OF_WORKER_THREADS)
+        if coverage_index:
+            coverage_index.save()
+        self.cursor = cursor
+        self.placed_count += sum(processed.values())
+        self.skipped_count += len(processed) - sum(processed.values())
+        processed.clear()
+        self.save()
+        logger.info(
+            f"Stitching job {self.job_id}: checkpoint at {self.cursor}/{self.image_count}"
+        )
+        if self.cancel_requested:
+            raise JobCancelled(self.job_id)
+
+    def run_batch(
+        self,
+        panorama: TiledPanorama,
+        budget: int = con.STITCHING_COUNT_LIMIT,
+        coverage_index: Optional[CoverageIndex] = None,
+    ) -> None:
+        """Stitches the next images, at most budget, and checkpoints every SAVE_PANORAMA_STEP images.
+
+        Args:
+            panorama (TiledPanorama): canvas from open_panorama
+            budget (int): maximum number of images in this batch
+            coverage_index (Optional[CoverageIndex]): passed on to stitch_images
+        """
+        start = self.cursor
+        batch = self.image_name_list[start : start + budget]
+        processed: dict[str, bool] = {}
+        stitch_images(
+            image_path=self.image_path,
+            image_name_list=batch,
+            panorama=panorama,
+            processed_images=processed,
+            coverage_index=coverage_index,
+            on_step=lambda consumed: self._checkpoint(
+                panorama, start + consumed, processed, coverage_index
+            ),
+            image_cache=console_image_cache(),
+            origin=self.origin,
+            wrap=self.zone_canvas,
+        )
+        self._checkpoint(panorama, start + len(batch), processed, coverage_index)
+
+    def run(
+        self,
+        budget: int = con.STITCHING_COUNT_LIMIT,
+        coverage_index: Optional[CoverageIndex] = None,
+    ) -> None:
+        """Runs the job in batches until all images are stitched and saves the result.
+
+        Can be called again on a job that was interrupted, it continues at the last checkpoint.
+
+        Args:
+            budget (int): images per batch
+            coverage_index (Optional[CoverageIndex]): passed on to stitch_images, the index at coverage_path
+                if not given
+        """
+        if self.status in (JobStatus.Done, JobStatus.Cancelled):
+            logger.warning(f"Stitching job {self.job_id} is {self.status}, not started")
+            return
+        if self.cancel_requested:
+            shutil.rmtree(self.canvas_dir, ignore_errors=True)
+            self.status = JobStatus.Cancelled
+            self.save()
+            logger.warning(f"Stitching job {self.job_id} cancelled before start")
+            return
+        if self.cursor > 0:
+            logger.warning(
+                f"Resuming stitching job {self.job_id} at {self.cursor}/{self.image_count}"
+            )
+        elif self.sort_by_overlap:
+            self.image_name_list = ImageIndex(self.image_name_list).overlap_order()
+            # names that can not be parsed are left out
+            self.image_count = len(self.image_name_list)
+            self.save_images()
+            logger.info(f"Sorted {self.image_count} images of {self.job_id} by overlap")
+        self.status = JobStatus.Running
+        self.save()
+        if coverage_index is None:
+            coverage_index = CoverageIndex(self.coverage_path)
+
+        try:
+            panorama = self.open_panorama()
+            while self.cursor < self.image_count:
+                self.run_batch(panorama, budget=budget, coverage_index=coverage_index)
+            save_panorama(
+                panorama,
+                self.output_path,
+                zone=self.zone,
+                origin=self.origin,
+                tile_pyramid=self.tile_pyramid,
+            )
+            if self.zone:
+                self.zone_coverage = zone_coverage(panorama, self.zone, self.origin)
+        except JobCancelled:
+            # the checkpoint stays, so a cancelled job can still be inspected
+            panorama.delete()
+            self.status = JobStatus.Cancelled
+            self.save()
+            logger.warning(
+                f"Stitching job {self.job_id} cancelled at {self.cursor}/{self.image_count}"
+            )
+            return
+        except Exception as e:
+            self.status = JobStatus.Failed
+            self.error = repr(e)
+            self.save()
+            raise
+
+        # the checkpoint stays, the canvas is only needed while running
+        panorama.delete()
+        self.status = JobStatus.Done
+        self.save()
+        logger.warning(
+            f"Stitching job {self.job_id} done: {self.placed_count} placed, {self.skipped_count} skipped"
+        )
+
+
+def resume_jobs(coverage_index: Optional[CoverageIndex] = None) -> list[str]:
+    """Runs all stored jobs that are not finished, e.g. after a restart of the console.
+
+    Returns:
+        list[str]: ids of the jobs that were resumed
+    """
+    resumed = []
+    for job in StitchingJob.list_jobs():
+        if job.status in (JobStatus.Pending, JobStatus.Running):
+            job.run(coverage_index=coverage_index)
+            resumed.append(job.job_id)
+    return resumed
+
+
+# For CLI usage
+if __name__ == "__main__":
+    if len(sys.argv) == 2 and sys.argv[1] == "list":
+        for job in StitchingJob.list_jobs():
+            print(
+                f"{job.job_id} {job.status} {job.cursor}/{job.image_count} -> {job.output_path}"
+            )
+        sys.exit(0)
+    if len(sys.argv) == 2 and sys.argv[1] == "resume":
+        print(f"Resumed {resume_jobs()}")
+        sys.exit(0)
+    if len(sys.argv) == 3 and sys.argv[1] == "resume":
+        StitchingJob.load(sys.argv[2]).run()
+        sys.exit(0)
+
+    print("Usage: python3 src/rift_console/stitching_job.py list")
+    print("Usage: python3 src/rift_console/stitching_job.py resume [JOB_ID]")
+    sys.exit(1)
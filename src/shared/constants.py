@@ -20,7 +20,15 @@ CONSOLE_LIVE_PATH = "logs/rift_console/images/live/"
 CONSOLE_DOWNLOAD_PATH = "logs/rift_console/images/download/"
 CONSOLE_STICHED_PATH = "logs/rift_console/images/stitched/"
 CONSOLE_EBT_PATH = "logs/rift_console/images/ebt/"
+CONSOLE_PANORAMA_PATH = "logs/rift_console/images/panorama/"
+CONSOLE_WORLDMAP_PATH = "logs/rift_console/images/panorama/worldmap/"
+CONSOLE_JOBS_PATH = "logs/rift_console/jobs/"
+CONSOLE_TILES_PATH = "logs/rift_console/images/tiles/"
+CONSOLE_IMAGE_CACHE_PATH = "logs/rift_console/images/cache/"
 MEL_PERSISTENT_SETTINGS = "logs/melvonaut/persistent_settings.json"
+CONSOLE_COVERAGE_LOCATION = "logs/rift_console/coverage_rift_console.npz"
+CONSOLE_IMAGE_CATALOG_LOCATION = "logs/rift_console/image_catalog.sqlite"
+CONSOLE_BENCHMARK_PATH = "logs/rift_console/benchmarks/"
 
 # [URLs]
 BASE_URL = "http://10.100.10.11:33000/"  # URL of our instance
@@ -59,22 +67,72 @@ CONSOLE_IMAGE_VIEWER_LIMIT = 1000
 
 ## [Image Processing]
 STITCHING_BORDER = 1000  # While in Stitching add this border in each direction
+# The panorama is stored on disk in square tiles of this size, only tiles in use are loaded into memory
+PANORAMA_TILE_SIZE = 1000
+# Saved panoramas also get a zoomable pyramid of tiles with this size, shown in the console under /tiles,
+# world map jobs of the console always write one
+EMIT_TILE_PYRAMID = False
+TILE_PYRAMID_SIZE = 256
 NUMBER_OF_WORKER_THREADS = (cpu_count() or 4) - 2  # use 1 for single core
 SAVE_PANORAMA_STEP = 1000  # save the current panorama each X images
-STITCHING_COUNT_LIMIT = 5000  # stitching limit
+# Images per batch of a stitching job, the job continues with the next batch
+STITCHING_COUNT_LIMIT = 5000
+# How overlapping images are combined: "overwrite" keeps the last image, "average" and "feather" (weighted
+# by the distance to the image border, hides seams) blend all images, "median" takes the median of the last
+# BLEND_MEDIAN_LAYERS images of each pixel and removes noise. Blending only works on tiled panoramas.
+BLEND_MODE = "overwrite"
+BLEND_MEDIAN_LAYERS = 5
+# Side length in pixels of one cell in the coverage index of the world
+COVERAGE_CELL_SIZE = 20
+# Split the world into square regions that are stitched in parallel processes, 1 stitches everything in one loop
+STITCHING_REGION_WORKERS = 1
+# Side length of one region, 4x2 regions for the whole world
+STITCHING_REGION_SIZE = 5400
+# Decoded and resized images are cached for repeated stitching, least recently used ones are removed above
+# this size in bytes, 0 turns the cache off
+IMAGE_CACHE_SIZE = 10 * 1024**3
+# Stitching jobs of a zone only stitch the images that touch it, onto a canvas of the size of the zone
+STITCH_ZONE_ONLY = True
+# Side length in pixels of one cell of the spatial index over the downloaded images
+IMAGE_INDEX_CELL_SIZE = 1000
+# Processes of the console that run stitching jobs in the background, further jobs wait in a queue
+CONSOLE_JOB_WORKERS = 1
 # Toogle between sorted/stitching images by position, starting in the top-right corner
 # else sort by timestamp
 SORT_IMAGE_BY_POSITION = True
+# Reorder images so each one overlaps the already placed ones as much as possible, the order above only
+# decides where each connected group of images starts, used by stitching jobs in their worker
+SORT_IMAGE_BY_OVERLAP = False
+# Largest overlaps per image that are considered for that order
+OVERLAP_ORDER_NEIGHBOURS = 8
 # The naming convention for images changed, can be changed for legacy data
 USE_LEGACY_IMAGE_NAMES = False  # should be false, only true for older datasets
 IMAGE_NAME_UNDERSCORE_COUNT = 8  # should be 8, only for old datasets can be 9
 IMAGE_ANGLE_POSITION = 2  # hould be 2, only for old datasets can be 3
 
 ## [New stitching algorithm]
-# Activate an improved stitching algorithm, which tries different placements of each image, but
-# takes a very long run time. Works, but needs further refinement
+# Activate an improved stitching algorithm, which tries different placements of each image.
+# Matching is done with numpy on whole images, a 15x15 grid takes below a second per image
 DO_IMAGE_NUDGING_SEARCH = False  # if False ignore SEARCH_GRID_SIDE_LENGTH
+# "grid" scores every offset in the search grid one by one, "fft" finds the best offset in one pass with
+# a cross-correlation in the frequency domain, which allows much larger SEARCH_GRID_SIDE_LENGTH.
+# "pyramid" searches on downscaled images first and only refines the result at full resolution.
+# "global" measures the offset between every pair of overlapping images, solves all positions together
+# and renders each image once, so errors do not add up along the stitching order
+IMAGE_NUDGING_MODE = "grid"
 SEARCH_GRID_SIDE_LENGTH = 15  # should be uneven
+# Only for "fft", images with a lower correlation (between -1 and 1) at the best offset are skipped
+FFT_MIN_CONFIDENCE = 0.1
+# Only for "global", pairs that overlap less than this share of the smaller image are not measured
+ALIGNMENT_MIN_OVERLAP = 0.2
+# Only for "global", how strongly each image is kept at its name position, compared to the confidence of a pair
+ALIGNMENT_PRIOR_WEIGHT = 0.01
+# Only for "global", decoded images kept in memory while pairs are measured
+ALIGNMENT_LOADED_IMAGES = 32
+# Only for "pyramid", number of resolution levels (each halves the size) and how many pixels around the
+# result of the coarser level are checked on the next level
+PYRAMID_LEVELS = 3
+PYRAMID_REFINE_RADIUS = 1
 # see image_processing:count_matching_pixels. Images are (0-255,0-255,0-255), summed up over RGB how
 # difference two pixels are allowed to be to still count as matching
 IMAGE_NOISE_FORGIVENESS = 20
@@ -0,0 +1,196 @@
+"""
+
+Raster index of which parts of the world have been imaged, one per CameraAngle.
+
+"""
+
+import math
+import os
+from typing import Any, Optional
+
+import numpy as np
+from loguru import logger
+
+import shared.constants as con
+from shared.models import CameraAngle, lens_size_by_angle
+
+LENSES = [CameraAngle.Narrow, CameraAngle.Normal, CameraAngle.Wide]
+
+
+class CoverageIndex:
+    """Downsampled boolean raster of the world for each lens, a cell is set once an image covered it completely.
+
+    The world wraps around in x and y, so do images and zones in this index. With the default
+    COVERAGE_CELL_SIZE all rasters together take below 2 MB and every query only uses numpy operations.
+    """
+
+    def __init__(
+        self, path: Optional[str] = None, cell_size: int = con.COVERAGE_CELL_SIZE
+    ) -> None:
+        """Creates an empty index or loads it from path.
+
+        Args:
+            path (Optional[str]): npz file used by load/save, nothing is stored if not given
+            cell_size (int): side length of one cell in pixels, ignored if the index is loaded
+        """
+        self.path = path
+        self.cell_size = cell_size
+        self._rasters: dict[CameraAngle, np.ndarray] = {}
+
+        if path and os.path.isfile(path):
+            with np.load(path) as data:
+                self.cell_size = int(data["cell_size"])
+                for angle in LENSES:
+                    self._rasters[angle] = data[angle.value].astype(bool)
+            logger.debug(f"Loaded coverage index from {path}")
+        else:
+            for angle in LENSES:
+                self._rasters[angle] = np.zeros(self.shape, dtype=bool)
+
+    @property
+    def shape(self) -> tuple[int, int]:
+        """Rows and columns of each raster."""
+        return (
+            math.ceil(con.WORLD_Y / self.cell_size),
+            math.ceil(con.WORLD_X / self.cell_size),
+        )
+
+    def save(self) -> None:
+        """Writes the index to its path, replaced in one step so readers never see half a file."""
+        if not self.path:
+            return
+        tmp_path = self.path + ".tmp.npz"
+        # Any, since savez_compressed also has keyword arguments that are no arrays
+        arrays: dict[str, Any] = {
+            angle.value: raster for angle, raster in self._rasters.items()
+        }
+        arrays["cell_size"] = np.array(self.cell_size)
+        np.savez_compressed(tmp_path, **arrays)
+        os.replace(tmp_path, self.path)
+
+    def _cells(self, start: int, end: int, world: int, inside: bool) -> np.ndarray:
+        """Cell indices of the pixel range start to end, wrapped around the world.
+
+        Args:
+            inside (bool): only cells that are completely inside the range, else all cells that touch it
+        """
+        if end < start:
+            end += world
+        if inside:
+            first, last = math.ceil(start / self.cell_size), end // self.cell_size
+        else:
+            first, last = start // self.cell_size, math.ceil(end / self.cell_size)
+        cells = math.ceil(world / self.cell_size)
+        return np.arange(first, max(first, min(last, first + cells))) % cells
+
+    def add_image(self, angle: CameraAngle, x: int, y: int) -> None:
+        """Marks the area of one image as covered.
+
+        Args:
+            angle (CameraAngle): lens of the image, Unknown is ignored
+            x (int): left edge of the image in the world
+            y (int): top edge of the image in the world
+        """
+        if angle not in self._rasters:
+            return
+        lens_size = lens_size_by_angle(angle)
+        rows = self._cells(y, y + lens_size, con.WORLD_Y, inside=True)
+        columns = self._cells(x, x + lens_size, con.WORLD_X, inside=True)
+        self._rasters[angle][np.ix_(rows, columns)] = True
+
+    def raster(self, angle: Optional[CameraAngle] = None) -> np.ndarray:
+        """Raster of one lens, or of all lenses combined if angle is not given."""
+        if angle is None or angle not in self._rasters:
+            combined: np.ndarray = np.logical_or.reduce(list(self._rasters.values()))
+            return combined
+        return self._rasters[angle]
+
+    def merge(self, other: "CoverageIndex") -> None:
+        """Marks everything that is covered in other, e.g. the index of a stitching job.
+
+        Raises:
+            ValueError: if other uses a different cell size
+        """
+        if other.cell_size != self.cell_size:
+            raise ValueError(
+                f"CoverageIndex: can not merge cell size {other.cell_size} into {self.cell_size}"
+            )
+        for angle, raster in other._rasters.items():
+            self._rasters[angle] |= raster
+
+    def fraction_covered(
+        self,
+        zone: Optional[tuple[int, int, int, int]] = None,
+        angle: Optional[CameraAngle] = None,
+    ) -> float:
+        """Share of a zone that is covered, between 0 and 1.
+
+        Args:
+            zone (Optional[tuple[int, int, int, int]]): x1, y1, x2, y2 in the world, whole world if not given
+            angle (Optional[CameraAngle]): only images of this lens, all lenses if not given
+
+        Returns:
+            float: covered share, measured in cells that touch the zone
+        """
+        raster = self.raster(angle)
+        if zone is None:
+            return float(raster.mean())
+        rows = self._cells(int(zone[1]), int(zone[3]), con.WORLD_Y, inside=False)
+        columns = self._cells(int(zone[0]), int(zone[2]), con.WORLD_X, inside=False)
+        if len(rows) == 0 or len(columns) == 0:
+            return 0.0
+        return float(raster[np.ix_(rows, columns)].mean())
+
+    def largest_uncovered(
+        self, angle: Optional[CameraAngle] = None
+    ) -> Optional[tuple[int, int, int, int]]:
+        """Finds the largest square that was not imaged yet, also across the world border.
+
+        Uses a summed-area table of the raster repeated 2x2, so every square of a given size is checked at
+        once, and a binary search over the size.
+
+        Args:
+            angle (Optional[CameraAngle]): only images of this lens, all lenses if not given
+
+        Returns:
+            Optional[tuple[int, int, int, int]]: x1, y1, x2, y2 in the world (x2/y2 can be beyond the
+            world border, then the square wraps around), None if everything is covered
+        """
+        raster = self.raster(angle)
+        rows, columns = raster.shape
+        summed = np.zeros((2 * rows + 1, 2 * columns + 1), dtype=np.int32)
+        summed[1:, 1:] = np.tile(raster, (2, 2)).cumsum(axis=0).cumsum(axis=1)
+
+        def empty_square(size: int) -> Optional[tuple[int, int]]:
+            covered = (
+                summed[size : size + rows, size : size + columns]
+                - summed[:rows, size : size + columns]
+                - summed[size : size + rows, :columns]
+                + summed[:rows, :columns]
+            )
+            found = np.flatnonzero(covered == 0)
+            if len(found) == 0:
+                return None
+            row, column = divmod(int(found[0]), columns)
+            return row, column
+
+        best = None
+        low, high = 1, min(rows, columns)
+        while low <= high:
+            size = (low + high) // 2
+            position = empty_square(size)
+            if position is None:
+                high = size - 1
+            else:
+                best = (size, position)
+                low = size + 1
+
+        if best is None:
+            return None
+        size, (row, column) = best
+        return (
+            column * self.cell_size,
+            row * self.cell_size,
+            (column + size) * self.cell_size,
+            (row + size) * self.cell_size,
+        )
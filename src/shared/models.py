@@ -410,7 +410,7 @@ class Event(BaseModel):
         """Custom parsing wrapper for ebt calculation."""
         pattern = r"DISTANCE_(\d+\.\d+)"
         dist = re.findall(pattern, self.event)[0]
-        if dist and self.current_x and self.current_y:
+        if dist and self.current_x is not None and self.current_y is not None:
             return (float(dist), self.current_x, self.current_y)
         else:
             logger.warning(f"Tried to parse incomplete event: {self}")
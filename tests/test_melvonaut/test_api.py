@@ -460,6 +460,13 @@ async def test_post_get_setting(client: TestClient):
     assert data["DISTANCE_BETWEEN_IMAGES"] == original_distance_between_images
 
 
+async def test_get_ebt_estimates(client: TestClient):
+    resp = await client.get("/api/get_ebt_estimates")
+    assert resp.status == 200, await resp.text()
+    data = await resp.json()
+    assert isinstance(data, list)
+
+
 async def test_get_all_settings(client: TestClient):
     original_distance_between_images = settings.DISTANCE_BETWEEN_IMAGES
     resp = await client.get("/api/get_all_settings")
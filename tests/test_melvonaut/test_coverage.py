@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+
+from shared import constants as con
+from shared.coverage import CoverageIndex
+from shared.models import CameraAngle
+
+
+def test_fraction_covered():
+    index = CoverageIndex()
+    index.add_image(CameraAngle.Narrow, 1000, 2000)
+
+    assert index.fraction_covered((1000, 2000, 1600, 2600), CameraAngle.Narrow) == 1
+    assert index.fraction_covered((1000, 2000, 2200, 2600), CameraAngle.Narrow) == 0.5
+    assert index.fraction_covered((1000, 2000, 1600, 2600), CameraAngle.Wide) == 0
+    assert index.fraction_covered((1000, 2000, 1600, 2600)) == 1
+    assert index.fraction_covered() == 600 * 600 / (con.WORLD_X * con.WORLD_Y)
+
+
+def test_wraparound(tmp_path):
+    path = str(tmp_path / "coverage.npz")
+    index = CoverageIndex(path)
+    # image over the lower right corner of the world
+    index.add_image(CameraAngle.Wide, con.WORLD_X - 500, con.WORLD_Y - 500)
+    index.save()
+
+    loaded = CoverageIndex(path)
+    assert np.array_equal(
+        loaded.raster(CameraAngle.Wide), index.raster(CameraAngle.Wide)
+    )
+    assert loaded.fraction_covered((0, 0, 500, 500), CameraAngle.Wide) == 1
+    assert (
+        loaded.fraction_covered(
+            (con.WORLD_X - 500, con.WORLD_Y - 500, 500, 500), CameraAngle.Wide
+        )
+        == 1
+    )
+
+
+def test_largest_uncovered():
+    index = CoverageIndex(cell_size=100)
+    assert index.largest_uncovered() == (0, 0, con.WORLD_Y, con.WORLD_Y)
+
+    # cover everything except a 3x3 cell hole that crosses the x border of the world
+    raster = index.raster(CameraAngle.Narrow)
+    raster[:] = True
+    raster[10:13, -1] = False
+    raster[10:13, :2] = False
+    assert index.largest_uncovered(CameraAngle.Narrow) == (
+        con.WORLD_X - 100,
+        1000,
+        con.WORLD_X + 200,
+        1300,
+    )
+
+    raster[:] = True
+    assert index.largest_uncovered(CameraAngle.Narrow) is None
+
+
+def test_merge():
+    index = CoverageIndex()
+    index.add_image(CameraAngle.Narrow, 1000, 2000)
+    other = CoverageIndex()
+    other.add_image(CameraAngle.Narrow, 1600, 2000)
+    other.add_image(CameraAngle.Wide, 0, 0)
+
+    index.merge(other)
+    assert index.fraction_covered((1000, 2000, 2200, 2600), CameraAngle.Narrow) == 1
+    assert index.fraction_covered((0, 0, 1000, 1000), CameraAngle.Wide) == 1
+    with pytest.raises(ValueError):
+        index.merge(CoverageIndex(cell_size=50))
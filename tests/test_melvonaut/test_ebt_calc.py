@@ -0,0 +1,274 @@
+import numpy as np
+
+from melvonaut import ebt_calc
+from shared import constants as con
+from shared.models import Event, Ping
+
+
+def brute_force_matches(pings):
+    """The loops find_matches used before, with distance for every single point."""
+    p1 = min(pings, key=lambda p: p.maxd)
+    res = []
+    for x in range(p1.x - p1.maxd, p1.x + p1.maxd):
+        for y in range(p1.y - p1.maxd, p1.y + p1.maxd):
+            if ebt_calc.x_0 < x < ebt_calc.x_max and ebt_calc.y_0 < y < ebt_calc.y_max:
+                dist = ebt_calc.distance(p1.x, x, p1.y, y)
+                if p1.mind < dist < p1.maxd:
+                    res.append((x, y))
+    return [
+        (x, y)
+        for x, y in res
+        if all(
+            pn.mind <= ebt_calc.distance(pn.x, x, pn.y, y) <= pn.maxd for pn in pings
+        )
+    ]
+
+
+def ping(x, y, d, offset=15):
+    return Ping(x=x, y=y, d=d, mind=int(d - offset), maxd=int(d + offset))
+
+
+def test_distances_like_distance():
+    rng = np.random.default_rng(21)
+    xs = rng.integers(-100, con.WORLD_X + 100, size=200)
+    ys = rng.integers(-100, con.WORLD_Y + 100, size=200)
+    for x1, y1 in [(0, 0), (100, 50), (con.WORLD_X - 10, con.WORLD_Y), (-5, 20)]:
+        expected = [ebt_calc.distance(x1, x, y1, y) for x, y in zip(xs, ys)]
+        assert ebt_calc.distances(x1, y1, xs, ys).tolist() == expected
+
+
+def test_find_matches_like_brute_force(monkeypatch):
+    monkeypatch.setattr(ebt_calc, "block_size", 7)
+    monkeypatch.setattr(ebt_calc, "cells_per_chunk", 3)
+    beacon = (5000, 3000)
+    pings = [
+        ping(5040, 3030, 50),
+        ping(4970, 3010, 32),
+        ping(5000, 2950, 50),
+    ]
+    res = ebt_calc.find_matches(pings)
+
+    assert res.tolist() == [list(point) for point in brute_force_matches(pings)]
+    assert np.array_equal(ebt_calc.find_matches_dense(pings), res)
+    assert len(res) > 0
+    centroid = res.mean(axis=0)
+    assert abs(centroid[0] - beacon[0]) < 15 and abs(centroid[1] - beacon[1]) < 15
+
+
+def test_find_matches_wraparound():
+    # beacon at the left border of the world, one ping is measured from the other side
+    pings = [
+        ping(con.WORLD_X - 30, 500, 30),
+        ping(20, 500, 20),
+    ]
+    res = ebt_calc.find_matches(pings)
+
+    assert res.tolist() == [list(point) for point in brute_force_matches(pings)]
+    assert np.array_equal(ebt_calc.find_matches_dense(pings), res)
+    assert len(res) > 0
+    assert (res[:, 0] < 60).all()
+
+
+def test_pruned_like_dense():
+    rng = np.random.default_rng(22)
+    for _ in range(8):
+        beacon = rng.integers(0, (con.WORLD_X, con.WORLD_Y))
+        pings = []
+        for _ in range(rng.integers(1, 5)):
+            x, y = beacon + rng.integers(-800, 800, size=2)
+            d = ebt_calc.distance(x, int(beacon[0]), y, int(beacon[1]))
+            d += rng.uniform(-100, 100)
+            pings.append(
+                Ping(
+                    x=int(x),
+                    y=int(y),
+                    d=d,
+                    mind=int(d - ebt_calc.f(d)),
+                    maxd=int(d + ebt_calc.f(d)),
+                )
+            )
+        assert np.array_equal(
+            ebt_calc.find_matches(pings), ebt_calc.find_matches_dense(pings)
+        )
+
+
+def test_find_matches_empty():
+    assert ebt_calc.find_matches([]).shape == (0, 2)
+    assert ebt_calc.find_matches_dense([]).shape == (0, 2)
+    # rings that do not intersect
+    pings = [ping(1000, 1000, 40), ping(2000, 1000, 40)]
+    assert len(ebt_calc.find_matches(pings)) == 0
+    assert len(ebt_calc.find_matches_dense(pings)) == 0
+
+
+def test_estimator_like_find_matches():
+    estimator = ebt_calc.EbtEstimator()
+    # the second ping has the smallest ring and starts over, the others only filter
+    pings = [
+        ping(5040, 3030, 50),
+        ping(4970, 3010, 32),
+        ping(5000, 2950, 50),
+        ping(5060, 3000, 60),
+    ]
+    for count, new in enumerate(pings, start=1):
+        estimate = estimator.add_ping(7, new)
+        res = ebt_calc.find_matches(pings[:count])
+
+        assert np.array_equal(estimator.candidates(7), res)
+        assert estimate.pings == count
+        assert estimate.candidates == len(res)
+        assert np.allclose((estimate.x, estimate.y), res.mean(axis=0))
+    assert estimate.uncertainty < 15
+    assert abs(estimate.likely_x - estimate.x) < 15
+    assert abs(estimate.likely_y - estimate.y) < 15
+    assert estimator.estimate(7) == estimate
+    assert estimator.estimate(8) is None
+
+
+def test_estimator_add_event():
+    estimator = ebt_calc.EbtEstimator()
+    events = [
+        Event(
+            event="GALILEO_MSG_EB,ID_3,DISTANCE_500.00",
+            id=0,
+            current_x=1000,
+            current_y=800,
+        ),
+        Event(event="some other announcement", id=1, current_x=1000, current_y=800),
+        Event(event="GALILEO_MSG_EB,ID_3,DISTANCE_400.00", id=2),
+        Event(
+            event="GALILEO_MSG_EB,ID_5,DISTANCE_300.00",
+            id=3,
+            current_x=3000,
+            current_y=900,
+        ),
+        # the distance can not be parsed
+        Event(
+            event="GALILEO_MSG_EB,ID_3,DISTANCE_unknown",
+            id=5,
+            current_x=1000,
+            current_y=800,
+        ),
+        # a position of 0 is still a position
+        Event(
+            event="GALILEO_MSG_EB,ID_6,DISTANCE_300.00",
+            id=4,
+            current_x=0,
+            current_y=0,
+        ),
+    ]
+    results = [estimator.add_event(event) for event in events]
+
+    assert results[1] is None and results[2] is None and results[4] is None
+    assert [estimate.id for estimate in estimator.estimates()] == [3, 5, 6]
+    assert estimator.estimate(3).pings == 1
+    assert estimator.estimate(6).pings == 1
+    assert np.array_equal(
+        estimator.candidates(6),
+        ebt_calc.find_matches(ebt_calc.parse_pings(id=6, events=events[5:])),
+    )
+    assert len(estimator.candidates(6)) > 0
+    assert np.array_equal(
+        estimator.candidates(3),
+        ebt_calc.find_matches(ebt_calc.parse_pings(id=3, events=events[:1])),
+    )
+
+
+def test_estimator_seed():
+    events = [
+        Event(
+            event=f"GALILEO_MSG_EB,ID_{id},DISTANCE_{d:.2f}",
+            id=index,
+            current_x=x,
+            current_y=y,
+        )
+        for index, (id, d, x, y) in enumerate(
+            [
+                (3, 500, 1000, 800),
+                (5, 300, 3000, 900),
+                (3, 450, 1300, 1000),
+                (3, 600, 900, 1300),
+            ]
+        )
+    ]
+    events.append(Event(event="GALILEO_MSG_EB,ID_3,DISTANCE_", id=9))
+    incremental = ebt_calc.EbtEstimator()
+    for event in events:
+        incremental.add_event(event)
+    seeded = ebt_calc.EbtEstimator()
+    seeded.seed(events)
+
+    assert seeded.estimates() == incremental.estimates()
+    for id in (3, 5):
+        assert np.array_equal(seeded.candidates(id), incremental.candidates(id))
+    # later pings narrow down the seeded candidates like any other
+    ping = Event(
+        event="GALILEO_MSG_EB,ID_3,DISTANCE_520.00",
+        id=10,
+        current_x=1100,
+        current_y=900,
+    )
+    assert seeded.add_event(ping) == incremental.add_event(ping)
+
+
+def test_most_likely_position_with_outlier():
+    rng = np.random.default_rng(24)
+    beacon = (12000, 5000)
+    pings = []
+    for _ in range(8):
+        x, y = beacon + rng.integers(-1500, 1500, size=2)
+        d = ebt_calc.distance(int(x), beacon[0], int(y), beacon[1])
+        d += rng.uniform(-100, 100)
+        pings.append(
+            Ping(
+                x=int(x),
+                y=int(y),
+                d=d,
+                mind=int(d - ebt_calc.f(d)),
+                maxd=int(d + ebt_calc.f(d)),
+            )
+        )
+    # far too long, no point matches all pings anymore
+    pings.append(ping(11000, 5000, 2500, offset=ebt_calc.f(2500)))
+    assert len(ebt_calc.find_matches(pings)) == 0
+
+    x, y, radius = ebt_calc.most_likely_position(pings)
+    assert ebt_calc.distance(x, beacon[0], y, beacon[1]) < 150
+    assert ebt_calc.distance(x, beacon[0], y, beacon[1]) < radius < 500
+
+    # a single ping leaves a whole ring, the radius shows it
+    assert ebt_calc.most_likely_position(pings[:1])[2] > 1000
+    assert ebt_calc.most_likely_position([]) is None
+
+
+def test_solve_all_like_one_by_one():
+    def eb(id, d, x, y):
+        return Event(
+            event=f"GALILEO_MSG_EB,ID_{id},DISTANCE_{d:.2f}",
+            id=0,
+            current_x=x,
+            current_y=y,
+        )
+
+    events = [
+        eb(11, 520.0, 3000, 2000),
+        Event(event="some other announcement", id=1),
+        eb(4, 300.0, 9000, 700),
+        eb(11, 480.0, 3400, 2300),
+        eb(1, 700.0, 15000, 5000),
+        eb(4, 350.0, 9200, 900),
+    ]
+    grouped = ebt_calc.group_pings(events)
+    assert list(grouped) == [1, 4, 11]
+    for id, pings in grouped.items():
+        assert [vars(p) for p in pings] == [
+            vars(p) for p in ebt_calc.parse_pings(id=id, events=events)
+        ]
+
+    estimates = ebt_calc.solve_all(events, workers=2)
+    assert [estimate.id for estimate in estimates] == [1, 4, 11]
+    for estimate in estimates:
+        expected = ebt_calc.solve_beacon(estimate.id, grouped[estimate.id])
+        assert estimate == expected
+        assert estimate.candidates == len(ebt_calc.find_matches(grouped[estimate.id]))
+    assert ebt_calc.solve_all([]) == []
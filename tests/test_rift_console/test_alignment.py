@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+from rift_console.alignment import align_images, solve_corrections
+from rift_console.image_processing import stitch_images
+from rift_console.panorama import TiledPanorama
+from shared import constants as con
+
+# true position of each image and the error in its name, the errors add up to zero
+TRUE_POSITIONS = [(100, 100), (400, 100), (100, 400), (400, 400)]
+NAME_ERRORS = [(0, 0), (3, -2), (-2, 1), (-1, 1)]
+
+
+@pytest.fixture
+def world(tmp_path, monkeypatch):
+    monkeypatch.setattr(con, "WORLD_X", 3000)
+    monkeypatch.setattr(con, "WORLD_Y", 2000)
+    monkeypatch.setattr(con, "DO_IMAGE_NUDGING_SEARCH", True)
+    monkeypatch.setattr(con, "IMAGE_NUDGING_MODE", "global")
+    monkeypatch.setattr(con, "SEARCH_GRID_SIDE_LENGTH", 15)
+
+    rng = np.random.default_rng(18)
+    world = rng.integers(0, 256, size=(1200, 1200, 3), dtype=np.uint8)
+    image_dir = tmp_path / "images"
+    image_dir.mkdir()
+    names = []
+    for second, ((x, y), (dx, dy)) in enumerate(zip(TRUE_POSITIONS, NAME_ERRORS)):
+        name = f"image_100_narrow_2025-01-01T10:00:{second:02d}.000000_x_{x + dx}_y_{y + dy}.png"
+        Image.fromarray(world[y : y + 600, x : x + 600]).save(image_dir / name)
+        names.append(name)
+    return world, str(image_dir) + "/", names
+
+
+def test_solve_corrections():
+    # chain 0 -> 1 -> 2 and an image without measurements
+    edges = [(0, 1, 2, -1, 1.0), (1, 2, 3, 0, 0.5), (0, 2, 5, -1, 0.8)]
+    corrections = solve_corrections(4, edges)
+
+    assert np.allclose(corrections[1] - corrections[0], (2, -1), atol=0.05)
+    assert np.allclose(corrections[2] - corrections[1], (3, 0), atol=0.05)
+    assert np.allclose(corrections[3], (0, 0))
+    # the prior keeps the group at its name positions on average
+    assert np.allclose(corrections.sum(axis=0), (0, 0))
+
+
+def test_align_images(world):
+    _, image_dir, names = world
+    offsets = align_images(image_dir, names, max_offset=7)
+
+    for name, (dx, dy) in zip(names, NAME_ERRORS):
+        assert offsets[name] == (-dx, -dy)
+
+
+def test_stitch_global(world, tmp_path):
+    pixels, image_dir, names = world
+    with TiledPanorama(
+        str(tmp_path / "panorama"), size=(3000 + 2000, 2000 + 2000)
+    ) as panorama:
+        processed = {}
+        stitch_images(
+            image_path=image_dir,
+            image_name_list=names,
+            panorama=panorama,
+            processed_images=processed,
+        )
+        result = panorama.crop_array((1100, 1100, 2000, 2000))
+
+    assert all(processed[name] for name in names)
+    assert np.array_equal(result[:, :, :3], pixels[100:1000, 100:1000])
+    assert (result[:, :, 3] == 255).all()
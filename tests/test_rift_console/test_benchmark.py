@@ -0,0 +1,46 @@
+import json
+import os
+
+from rift_console.benchmark import (
+    compare,
+    generate_tiles,
+    run_case_process,
+    save_results,
+)
+from rift_console.image_helper import parse_image_name
+
+
+def test_generate_tiles(tmp_path):
+    image_path = str(tmp_path / "images") + "/"
+    truth, world_size = generate_tiles(image_path, 5, name_error=3, seed=1)
+
+    # 3 columns and 2 rows of 600px images with 360px step, plus the margin
+    assert world_size == (6 + 2 * 360 + 600, 6 + 360 + 600)
+    assert (tmp_path / "reference.png").is_file()
+    assert sorted(os.listdir(image_path)) == sorted(truth)
+    for name, (x, y) in truth.items():
+        lens_size, name_x, name_y = parse_image_name(name)
+        assert lens_size == 600
+        assert abs(name_x - x) <= 3 and abs(name_y - y) <= 3
+
+
+def test_run_case(tmp_path):
+    image_path = str(tmp_path / "images") + "/"
+    truth, world_size = generate_tiles(image_path, 4, seed=2)
+
+    unnudged = run_case_process(image_path, truth, world_size, "none")
+    assert unnudged["placed"] == 4
+    assert unnudged["placement_error_max"] <= 5 * 2**0.5
+
+    aligned = run_case_process(image_path, truth, world_size, "global")
+    assert aligned["placed"] == 4
+    assert aligned["relative_error_mean"] <= 1
+    assert aligned["pixel_error_mean"] < unnudged["pixel_error_mean"]
+
+    results = {"commit": "abc", "cases": [unnudged, aligned]}
+    path = save_results(results, str(tmp_path / "results"))
+    with open(path) as f:
+        assert json.load(f) == results
+    lines = compare(results, {"commit": "def", "cases": [aligned]})
+    assert lines[0] == "abc -> def"
+    assert "1.00x images/s" in lines[1]
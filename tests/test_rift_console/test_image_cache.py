@@ -0,0 +1,51 @@
+import os
+
+import numpy as np
+from PIL import Image
+
+from rift_console.image_cache import ImageCache, decode_image
+
+
+def save_image(path, seed, size=(700, 700)):
+    rng = np.random.default_rng(seed)
+    pixels = rng.integers(0, 256, size=(size[1], size[0], 3), dtype=np.uint8)
+    Image.fromarray(pixels).save(path)
+
+
+def test_load_from_cache(tmp_path):
+    path = str(tmp_path / "image_1_normal_2025-01-01T10:00:00.000000_x_0_y_0.png")
+    save_image(path, 1)
+    cache = ImageCache(str(tmp_path / "cache"), max_bytes=10**8)
+
+    expected = np.asarray(decode_image(path, 800))
+    assert expected.shape == (800, 800, 4)
+    assert np.array_equal(np.asarray(cache.load(path, 800)), expected)
+    assert np.array_equal(np.asarray(cache.load(path, 800)), expected)
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    # a changed download is decoded again
+    save_image(path, 2)
+    os.utime(path, ns=(0, 10**9))
+    assert np.array_equal(
+        np.asarray(cache.load(path, 800)), np.asarray(decode_image(path, 800))
+    )
+    assert cache.misses == 2
+
+
+def test_evict_least_recently_used(tmp_path):
+    paths = [str(tmp_path / f"image_{i}.png") for i in range(3)]
+    for i, path in enumerate(paths):
+        save_image(path, i, size=(600, 600))
+    entry_size = 600 * 600 * 4 + 128
+    cache = ImageCache(str(tmp_path / "cache"), max_bytes=2 * entry_size)
+
+    cache.load(paths[0], 600)
+    cache.load(paths[1], 600)
+    # the second entry becomes the least recently used one
+    os.utime(cache._cache_path(paths[1], 600), (1, 1))
+    cache.load(paths[2], 600)
+
+    assert len(os.listdir(tmp_path / "cache")) == 2
+    cache.load(paths[0], 600)
+    cache.load(paths[2], 600)
+    assert (cache.hits, cache.misses) == (2, 3)
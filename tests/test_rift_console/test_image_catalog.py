@@ -0,0 +1,80 @@
+import datetime
+
+from rift_console.image_catalog import ImageCatalog
+from rift_console.image_helper import find_image_names
+from shared.models import CameraAngle
+
+
+def name(angle, time, x, y):
+    return f"image_100_{angle}_2025-01-{time}.000000_x_{x}_y_{y}.png"
+
+
+def touch(directory, names):
+    for image in names:
+        (directory / image).write_bytes(b"png")
+
+
+def test_sync_and_filter(tmp_path):
+    names = [
+        name("narrow", "01T10:00:00", 500, 100),
+        name("wide", "01T12:00:00", 100, 100),
+        name("narrow", "02T10:00:00", 0, 0),
+    ]
+    touch(tmp_path, names + ["image_broken.png", "thumb.png"])
+    catalog = ImageCatalog()
+
+    added = []
+    assert catalog.sync(str(tmp_path), source="melvonaut", added=added) == (3, 0)
+    assert sorted(added) == sorted(names)
+    assert catalog.sync(str(tmp_path), added=added) == (0, 0)
+    assert len(added) == 3
+    assert catalog.names(str(tmp_path)) == names
+    assert catalog.names(str(tmp_path), by_position=True) == [
+        names[2],
+        names[1],
+        names[0],
+    ]
+    assert catalog.names(str(tmp_path), newest_first=True, limit=1) == [names[2]]
+    assert catalog.count(str(tmp_path), CameraAngle.Narrow) == 2
+    assert catalog.dates(str(tmp_path)) == [("2025-01-02", 1), ("2025-01-01", 2)]
+
+    # end is inclusive to the second
+    start = datetime.datetime(2025, 1, 1, 10, tzinfo=datetime.timezone.utc)
+    end = datetime.datetime(2025, 1, 1, 12, tzinfo=datetime.timezone.utc)
+    assert catalog.names(str(tmp_path), start=start, end=end) == names[:2]
+    assert catalog.names(
+        str(tmp_path), angle=CameraAngle.Narrow, start=start, end=end
+    ) == [names[0]]
+    assert catalog.entries(str(tmp_path), angle=CameraAngle.Wide) == [
+        (names[1], "2025-01-01T12:00:00.000000", CameraAngle.Wide)
+    ]
+    assert catalog.positions(str(tmp_path))[0] == (
+        names[0],
+        CameraAngle.Narrow,
+        500,
+        100,
+    )
+
+    # new and deleted files
+    (tmp_path / names[0]).unlink()
+    added = name("normal", "03T10:00:00", 0, 0)
+    touch(tmp_path, [added])
+    assert catalog.sync(str(tmp_path)) == (1, 1)
+    assert catalog.names(str(tmp_path)) == [names[1], names[2], added]
+
+
+def test_persistent(tmp_path):
+    images = tmp_path / "images"
+    images.mkdir()
+    names = [name("wide", "01T12:00:00", 100, 100), name("narrow", "01T10:00:00", 0, 0)]
+    touch(images, names)
+    path = str(tmp_path / "catalog.sqlite")
+
+    catalog = ImageCatalog(path)
+    catalog.add(str(images), names[0], source="melvonaut")
+    catalog.close()
+    assert ImageCatalog(path).names(str(images)) == [names[0]]
+
+    # find_image_names lists the folder itself, the catalog stays as it is
+    assert find_image_names(str(images) + "/") == [names[1], names[0]]
+    assert ImageCatalog(path).names(str(images)) == [names[0]]
@@ -0,0 +1,64 @@
+from rift_console.image_index import ImageIndex, overlap_length, zone_size
+from shared import constants as con
+
+
+def name(x, y, angle="narrow"):
+    return f"image_100_{angle}_2025-01-01T10:00:00.000000_x_{x}_y_{y}.png"
+
+
+def test_query():
+    names = [name(0, 0), name(1000, 500, "wide"), name(5000, 5000), name(599, 0)]
+    index = ImageIndex(names + ["not_an_image.png"])
+    assert len(index) == 4
+
+    assert index.query((0, 0, 600, 600)) == [names[0], names[3]]
+    # touching the last column of the narrow image at 0, 0
+    assert index.query((599, 599, 1000, 1000)) == [names[0], names[3]]
+    assert index.query((600, 0, 1000, 1000)) == [names[3]]
+    assert index.query((1500, 1400, 1600, 1600)) == [names[1]]
+    assert index.query((7000, 7000, 8000, 8000)) == []
+
+
+def test_query_wraparound():
+    names = [name(con.WORLD_X - 300, con.WORLD_Y - 300), name(100, 100)]
+    index = ImageIndex(names)
+
+    # the image over the corner of the world also covers the top left corner
+    assert index.query((0, 0, 50, 50)) == [names[0]]
+    # zone over the x border of the world
+    assert index.query((con.WORLD_X - 50, 400, 150, 500)) == [names[1]]
+    assert index.query((con.WORLD_X - 50, con.WORLD_Y - 50, 150, 150)) == names
+    assert zone_size((con.WORLD_X - 50, 0, 150, 10)) == (200, 10)
+    assert zone_size((0, 0, con.WORLD_X, con.WORLD_Y)) == (con.WORLD_X, con.WORLD_Y)
+
+
+def test_overlap_length():
+    assert overlap_length(0, 600, 400, 600, con.WORLD_X) == 200
+    assert overlap_length(400, 600, 0, 600, con.WORLD_X) == 200
+    assert overlap_length(0, 1000, 100, 600, con.WORLD_X) == 600
+    assert overlap_length(0, 600, 600, 600, con.WORLD_X) == 0
+    # across the world border
+    assert overlap_length(con.WORLD_X - 100, 600, 0, 600, con.WORLD_X) == 500
+
+
+def test_overlap_order():
+    a, b, c, d, e = (name(x, 0) for x in (0, 2000, 500, 1000, 1550))
+    # b does not touch a, it is reached over the chain c, d, e
+    assert ImageIndex([a, b, c, d, e]).overlap_order() == [a, c, d, e, b]
+
+    # the image with the larger overlap is placed first
+    f = name(100, 0)
+    assert ImageIndex([a, c, f]).overlap_order() == [a, f, c]
+
+    # separate groups start in the given order
+    far = name(10000, 5000)
+    assert ImageIndex([far, c, a]).overlap_order() == [far, c, a]
+
+    # with one neighbour per image the small overlap of d and e is dropped, so b starts a new group
+    assert ImageIndex([a, b, c, d, e]).overlap_order(max_neighbours=1) == [
+        a,
+        c,
+        d,
+        b,
+        e,
+    ]
@@ -0,0 +1,259 @@
+import os
+import random
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from rift_console import image_processing
+from rift_console.panorama import TiledPanorama
+from rift_console.image_helper import generate_spiral_walk
+from shared import constants as con
+
+
+def count_matching_pixels_reference(offset, first_img, second_img, max_offset):
+    """Per pixel implementation, used to check the numpy version."""
+    matches = 0
+    for x_local in range(first_img.size[0]):
+        for y_local in range(first_img.size[1]):
+            p1 = first_img.getpixel((x_local, y_local))
+            p2 = second_img.getpixel(
+                (x_local + offset[0] + max_offset, y_local + offset[1] + max_offset)
+            )
+            if (
+                abs(p1[0] - p2[0]) + abs(p1[1] - p2[1]) + abs(p1[2] - p2[2])
+                < con.IMAGE_NOISE_FORGIVENESS
+            ):
+                matches += 1
+    return offset, matches
+
+
+@pytest.fixture
+def images():
+    rng = random.Random(42)
+    max_offset = 3
+    first = Image.new("RGBA", (20, 16))
+    second = Image.new("RGBA", (20 + 2 * max_offset, 16 + 2 * max_offset))
+    for img in (first, second):
+        for x in range(img.size[0]):
+            for y in range(img.size[1]):
+                value = rng.randrange(0, 40)
+                img.putpixel((x, y), (value, value // 2, value // 3, 255))
+    return first, second, max_offset
+
+
+def test_count_matching_pixels(images):
+    first, second, max_offset = images
+    for offset in [(0, 0), (-3, 2), (3, -3)]:
+        assert image_processing.count_matching_pixels(
+            offset, first, second, max_offset
+        ) == count_matching_pixels_reference(offset, first, second, max_offset)
+
+
+def test_count_matching_pixels_grid(images):
+    first, second, max_offset = images
+    offsets = generate_spiral_walk((2 * max_offset + 1) ** 2)
+    results = image_processing.count_matching_pixels_grid(
+        offsets=offsets, first_img=first, second_img=second, max_offset=max_offset
+    )
+    assert results == [
+        count_matching_pixels_reference(offset, first, second, max_offset)
+        for offset in offsets
+    ]
+
+
+@pytest.fixture
+def shifted_images():
+    """Noisy crops of a smooth texture, a 72px panorama crop and 60px images with known shifts."""
+    rng = np.random.default_rng(7)
+    max_offset = 6
+    texture = rng.integers(20, 220, size=(20, 20, 3)).astype(np.uint8)
+    reference = np.asarray(
+        Image.fromarray(texture).resize((120, 120), Image.Resampling.BICUBIC),
+        dtype=np.int16,
+    )
+
+    def noisy(x, y, size):
+        region = reference[y : y + size, x : x + size]
+        values = region + rng.integers(-3, 4, size=region.shape)
+        return Image.fromarray(np.clip(values, 0, 255).astype(np.uint8)).convert("RGBA")
+
+    start = 30
+    second = noisy(start - max_offset, start - max_offset, 60 + 2 * max_offset)
+    shifts = [(0, 0), (4, -2), (-6, 5), (3, 3)]
+    firsts = [noisy(start + x, start + y, 60) for x, y in shifts]
+    return second, list(zip(shifts, firsts)), max_offset
+
+
+def test_fft_registration(shifted_images):
+    second, shifted, max_offset = shifted_images
+    # only the left part of the panorama crop is already set
+    alpha = np.zeros((second.size[1], second.size[0]), dtype=np.uint8)
+    alpha[:, :40] = 255
+    second.putalpha(Image.fromarray(alpha))
+
+    for shift, first in shifted:
+        offset, confidence = image_processing.fft_registration(
+            first_img=first, second_img=second, max_offset=max_offset
+        )
+        assert offset == shift
+        assert confidence > con.FFT_MIN_CONFIDENCE
+
+
+def test_pyramid_registration(shifted_images):
+    second, shifted, max_offset = shifted_images
+    for shift, first in shifted:
+        offset, matches = image_processing.pyramid_registration(
+            first_img=first, second_img=second, max_offset=max_offset
+        )
+        assert offset == shift
+        assert (offset, matches) == image_processing.count_matching_pixels(
+            shift, first, second, max_offset
+        )
+
+
+def test_nudging_pool(images):
+    first, second, max_offset = images
+    offsets = generate_spiral_walk((2 * max_offset + 1) ** 2)
+    with image_processing.NudgingPool(workers=2, max_offset=max_offset) as pool:
+        for _ in range(2):
+            assert pool.count_matching_pixels_grid(
+                offsets=offsets,
+                first_img=first,
+                second_img=second,
+                max_offset=max_offset,
+            ) == image_processing.count_matching_pixels_grid(
+                offsets=offsets,
+                first_img=first,
+                second_img=second,
+                max_offset=max_offset,
+            )
+
+
+def test_update_stitching(tmp_path, monkeypatch):
+    monkeypatch.setattr(con, "WORLD_X", 3000)
+    monkeypatch.setattr(con, "WORLD_Y", 2000)
+    monkeypatch.setattr(con, "DO_IMAGE_NUDGING_SEARCH", False)
+    image_dir = tmp_path / "images"
+    image_dir.mkdir()
+    panorama_dir = str(tmp_path / "worldmap")
+
+    def add_image(second, x, y, color):
+        name = f"image_100_narrow_2025-01-01T10:00:{second:02d}.000000_x_{x}_y_{y}.png"
+        Image.new("RGB", (600, 600), color).save(image_dir / name)
+        return name
+
+    first_names = [
+        add_image(1, 100, 200, (255, 0, 0)),
+        add_image(2, 900, 200, (0, 255, 0)),
+    ]
+    panorama, new_images = image_processing.update_stitching(
+        image_path=str(image_dir) + "/",
+        image_name_list=first_names,
+        panorama_dir=panorama_dir,
+    )
+    assert new_images == first_names
+    panorama.flush()
+
+    later_name = add_image(3, 1700, 1000, (0, 0, 255))
+    panorama, new_images = image_processing.update_stitching(
+        image_path=str(image_dir) + "/",
+        image_name_list=first_names + [later_name],
+        panorama_dir=panorama_dir,
+    )
+    assert new_images == [later_name]
+    assert image_processing.load_manifest(panorama_dir) == {
+        name: True for name in first_names + [later_name]
+    }
+
+    border = con.STITCHING_BORDER
+    for (x, y), color in [
+        ((100, 200), (255, 0, 0, 255)),
+        ((900, 200), (0, 255, 0, 255)),
+        ((1700, 1000), (0, 0, 255, 255)),
+    ]:
+        assert (
+            panorama.crop(
+                (x + border, y + border, x + border + 1, y + border + 1)
+            ).getpixel((0, 0))
+            == color
+        )
+    panorama.flush()
+
+
+def test_stitch_images_parallel(tmp_path, monkeypatch):
+    monkeypatch.setattr(con, "DO_IMAGE_NUDGING_SEARCH", False)
+    rng = np.random.default_rng(11)
+    image_dir = tmp_path / "images"
+    image_dir.mkdir()
+
+    # one image across the seam of the first two regions, one over the x wraparound
+    positions = [(5000, 300), (5300, 500), (12000, 6000), (21200, 8000), (100, 5200)]
+    names = []
+    for second, (x, y) in enumerate(positions):
+        name = f"image_100_narrow_2025-01-01T10:00:{second:02d}.000000_x_{x}_y_{y}.png"
+        pixels = rng.integers(0, 256, size=(600, 600, 3), dtype=np.uint8)
+        Image.fromarray(pixels).save(image_dir / name)
+        names.append(name)
+
+    # stitch on top of an existing panorama
+    parent_dir = str(tmp_path / "parent")
+    existing = Image.new("RGBA", (300, 300), (9, 9, 9, 255))
+    with (
+        TiledPanorama(
+            parent_dir, size=(con.WORLD_X + 2000, con.WORLD_Y + 2000)
+        ) as serial,
+        TiledPanorama(str(tmp_path / "parallel"), size=serial.size) as parallel,
+    ):
+        for pan in (serial, parallel):
+            pan.paste(existing, (6000, 1000))
+            pan.paste(existing, (5500, 1200))
+
+        serial_processed = {}
+        image_processing.stitch_images(
+            image_path=str(image_dir) + "/",
+            image_name_list=names,
+            panorama=serial,
+            processed_images=serial_processed,
+        )
+        # in steps, like inside a StitchingJob
+        monkeypatch.setattr(con, "SAVE_PANORAMA_STEP", 2)
+        parallel_processed = {}
+        steps = []
+        image_processing.stitch_images_parallel(
+            image_path=str(image_dir) + "/",
+            image_name_list=names,
+            panorama=parallel,
+            workers=2,
+            processed_images=parallel_processed,
+            on_step=lambda consumed: steps.append((consumed, len(parallel_processed))),
+        )
+
+        assert steps == [(2, 2), (4, 4), (5, 5)]
+        assert parallel_processed == serial_processed
+        for box in [
+            (5000, 0, 8000, 2500),
+            (12000, 6000, 14000, 8000),
+            (20000, 7000, 23600, 10000),
+            (0, 5000, 2000, 7000),
+        ]:
+            assert np.array_equal(serial.crop_array(box), parallel.crop_array(box))
+
+
+def test_checkpoint_dir_per_canvas(tmp_path, monkeypatch):
+    monkeypatch.setattr(con, "CONSOLE_PANORAMA_PATH", str(tmp_path) + "/")
+    with (
+        TiledPanorama.temporary_canvas((100, 100)) as first,
+        TiledPanorama.temporary_canvas((100, 100)) as second,
+    ):
+        directories = []
+        for value, canvas in ((10, first), (20, second)):
+            canvas.paste(Image.new("RGBA", (10, 10), (value, 0, 0, 255)), (0, 0))
+            directories.append(image_processing.checkpoint_dir(canvas))
+            canvas.checkpoint(directories[-1])
+        # runs at the same time keep their own tiles
+        assert directories[0] != directories[1]
+        restored = TiledPanorama.restore(directories[0], str(tmp_path / "restored"))
+        assert restored.crop_array((0, 0, 1, 1))[0, 0, 0] == 10
+    # removed with the temporary canvas
+    assert not any(os.path.exists(directory) for directory in directories)
@@ -0,0 +1,73 @@
+import asyncio
+import math
+import threading
+import time
+
+from rift_console.job_manager import JobManager
+from rift_console.stitching_job import JobStatus
+
+
+def wait_for(manager, job_id, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        info = manager.status(job_id)
+        if info.status not in (JobStatus.Pending, JobStatus.Running):
+            return info
+        time.sleep(0.05)
+    raise TimeoutError(job_id)
+
+
+def test_submit_and_cancel():
+    manager = JobManager(workers=1)
+    results = []
+    try:
+        running = manager.submit("sleep", "blocks the worker", time.sleep, 1)
+        failing = manager.submit("factorial", "invalid", math.factorial, -1)
+        done = manager.submit(
+            "factorial", "valid", math.factorial, 5, on_done=results.append
+        )
+        # the pool only takes the next job after the running one, so this one is still queued
+        cancelled = manager.submit(
+            "factorial", "cancelled", math.factorial, 6, on_done=results.append
+        )
+        assert manager.cancel(cancelled)
+
+        assert wait_for(manager, running).status == JobStatus.Done
+        failed = wait_for(manager, failing)
+        assert failed.status == JobStatus.Failed
+        assert "ValueError" in failed.error
+        finished = wait_for(manager, done)
+        assert finished.status == JobStatus.Done
+        assert finished.progress == 100
+        assert manager.status(cancelled).status == JobStatus.Cancelled
+        assert [info.job_id for info in manager.list_jobs()] == [
+            cancelled,
+            done,
+            failing,
+            running,
+        ]
+    finally:
+        manager.shutdown()
+    assert results == [120]
+
+
+def test_on_done_runs_in_event_loop():
+    manager = JobManager(workers=1)
+    threads = []
+
+    async def submit_and_wait():
+        done = asyncio.Event()
+
+        def on_done(result):
+            threads.append((threading.get_ident(), result))
+            done.set()
+
+        manager.submit("factorial", "valid", math.factorial, 4, on_done=on_done)
+        await asyncio.wait_for(done.wait(), timeout=60)
+        return threading.get_ident()
+
+    try:
+        loop_thread = asyncio.run(submit_and_wait())
+    finally:
+        manager.shutdown()
+    assert threads == [(loop_thread, 24)]
@@ -15,3 +15,13 @@ def test_main_succeeds(runner: CliRunner) -> None:
     # result = runner.invoke(__main__.main)
     # assert result.exit_code == 0
     pass
+
+
+async def test_tiles_missing_pyramid(tmp_path, monkeypatch) -> None:
+    """A panorama without tile pyramid is not found instead of an error."""
+    from rift_console.__main__ import app
+    from shared import constants as con
+
+    monkeypatch.setattr(con, "CONSOLE_TILES_PATH", str(tmp_path))
+    response = await app.test_client().get("/tiles/missing")
+    assert response.status_code == 404
@@ -0,0 +1,200 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+from rift_console.image_helper import count_set_pixels
+from rift_console.panorama import TiledCompositor, TiledPanorama, feather_weights
+
+
+@pytest.fixture
+def canvas(tmp_path):
+    with TiledPanorama(str(tmp_path / "canvas"), size=(250, 170), tile_size=64) as pan:
+        yield pan
+
+
+def random_image(rng, size):
+    pixels = rng.integers(0, 256, size=(size[1], size[0], 4), dtype=np.uint8)
+    return Image.fromarray(pixels, "RGBA")
+
+
+def test_paste_and_crop_like_pil(canvas):
+    rng = np.random.default_rng(1)
+    reference = Image.new("RGBA", canvas.size)
+    # overlapping pastes, across tile borders and partly outside of the canvas
+    for box in [(10, 20), (50, 60), (200, 150), (-30, -10), (63, 63)]:
+        img = random_image(rng, (90, 70))
+        canvas.paste(img, box)
+        reference.paste(img, box)
+
+    for box in [(0, 0, 250, 170), (60, 50, 140, 131), (-5, -5, 20, 20)]:
+        assert np.array_equal(
+            np.asarray(canvas.crop(box)), np.asarray(reference.crop(box))
+        )
+
+
+def test_save_and_reopen(canvas, tmp_path):
+    rng = np.random.default_rng(2)
+    img = random_image(rng, (120, 100))
+    canvas.paste(img, (40, 30))
+    canvas.flush()
+
+    path = str(tmp_path / "out.png")
+    canvas.save(path, box=(20, 10, 200, 160))
+    with Image.open(path) as saved:
+        assert saved.size == (180, 150)
+        assert np.array_equal(
+            np.asarray(saved), np.asarray(canvas.crop((20, 10, 200, 160)))
+        )
+
+    reopened = TiledPanorama(canvas.directory)
+    assert reopened.size == canvas.size
+    assert np.array_equal(
+        np.asarray(reopened.crop((40, 30, 160, 130))), np.asarray(img)
+    )
+
+
+def test_thumbnail(canvas):
+    rng = np.random.default_rng(3)
+    reference = Image.new("RGBA", canvas.size)
+    img = random_image(rng, (250, 170))
+    canvas.paste(img, (0, 0))
+    reference.paste(img, (0, 0))
+
+    thumb = canvas.thumbnail((50, 34))
+    expected = reference.resize((50, 34), Image.Resampling.LANCZOS)
+    diff = np.abs(
+        np.asarray(thumb, dtype=np.int16) - np.asarray(expected, dtype=np.int16)
+    )
+    assert diff.max() <= 2
+
+
+def test_temporary_canvas_is_deleted(tmp_path, monkeypatch):
+    monkeypatch.setattr("shared.constants.CONSOLE_PANORAMA_PATH", str(tmp_path) + "/")
+    with TiledPanorama.temporary_canvas((100, 100)) as pan:
+        directory = pan.directory
+        pan.paste(Image.new("RGBA", (10, 10), (1, 2, 3, 255)), (5, 5))
+    assert not (tmp_path / directory).exists()
+
+
+def test_coverage(canvas):
+    reference = Image.new("RGBA", canvas.size)
+    img = Image.new("RGBA", (100, 50), (0, 0, 0, 255))
+    for box in [(10, 10), (150, 100)]:
+        canvas.paste(img, box)
+        reference.paste(img, box)
+
+    for box in [(0, 0, 250, 170), (50, 30, 200, 130), (0, 0, 5, 5)]:
+        expected = np.count_nonzero(np.asarray(reference.crop(box)).any(axis=2))
+        assert canvas.count_set_pixels(box) == expected
+        assert count_set_pixels(reference.crop(box)) == expected
+    assert canvas.coverage() == 2 * 100 * 50 / (250 * 170)
+
+
+def test_checkpoint_and_restore(canvas, tmp_path):
+    rng = np.random.default_rng(4)
+    checkpoint_dir = str(tmp_path / "checkpoint")
+
+    canvas.paste(random_image(rng, (50, 50)), (10, 10))
+    assert canvas.checkpoint(checkpoint_dir) == 1
+    # only the tiles changed since the last checkpoint are written again
+    canvas.paste(random_image(rng, (50, 50)), (100, 100))
+    assert canvas.checkpoint(checkpoint_dir) == 4
+    assert canvas.checkpoint(checkpoint_dir) == 0
+
+    restored = TiledPanorama.restore(checkpoint_dir, str(tmp_path / "restored"))
+    assert restored.size == canvas.size
+    assert np.array_equal(
+        restored.crop_array((0, 0, 250, 170)), canvas.crop_array((0, 0, 250, 170))
+    )
+
+    restored.paste(random_image(rng, (10, 10)), (200, 150))
+    assert restored.checkpoint(checkpoint_dir) == 1
+    again = TiledPanorama.restore(checkpoint_dir, str(tmp_path / "again"))
+    assert np.array_equal(
+        again.crop_array((0, 0, 250, 170)), restored.crop_array((0, 0, 250, 170))
+    )
+
+
+def test_write_pyramid(canvas, tmp_path):
+    rng = np.random.default_rng(6)
+    img = random_image(rng, (100, 60))
+    canvas.paste(img, (20, 10))
+    directory = tmp_path / "pyramid"
+
+    written = canvas.write_pyramid(str(directory), box=(10, 0, 250, 170), tile_size=64)
+
+    # 240x170 with 64px tiles: zoom 2 is full resolution, zoom 0 a single tile
+    assert (directory / "pyramid.json").is_file()
+    assert sorted(p.name for p in (directory / "2").iterdir()) == [
+        "0_0.png",
+        "0_1.png",
+        "1_0.png",
+        "1_1.png",
+    ]
+    assert written == 4 + 1 + 1
+    with Image.open(directory / "2" / "1_1.png") as tile:
+        assert np.array_equal(
+            np.asarray(tile), canvas.crop_array((10 + 64, 64, 10 + 128, 128))
+        )
+    with Image.open(directory / "0" / "0_0.png") as tile:
+        assert tile.size == (64, 64)
+        # the image covers x 10 to 110 and y 10 to 70, a quarter of it with partly covered edge pixels
+        assert np.count_nonzero(np.asarray(tile)[:, :, 3]) == 26 * 16
+
+
+def constant_image(value, size=(80, 60)):
+    return Image.new("RGBA", size, (value, value, value, 255))
+
+
+def test_blend_average(canvas, tmp_path, monkeypatch):
+    monkeypatch.setattr("shared.constants.CONSOLE_PANORAMA_PATH", str(tmp_path) + "/")
+    # content that is already on the canvas counts as one image
+    canvas.paste(constant_image(30), (0, 0))
+    with TiledCompositor(canvas, "average") as compositor:
+        directory = compositor.directory
+        compositor.paste(constant_image(60), (40, 30))
+        compositor.paste(constant_image(90), (40, 30))
+
+    pixels = canvas.crop_array((0, 0, 250, 170))
+    assert (pixels[10, 10] == (30, 30, 30, 255)).all()
+    assert (pixels[40, 50] == (60, 60, 60, 255)).all()
+    assert (pixels[80, 100] == (75, 75, 75, 255)).all()
+    # outside of all images stays transparent
+    assert (pixels[150, 200] == 0).all()
+    assert not (tmp_path / directory).exists()
+
+
+def test_blend_feather(canvas, tmp_path, monkeypatch):
+    monkeypatch.setattr("shared.constants.CONSOLE_PANORAMA_PATH", str(tmp_path) + "/")
+    weights = feather_weights(80, 60)
+    assert weights.shape == (60, 80)
+    assert weights[30, 40] == 1 and weights.min() > 0
+
+    with TiledCompositor(canvas, "feather") as compositor:
+        compositor.paste(constant_image(0), (0, 0))
+        compositor.paste(constant_image(200), (60, 0))
+
+    row = canvas.crop_array((60, 30, 80, 31))[0, :, 0]
+    # the colors change smoothly in the overlap instead of at one seam
+    assert row[0] < 20 and row[-1] > 180
+    assert (np.diff(row.astype(int)) >= 0).all()
+
+
+def test_blend_median(canvas, tmp_path, monkeypatch):
+    monkeypatch.setattr("shared.constants.CONSOLE_PANORAMA_PATH", str(tmp_path) + "/")
+    with TiledCompositor(canvas, "median", layers=3) as compositor:
+        for value in (250, 100, 110, 120, 240):
+            compositor.paste(constant_image(value), (50, 50))
+        # the median is only computed by flush, until then the canvas shows the last image
+        assert (canvas.crop_array((60, 60, 61, 61))[0, 0] == (240, 240, 240, 255)).all()
+        compositor.paste(constant_image(20), (0, 0))
+        compositor.flush()
+        # only the last three images count (110, 120, 240), pixels of the image at (0, 0) have one layer
+        assert (canvas.crop_array((60, 60, 61, 61))[0, 0] == (120, 120, 120, 255)).all()
+        assert (canvas.crop_array((10, 10, 11, 11))[0, 0] == (20, 20, 20, 255)).all()
+        compositor.paste(constant_image(130), (50, 50))
+
+    # only the last three images are kept (120, 240, 130), the outlier among them does not count
+    assert (canvas.crop_array((60, 60, 61, 61))[0, 0] == (130, 130, 130, 255)).all()
+    with pytest.raises(ValueError):
+        TiledCompositor(canvas, "overwrite")
@@ -0,0 +1,185 @@
+import os
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from rift_console.image_processing import stitch_images
+from rift_console.panorama import TiledPanorama
+from rift_console.stitching_job import JobCancelled, JobStatus, StitchingJob
+from shared import constants as con
+from shared.coverage import CoverageIndex
+from shared.models import CameraAngle
+
+
+@pytest.fixture
+def image_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(con, "WORLD_X", 3000)
+    monkeypatch.setattr(con, "WORLD_Y", 2000)
+    monkeypatch.setattr(con, "DO_IMAGE_NUDGING_SEARCH", False)
+    monkeypatch.setattr(con, "SAVE_PANORAMA_STEP", 2)
+    monkeypatch.setattr(con, "CONSOLE_JOBS_PATH", str(tmp_path / "jobs"))
+    monkeypatch.setattr(con, "CONSOLE_TILES_PATH", str(tmp_path / "tiles"))
+    monkeypatch.setattr(con, "CONSOLE_IMAGE_CACHE_PATH", str(tmp_path / "cache"))
+
+    rng = np.random.default_rng(5)
+    image_dir = tmp_path / "images"
+    image_dir.mkdir()
+    for second, (x, y) in enumerate(
+        [(0, 0), (400, 100), (800, 200), (1200, 300), (1600, 400)]
+    ):
+        name = f"image_100_narrow_2025-01-01T10:00:{second:02d}.000000_x_{x}_y_{y}.png"
+        pixels = rng.integers(0, 256, size=(600, 600, 3), dtype=np.uint8)
+        Image.fromarray(pixels).save(image_dir / name)
+    return str(image_dir) + "/"
+
+
+def test_resume_after_interrupt(image_dir, tmp_path):
+    names = sorted(os.listdir(image_dir))
+    output_path = str(tmp_path / "result.png")
+    job = StitchingJob.create(
+        image_path=image_dir,
+        image_name_list=names,
+        output_path=output_path,
+        tile_pyramid=True,
+    )
+
+    # first batch, then the process "dies" with an image on the canvas that is not in the checkpoint
+    panorama = job.open_panorama()
+    job.run_batch(panorama, budget=3)
+    assert job.cursor == 3
+    panorama.paste(Image.new("RGBA", (100, 100), (1, 2, 3, 255)), (3000, 2000))
+    panorama.flush()
+
+    resumed = StitchingJob.load(job.job_id)
+    assert resumed.cursor == 3
+    assert resumed.image_name_list == names
+    resumed.run(budget=3)
+    assert resumed.status == JobStatus.Done
+    assert resumed.placed_count == len(names)
+    assert (tmp_path / "tiles" / "result" / "pyramid.json").is_file()
+    # images placed by run are covered, the first batch was run without the index of the job
+    coverage = CoverageIndex(resumed.coverage_path)
+    assert coverage.fraction_covered((1300, 400, 1700, 800), CameraAngle.Narrow) == 1
+    assert coverage.fraction_covered((100, 100, 500, 500)) == 0
+    assert coverage.fraction_covered((2300, 1100, 2900, 1600)) == 0
+
+    with TiledPanorama(
+        str(tmp_path / "reference"), size=(3000 + 2000, 2000 + 2000)
+    ) as reference:
+        stitch_images(image_path=image_dir, image_name_list=names, panorama=reference)
+        expected = reference.crop_array((1000, 1000, 4000, 3000))
+    with Image.open(output_path) as result:
+        assert np.array_equal(np.asarray(result), expected)
+
+
+def test_cancel(image_dir, tmp_path):
+    names = sorted(os.listdir(image_dir))
+    job = StitchingJob.create(
+        image_path=image_dir,
+        image_name_list=names,
+        output_path=str(tmp_path / "result.png"),
+    )
+
+    # a running job stops at its next checkpoint
+    panorama = job.open_panorama()
+    job.request_cancel()
+    with pytest.raises(JobCancelled):
+        job.run_batch(panorama, budget=3)
+    assert job.cursor == 2
+    assert job.progress == 40
+
+    # a job that was not running yet does not start
+    job.run()
+    assert job.status == JobStatus.Cancelled
+    assert StitchingJob.load(job.job_id).status == JobStatus.Cancelled
+    assert not os.path.exists(tmp_path / "result.png")
+
+
+def test_cancel_removes_blend_buffers(image_dir, tmp_path, monkeypatch):
+    monkeypatch.setattr(con, "BLEND_MODE", "average")
+    monkeypatch.setattr(con, "CONSOLE_PANORAMA_PATH", str(tmp_path / "panorama"))
+    job = StitchingJob.create(
+        image_path=image_dir,
+        image_name_list=sorted(os.listdir(image_dir)),
+        output_path=str(tmp_path / "result.png"),
+    )
+
+    panorama = job.open_panorama()
+    job.request_cancel()
+    with pytest.raises(JobCancelled):
+        job.run_batch(panorama, budget=3)
+    assert os.listdir(tmp_path / "panorama") == []
+
+
+def test_sort_by_overlap_in_worker(image_dir, tmp_path, monkeypatch):
+    monkeypatch.setattr(con, "SORT_IMAGE_BY_OVERLAP", True)
+    names = sorted(os.listdir(image_dir))
+    shuffled = [names[0], names[2], names[1], names[3], names[4]]
+    job = StitchingJob.create(
+        image_path=image_dir,
+        image_name_list=shuffled,
+        output_path=str(tmp_path / "result.png"),
+    )
+    # the order is only computed by the worker
+    assert job.image_name_list == shuffled
+
+    job.run()
+    assert job.status == JobStatus.Done
+    # each image overlaps only the images next to it
+    assert job.image_name_list == names
+    assert StitchingJob.load(job.job_id).image_name_list == names
+
+
+def test_zone_canvas(image_dir, tmp_path, monkeypatch):
+    # high enough for a zone canvas with two borders
+    monkeypatch.setattr(con, "WORLD_Y", 2700)
+    names = sorted(os.listdir(image_dir))
+    zone = (300, 100, 1200, 700)
+    output_path = str(tmp_path / "zone.png")
+    job = StitchingJob.create(
+        image_path=image_dir, image_name_list=names, output_path=output_path, zone=zone
+    )
+    # the images at x 1200 and 1600 do not touch the zone
+    assert job.zone_canvas
+    assert job.image_name_list == names[:3]
+
+    job.run()
+    assert job.status == JobStatus.Done
+    assert not (tmp_path / "tiles" / "zone").exists()
+    with TiledPanorama(
+        str(tmp_path / "reference"), size=(3000 + 2000, 2700 + 2000)
+    ) as reference:
+        stitch_images(image_path=image_dir, image_name_list=names, panorama=reference)
+        expected = reference.crop_array((1300, 1100, 2200, 1700))
+        assert job.zone_coverage == reference.coverage((1300, 1100, 2200, 1700))
+    for path in (output_path, str(tmp_path / "zone_cut.png")):
+        with Image.open(path) as result:
+            assert np.array_equal(np.asarray(result), expected)
+    # the thumbnail keeps the aspect ratio of the zone
+    with Image.open(tmp_path / "zone_thumb.png") as thumb:
+        assert thumb.size == (750, 500)
+
+
+def test_wide_zone_uses_world_canvas(image_dir, tmp_path, monkeypatch):
+    # high enough for a zone canvas with two borders
+    monkeypatch.setattr(con, "WORLD_Y", 2700)
+    names = sorted(os.listdir(image_dir))
+    # wider than the world without two borders, images left of it would wrap into the right border
+    zone = (300, 100, 1500, 700)
+    output_path = str(tmp_path / "zone.png")
+    job = StitchingJob.create(
+        image_path=image_dir, image_name_list=names, output_path=output_path, zone=zone
+    )
+    assert not job.zone_canvas
+    assert job.image_name_list == names
+
+    job.run()
+    assert job.status == JobStatus.Done
+    with TiledPanorama(
+        str(tmp_path / "reference"), size=(3000 + 2000, 2700 + 2000)
+    ) as reference:
+        stitch_images(image_path=image_dir, image_name_list=names, panorama=reference)
+        expected = reference.crop_array((1300, 1100, 2500, 1700))
+    with Image.open(tmp_path / "zone_cut.png") as result:
+        assert np.array_equal(np.asarray(result), expected)